@@ -0,0 +1,146 @@
+"""
+Compares the throughput of the sync views, served WSGI style by a pool of
+threads, with the async views served by a single event loop, on a mix of
+entry, index and search requests against a synthetic wiki.
+
+    python benchmarks/asgi_vs_wsgi.py --entries 2000 --requests 4000 --io-latency 0.005
+
+Each mode runs in its own process, since WIKI_ASYNC_VIEWS is read when the
+URLconf is imported. --io-latency adds a delay to every entry read, to
+model a slow disk or network filesystem.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import generate_wiki, setup_django
+
+
+def request_paths(titles, count, seed=0):
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.8:
+            paths.append(f"/wiki/{rng.choice(titles)}/")
+        elif kind < 0.9:
+            paths.append(f"/?page={rng.randint(1, max(len(titles) // 10, 1))}")
+        else:
+            paths.append(f"/search/?q={rng.choice(['python', 'cache', 'server', 'memory'])}")
+    return paths
+
+
+def slow_down(latency):
+    """
+    Makes every entry read and stat of the filesystem store sleep first.
+    """
+    from encyclopedia.stores import FileSystemEntryStore
+
+    def delayed(method):
+        def wrapper(*args, **kwargs):
+            time.sleep(latency)
+            return method(*args, **kwargs)
+        return wrapper
+
+    for name in ("get", "version", "modified"):
+        setattr(FileSystemEntryStore, name, delayed(getattr(FileSystemEntryStore, name)))
+
+
+def run_wsgi(paths, concurrency):
+    from django.test import Client
+
+    def fetch(path):
+        started = time.perf_counter()
+        Client().get(path)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(fetch, paths))
+
+
+def run_asgi(paths, concurrency):
+    from django.test import AsyncClient
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        client = AsyncClient()
+
+        async def fetch(path):
+            async with semaphore:
+                started = time.perf_counter()
+                await client.get(path)
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(fetch(path) for path in paths))
+
+    return asyncio.run(main())
+
+
+def child(options):
+    setup_django(options.media_root, WIKI_RENDER_CACHE_MAX_BYTES=0)
+    from encyclopedia import util
+
+    if options.io_latency:
+        slow_down(options.io_latency)
+    titles = util.list_entries()
+    paths = request_paths(titles, options.requests)
+    run = run_asgi if options.mode == "asgi" else run_wsgi
+    run(paths[:50], options.concurrency)
+
+    started = time.perf_counter()
+    latencies = sorted(run(paths, options.concurrency))
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "mode": options.mode,
+        "requests": len(paths),
+        "seconds": elapsed,
+        "throughput": len(paths) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="Threads serving WSGI requests, and requests in flight for ASGI.")
+    parser.add_argument("--io-latency", type=float, default=0.0, help="Seconds added to each entry read.")
+    parser.add_argument("--mode", choices=["wsgi", "asgi"], help=argparse.SUPPRESS)
+    parser.add_argument("--media-root", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.mode:
+        return child(options)
+
+    media_root = tempfile.mkdtemp()
+    try:
+        generate_wiki(media_root, options.entries)
+        for mode in ("wsgi", "asgi"):
+            env = dict(os.environ, WIKI_ASYNC_VIEWS="1" if mode == "asgi" else "0")
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--media-root", media_root,
+                 "--requests", str(options.requests), "--concurrency", str(options.concurrency),
+                 "--io-latency", str(options.io_latency)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            print(f"{mode}: {result['throughput']:8.1f} req/s  "
+                  f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms")
+    finally:
+        shutil.rmtree(media_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Helpers shared by the benchmark scripts: configuring Django outside of
+manage.py and generating synthetic wikis.
+"""
+
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = (
+    "the of and to in is for that with as on by it this are from be at or an "
+    "which data code language program system page entry web server python django "
+    "markdown html css git version control function variable memory compiler "
+    "network request response database query index search cache thread process "
+    "file storage template render view model form test library module package"
+).split()
+
+
+def setup_django(media_root, **settings):
+    """
+    Configures Django with the wiki's settings, serving entries from
+    media_root. Extra keyword arguments override settings.
+    """
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wiki.settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+    import django
+    from django.conf import settings as django_settings
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    django_settings.MEDIA_ROOT = media_root
+    django_settings.DEBUG = False
+    for name, value in settings.items():
+        setattr(django_settings, name, value)
+    setup_test_environment()
+
+
+def title_for(number):
+    return f"Entry{number:06d}"
+
+
+def make_entry(rng, title, count, size):
+    """
+    Returns roughly size characters of Markdown for an entry: headings,
+    paragraphs, lists, code blocks and links to other entries.
+    """
+    parts = [f"# {title}\n\n"]
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.1:
+            block = "## " + " ".join(rng.choices(WORDS, k=4)).title() + "\n"
+        elif kind < 0.25:
+            block = "".join(f"* {' '.join(rng.choices(WORDS, k=6))}\n" for _ in range(rng.randint(2, 6)))
+        elif kind < 0.32:
+            block = "```\n" + "".join(f"{rng.choice(WORDS)} = {rng.randint(0, 999)}\n" for _ in range(4)) + "```\n"
+        else:
+            words = rng.choices(WORDS, k=rng.randint(30, 90))
+            for _ in range(rng.randint(0, 2)):
+                other = title_for(rng.randrange(count))
+                words.insert(rng.randrange(len(words)), f"[{other}](/wiki/{other})")
+            block = " ".join(words).capitalize() + ".\n"
+        parts.append(block + "\n")
+        length += len(block) + 1
+    return "".join(parts)
+
+
+def generate_wiki(media_root, count, mean_size=3000, seed=0):
+    """
+    Writes count synthetic entries to media_root/entries, with sizes drawn
+    from a log-normal distribution around mean_size characters, and returns
+    their titles.
+    """
+    rng = random.Random(seed)
+    directory = os.path.join(media_root, "entries")
+    os.makedirs(directory, exist_ok=True)
+    titles = []
+    for number in range(count):
+        title = title_for(number)
+        size = int(rng.lognormvariate(0, 0.8) * mean_size * 0.73)
+        with open(os.path.join(directory, f"{title}.md"), "w", encoding="utf-8") as f:
+            f.write(make_entry(rng, title, count, max(size, 200)))
+        titles.append(title)
+    return titles
@@ -0,0 +1,74 @@
+"""
+Compares the Markdown renderers on the entries/ corpus: the time to
+render each document whole, and for one long document made by joining the
+corpus --scale times, the time until the first chunk is available when
+rendering in chunks.
+
+    python benchmarks/renderers.py --repeat 20 --scale 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from common import ROOT
+
+sys.path.insert(0, ROOT)
+
+from django.core.exceptions import ImproperlyConfigured  # noqa: E402
+
+from encyclopedia.renderers import CommonMarkRenderer, Markdown2Renderer  # noqa: E402
+
+
+def load_corpus(directory):
+    documents = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".md"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                documents.append(f.read())
+    return documents
+
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default=os.path.join(ROOT, "entries"))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scale", type=int, default=200, help="Copies of the corpus in the long document.")
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+    options = parser.parse_args()
+
+    documents = load_corpus(options.directory)
+    corpus_size = sum(len(document) for document in documents)
+    long_document = "\n\n".join(documents * options.scale)
+    print(f"{len(documents)} documents, {corpus_size} characters; "
+          f"long document {len(long_document) / 1e6:.1f}M characters")
+
+    renderers = [Markdown2Renderer()]
+    try:
+        renderers.append(CommonMarkRenderer())
+    except ImproperlyConfigured as e:
+        print(f"Skipping commonmark: {e}")
+
+    for renderer in renderers:
+        corpus = time_call(lambda: [renderer.render(document) for document in documents], options.repeat)
+        whole = time_call(lambda: renderer.render(long_document), 1)
+        first = time_call(lambda: next(renderer.render_chunks(long_document, options.chunk_size)), 1)
+        chunked = time_call(lambda: list(renderer.render_chunks(long_document, options.chunk_size)), 1)
+        print(f"{renderer.name:>10}: corpus {corpus * 1000:8.2f} ms ({corpus_size / corpus / 1e6:5.2f} MB/s)  "
+              f"long document {whole * 1000:9.1f} ms whole, {chunked * 1000:9.1f} ms chunked, "
+              f"first chunk after {first * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
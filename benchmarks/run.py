@@ -0,0 +1,242 @@
+"""
+Benchmarks the entry functions in encyclopedia.util, Markdown rendering and
+every URL in encyclopedia/urls.py against synthetic wikis of each size.
+
+    python benchmarks/run.py --sizes 1000,10000,100000 --output results.json
+    python benchmarks/run.py --baseline results.json
+
+Results are written as JSON. Given a baseline from an earlier run, the
+median of every benchmark is compared with it and the script exits with
+status 1 if any is slower by more than --threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, generate_wiki, setup_django
+
+
+def measure(func, iterations, warmup=1):
+    """
+    Calls func(i) for i in range(iterations), after warmup calls, and
+    returns statistics of the time each call took.
+    """
+    for i in range(warmup):
+        func(i)
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[max(int(len(timings) * 0.95) - 1, 0)] * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "ops_per_sec": iterations / sum(timings) if sum(timings) else None,
+    }
+
+
+def benchmark_util(titles, iterations, rng):
+    import markdown2
+    from encyclopedia import util
+    from encyclopedia.cache import render_cache
+    from encyclopedia.stores import get_store
+
+    store = get_store()
+    picks = [rng.choice(titles) for _ in range(iterations)]
+    contents = [util.get_entry(title) for title in picks]
+    results = {}
+
+    def list_cold(i):
+        if hasattr(store, "catalog"):
+            store.catalog.invalidate()
+        util.list_entries()
+
+    results["list_entries (cold)"] = measure(list_cold, min(iterations, 20))
+    results["list_entries"] = measure(lambda i: util.list_entries(), iterations)
+    results["list_entries (page)"] = measure(
+        lambda i: util.list_entries(rng.randrange(len(titles)), 10), iterations)
+    results["count_entries"] = measure(lambda i: util.count_entries(), iterations)
+    results["random_entry"] = measure(lambda i: util.random_entry(), iterations)
+    results["get_entry"] = measure(lambda i: util.get_entry(picks[i]), iterations)
+    results["markdown2.markdown"] = measure(lambda i: markdown2.markdown(contents[i]), iterations)
+
+    def render_cold(i):
+        render_cache.clear()
+        util.render_entry(picks[i])
+
+    results["render_entry (cold)"] = measure(render_cold, iterations)
+    for title in picks:
+        util.render_entry(title)
+    results["render_entry (cached)"] = measure(lambda i: util.render_entry(picks[i]), iterations)
+    results["save_entry (new)"] = measure(
+        lambda i: util.save_entry(f"Benchmark{i:06d}-{rng.random():.6f}", contents[i]), iterations, warmup=0)
+    results["save_entry (update)"] = measure(
+        lambda i: util.save_entry(picks[i], contents[i] + "\nEdited.\n"), iterations, warmup=0)
+    results["search_entries"] = measure(
+        lambda i: util.search_entries(rng.choice(["python", "cache server", "memory", "templ"])), iterations)
+    return results
+
+
+def benchmark_urls(titles, iterations, rng):
+    from django.test import Client
+    from django.urls import reverse
+
+    client = Client()
+    picks = [rng.choice(titles) for _ in range(iterations)]
+    pages = max(len(titles) // 10, 1)
+    counter = iter(range(10 ** 9))
+
+    requests = {
+        "GET index": lambda i: client.get(reverse("index")),
+        "GET index (page)": lambda i: client.get(reverse("index"), {"page": rng.randint(1, pages)}),
+        "GET entry": lambda i: client.get(reverse("entry", args=[picks[i]])),
+        "GET entry (missing)": lambda i: client.get(reverse("entry", args=["Missing"])),
+        "GET search": lambda i: client.get(reverse("search"), {"q": rng.choice(["python", "cache", "memory"])}),
+        "GET search (exact)": lambda i: client.get(reverse("search"), {"q": picks[i]}),
+        "GET random": lambda i: client.get(reverse("random")),
+        "GET create": lambda i: client.get(reverse("create")),
+        "POST create": lambda i: client.post(reverse("create"), {
+            "title": f"Created{next(counter):06d}", "content": "# Created\n\nSome content."}),
+        "GET edit": lambda i: client.get(reverse("edit", args=[picks[i]])),
+        "POST edit": lambda i: client.post(reverse("edit", args=[picks[i]]), {
+            "title": picks[i], "content": f"# {picks[i]}\n\nEdited {i}."}),
+    }
+    return {name: measure(request, iterations) for name, request in requests.items()}
+
+
+def populate_store(media_root, titles):
+    """
+    Copies the generated entry files into a store that does not keep them
+    as files.
+    """
+    from encyclopedia.stores import get_store
+
+    store = get_store()
+    directory = os.path.join(media_root, "entries")
+    for title in titles:
+        with open(os.path.join(directory, f"{title}.md"), encoding="utf-8") as f:
+            store.save(title, f.read())
+
+
+def run(options):
+    from django.test import override_settings
+
+    results = {}
+    for size in options.sizes:
+        rng = random.Random(size)
+        media_root = tempfile.mkdtemp()
+        try:
+            started = time.perf_counter()
+            titles = generate_wiki(media_root, size)
+            overrides = {"MEDIA_ROOT": media_root}
+            if options.store == "sqlite":
+                overrides["WIKI_ENTRY_STORE"] = {
+                    "BACKEND": "encyclopedia.stores.SQLiteEntryStore",
+                    "OPTIONS": {"path": os.path.join(media_root, "entries.sqlite3")},
+                }
+            with override_settings(**overrides):
+                if options.store == "sqlite":
+                    populate_store(media_root, titles)
+                print(f"{size} entries generated in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+                results[str(size)] = benchmark_util(titles, options.iterations, rng)
+                results[str(size)].update(benchmark_urls(titles, options.iterations, rng))
+        finally:
+            shutil.rmtree(media_root)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change in median time of every benchmark found in both runs
+    and returns the names of those slower by more than threshold.
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, stats in benchmarks.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None or not before["median_ms"]:
+                continue
+            change = stats["median_ms"] / before["median_ms"] - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{size}/{name}")
+            print(f"{size:>7} {name:<24} {before['median_ms']:10.3f} -> {stats['median_ms']:10.3f} ms "
+                  f"{change:+8.1%}{flag}")
+    return regressions
+
+
+def report(results):
+    for size, benchmarks in results.items():
+        for name, stats in benchmarks.items():
+            print(f"{size:>7} {name:<24} median {stats['median_ms']:10.3f} ms  "
+                  f"p95 {stats['p95_ms']:10.3f} ms  {stats['ops_per_sec'] or 0:10.1f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000",
+                        type=lambda value: [int(size) for size in value.split(",")],
+                        help="Comma-separated numbers of entries, e.g. 1000,10000,100000.")
+    parser.add_argument("--iterations", type=int, default=200, help="Calls timed per benchmark.")
+    parser.add_argument("--store", choices=["fs", "sqlite"], default="fs")
+    parser.add_argument("--output", help="File to write the results to as JSON.")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown of the median reported as a regression (default 0.2 = 20%%).")
+    options = parser.parse_args()
+
+    media_root = tempfile.mkdtemp()
+    try:
+        setup_django(media_root)
+        results = run(options)
+    finally:
+        shutil.rmtree(media_root)
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "store": options.store,
+                    "iterations": options.iterations,
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                },
+                "results": results,
+            }, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures the template time of entry pages for the entries/ corpus: the
+time to render entry.html around each entry's (already rendered) HTML,
+with templates compiled on every render, with the cached template loader,
+and with the cached loader and fragment caching.
+
+    python benchmarks/templates.py --repeat 50
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from common import ROOT, setup_django
+
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    options = parser.parse_args()
+
+    setup_django(ROOT)
+
+    from django.template import Engine, RequestContext, engines
+    from django.template.loader import get_template
+    from django.test import RequestFactory
+
+    from encyclopedia import util
+    from encyclopedia.templatetags.fragments import fragment_cache
+    from encyclopedia.views import page_version, rendered_page_version
+
+    request = RequestFactory().get("/")
+    pages = []
+    for title in util.list_entries():
+        backlinks = util.backlinks(title)
+        pages.append({
+            "title": title,
+            "content": util.render_entry(title),
+            "backlinks": backlinks,
+            "fragment_version": rendered_page_version(page_version(util.entry_version(title), backlinks)),
+        })
+    print(f"{len(pages)} entries, {sum(len(page['content']) for page in pages)} characters of HTML")
+
+    # The same engine without the cached loader compiles templates each time
+    engine = engines["django"].engine
+    uncached_engine = Engine(
+        dirs=engine.dirs,
+        context_processors=engine.context_processors,
+        libraries=engine.libraries,
+        loaders=["django.template.loaders.filesystem.Loader", "django.template.loaders.app_directories.Loader"],
+    )
+
+    def uncompiled():
+        for page in pages:
+            uncached_engine.get_template("encyclopedia/entry.html").render(RequestContext(request, page))
+
+    template = get_template("encyclopedia/entry.html")
+
+    def cached():
+        for page in pages:
+            template.render(page, request)
+
+    results = {}
+    fragment_cache.max_bytes = 0
+    results["compiled each time"] = time_call(uncompiled, options.repeat)
+    results["cached loader"] = time_call(cached, options.repeat)
+    fragment_cache.max_bytes = 4 * 1024 * 1024
+    cached()
+    results["cached loader + fragments"] = time_call(cached, options.repeat)
+
+    baseline = results["cached loader"]
+    for name, seconds in results.items():
+        print(f"{name:>26}: {seconds / len(pages) * 1e6:8.1f} us per page "
+              f"({(seconds / baseline - 1) * 100:+6.1f}% vs cached loader)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class EncyclopediaConfig(AppConfig):
     name = 'encyclopedia'
+
+    def ready(self):
+        from . import bus, purge, signals
+
+        signals.entry_saved.connect(purge.purge_entry, dispatch_uid="encyclopedia.purge_entry")
+        signals.entry_saved.connect(bus.publish_entry, dispatch_uid="encyclopedia.publish_entry")
+        signals.entries_saved.connect(bus.publish_entries, dispatch_uid="encyclopedia.publish_entries")
@@ -0,0 +1,191 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.http import StreamingHttpResponse
+from django.utils.http import http_date, quote_etag
+
+from . import compression, util
+from .forms import EditEntryForm, NewEntryForm
+from .views import (
+    cached_entry_page, compress_entry_page, entry_page_parts, metrics, page_version, rate_limited_edit,
+    render, rendered_page_version, should_stream, suggest_limit, suggest_response,
+)
+
+# Async versions of the views in views.py, used instead of them when
+# WIKI_ASYNC_VIEWS is set. Entry I/O is awaited through util's async
+# variants so a single ASGI worker keeps serving while disks are slow.
+
+async def index(request):
+    # Cursor pagination, stable while entries are being added
+    after = request.GET.get('after')
+    if after is not None:
+        entries = await util.alist_entries_after(after, 11)
+        return render(request, "encyclopedia/index.html", {
+            "entries": entries[:10],
+            "next_cursor": entries[9] if len(entries) > 10 else None
+        })
+
+    paginator = Paginator(util.EntryListing(), 10)
+    page_num = request.GET.get('page')
+    page_obj = await util.run_io(paginator.get_page, page_num)
+
+    return render(request, "encyclopedia/index.html", {
+        "entries": page_obj,
+        "page_range": paginator.get_elided_page_range(page_obj.number)
+    })
+
+async def entry(request, title):
+    canonical = await util.aresolve_title(title)
+    if canonical is not None and canonical != title:
+        return redirect("entry", canonical, permanent=True)
+
+    backlinks = await util.abacklinks(title)
+    version = page_version(await util.aentry_version(title), backlinks)
+    last_modified = await util.aentry_modified(title)
+    etag = quote_etag(rendered_page_version(version)) if version is not None else None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+
+    if request.method in ("GET", "HEAD"):
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            return response
+
+    if should_stream(await util.aentry_size(title)):
+        chunks = await util.run_io(util.render_entry_chunks, title)
+        if chunks is not None:
+            head, tail = entry_page_parts(request, title, backlinks, version)
+            response = StreamingHttpResponse(stream(head, chunks, tail))
+            if etag is not None:
+                response["ETag"] = etag
+            if timestamp is not None:
+                response["Last-Modified"] = http_date(timestamp)
+            patch_cache_control(response, **getattr(settings, "WIKI_ENTRY_CACHE_CONTROL", {}))
+            return response
+
+    encoding = compression.choose_encoding(request.headers.get("Accept-Encoding", ""))
+    response = cached_entry_page(title, version, encoding)
+    if response is None:
+        content = await util.arender_entry(title)
+        if (content):
+            response = compress_entry_page(render(request, "encyclopedia/entry.html", {
+                "title": title,
+                "content": content,
+                "backlinks": backlinks,
+                "fragment_version": rendered_page_version(version)
+            }), title, version, encoding)
+    if response is not None:
+        if etag is not None and not response.has_header("ETag"):
+            response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        patch_vary_headers(response, ["Accept-Encoding"])
+        patch_cache_control(response, **getattr(settings, "WIKI_ENTRY_CACHE_CONTROL", {}))
+        return response
+    else:
+        return render(request, "encyclopedia/error.html", {
+            "title": title,
+            "message": "Not Found"
+        })
+
+async def stream(head, chunks, tail):
+    # Reads and renders each piece in the I/O pool
+    yield head
+    while (chunk := await util.run_io(next, chunks, None)) is not None:
+        yield chunk
+    yield tail
+
+async def create(request):
+    if request.method == "POST":
+        form = NewEntryForm(request.POST)
+        if form.is_valid():
+            title = form.cleaned_data["title"]
+            content = form.cleaned_data["content"]
+
+            if (await util.aresolve_title(title)):
+                return render(request, "encyclopedia/create.html", {
+                    "message": "Entry with Title Already Exists!",
+                    "form": form
+                })
+            else:
+                await util.asave_entry(title, content)
+                return redirect("entry", title)
+        else:
+            return render(request, "encyclopedia/create.html", {
+                    "message": form.errors,
+                    "form": form
+                })
+
+    return render(request, "encyclopedia/create.html", {
+            "form": NewEntryForm()
+        })
+
+async def edit(request, title):
+    if request.method == "POST":
+        form = EditEntryForm(request.POST)
+        if form.is_valid():
+            content = form.cleaned_data["content"]
+            try:
+                await util.aedit_entry(title, content, base_revision=form.cleaned_data["revision"])
+            except util.RateLimited as error:
+                return rate_limited_edit(request, title, form, error)
+            except util.EditConflict:
+                data = request.POST.copy()
+                data["revision"] = (await util.alatest_edit(title))[1]
+                return render(request, "encyclopedia/edit.html", {
+                    'title': title,
+                    'message': "This entry was changed while you were editing it. Review the latest version before saving again.",
+                    'form': EditEntryForm(data)
+                }, status=409)
+            return redirect("entry", title)
+        else:
+            return render(request, "encyclopedia/edit.html", {
+                'title': title,
+                'form': form
+            })
+
+    content, revision = await util.alatest_edit(title)
+    return render(request, "encyclopedia/edit.html", {
+            "title": title,
+            "form": EditEntryForm(initial={
+                "title": title,
+                "content": content,
+                "revision": revision
+            })
+        })
+
+async def search(request):
+    query = request.GET.get("q", "")
+
+    title = await util.aresolve_title(query)
+    if (title):
+        return redirect("entry", title)
+
+    paginator = Paginator(await util.asearch_entries(query), 10)
+    page_num = request.GET.get('page')
+    page_obj = await util.run_io(paginator.get_page, page_num)
+
+    return render(request, "encyclopedia/searchResults.html", {
+        "query": query,
+        "no_results": not paginator.count,
+        "entries": page_obj,
+        "page_range": paginator.get_elided_page_range(page_obj.number)
+    })
+
+async def suggest(request):
+    query = request.GET.get("q", "")
+    return suggest_response(query, await util.asuggest_titles(query, suggest_limit(request)))
+
+async def random(request):
+    # Avoid the entries this session was recently sent to, if enabled
+    history = getattr(settings, "WIKI_RANDOM_HISTORY", 0)
+    recent = await sync_to_async(request.session.get)("recent_random", []) if history else []
+
+    entry = await util.arandom_entry(exclude=recent)
+    if entry is None:
+        return redirect("index")
+
+    if history:
+        await sync_to_async(request.session.__setitem__)("recent_random", (recent + [entry])[-history:])
+    return redirect("entry", entry)
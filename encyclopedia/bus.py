@@ -0,0 +1,242 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
+
+from .stores import get_store
+
+
+class Transport:
+    """
+    Base class for cache bus transports: a log of (node, title) messages
+    shared by every process, which each process reads from where it left
+    off. Cursors are opaque JSON values returned by last() and read(),
+    or start, the cursor before every message.
+    """
+
+    start = None
+
+    def publish(self, node, title):
+        raise NotImplementedError
+
+    def last(self):
+        """
+        Returns the cursor of the latest message.
+        """
+        raise NotImplementedError
+
+    def read(self, after):
+        """
+        Returns (cursor, messages) for the (node, title) messages published
+        after the given cursor, with messages None if some of them have
+        already been dropped from the log.
+        """
+        raise NotImplementedError
+
+
+class SQLiteTransport(Transport):
+    """
+    Keeps the messages in a SQLite database in WAL mode, for processes
+    sharing a filesystem. path defaults to cache-bus.sqlite3 in
+    MEDIA_ROOT. Only the latest max_messages messages are kept.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            node TEXT NOT NULL,
+            title TEXT NOT NULL
+        );
+    """
+
+    start = 0
+
+    def __init__(self, path=None, max_messages=10000):
+        if path is None:
+            try:
+                path = default_storage.path("cache-bus.sqlite3")
+            except NotImplementedError:
+                raise ImproperlyConfigured("SQLiteTransport needs a path when MEDIA_ROOT is not local.")
+        self.path = path
+        self.max_messages = max_messages
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+
+    def publish(self, node, title):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = connection.execute("INSERT INTO messages (node, title) VALUES (?, ?)", (node, title))
+            connection.execute("DELETE FROM messages WHERE id <= ?", (cursor.lastrowid - self.max_messages,))
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def last(self):
+        return self._connection().execute("SELECT coalesce(max(id), 0) FROM messages").fetchone()[0]
+
+    def read(self, after):
+        connection = self._connection()
+        rows = connection.execute(
+            "SELECT id, node, title FROM messages WHERE id > ? ORDER BY id", (after,)).fetchall()
+        if not rows:
+            return after, []
+        # Ids are consecutive, so a gap after the cursor means pruned messages
+        if rows[0][0] != after + 1:
+            return rows[-1][0], None
+        return rows[-1][0], [(node, title) for _, node, title in rows]
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+
+class RedisTransport(Transport):
+    """
+    Keeps the messages in a Redis stream, for processes on several hosts.
+    Requires the redis package, and works with any server speaking the
+    Redis protocol with streams. The stream is trimmed to about
+    max_messages messages; processes reading less often than that many
+    saves may miss some.
+    """
+
+    start = "0-0"
+
+    def __init__(self, url="redis://localhost:6379/0", stream="encyclopedia:cache-bus", max_messages=10000):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("RedisTransport requires the redis package.")
+        self.client = redis.Redis.from_url(url)
+        self.stream = stream
+        self.max_messages = max_messages
+
+    def publish(self, node, title):
+        self.client.xadd(self.stream, {"node": node, "title": title},
+                         maxlen=self.max_messages, approximate=True)
+
+    def last(self):
+        entries = self.client.xrevrange(self.stream, count=1)
+        return entries[0][0].decode() if entries else "0-0"
+
+    def read(self, after):
+        streams = self.client.xread({self.stream: after})
+        if not streams:
+            return after, []
+        entries = streams[0][1]
+        return entries[-1][0].decode(), [
+            (fields[b"node"].decode(), fields[b"title"].decode()) for _, fields in entries]
+
+
+class CacheBus:
+    """
+    Tells other processes which entries this one saved, so they drop
+    what they cached about them. Each process reads the messages of the
+    others at most once every poll_interval seconds, from the given
+    cursor or else from the messages published after it was created.
+    """
+
+    def __init__(self, transport, poll_interval=0.1, cursor=None):
+        self.transport = transport
+        self.poll_interval = poll_interval
+        self.node = uuid.uuid4().hex
+        self._cursor = transport.last() if cursor is None else cursor
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Published in place of a title to have the other processes drop
+    # everything they cached, titles are never empty
+    CLEAR = ""
+
+    def publish(self, title):
+        self.transport.publish(self.node, title)
+
+    def publish_clear(self):
+        """
+        Has the other processes drop everything they cached, for changes
+        to too many entries to publish them one by one.
+        """
+        self.transport.publish(self.node, self.CLEAR)
+
+    def due(self):
+        """
+        Returns whether poll() would read the transport.
+        """
+        return time.monotonic() - self._checked_at >= self.poll_interval
+
+    @property
+    def cursor(self):
+        return self._cursor
+
+    def poll(self, force=False):
+        """
+        Returns the set of titles other processes saved since the last
+        poll, or None if too many were saved to tell which or another
+        process asked for every cache to be cleared. Returns an
+        empty set without reading the transport if polled too recently,
+        unless force is given.
+        """
+        if not force and not self.due():
+            return set()
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._cursor, messages = self.transport.read(self._cursor)
+        if messages is None:
+            return None
+        titles = {title for node, title in messages if node != self.node}
+        if self.CLEAR in titles:
+            return None
+        return titles
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus():
+    """
+    Returns the cache bus configured by WIKI_CACHE_BUS for the entry
+    store, or None if there is none.
+    """
+    config = getattr(settings, "WIKI_CACHE_BUS", None)
+    if not config:
+        return None
+    store = get_store()
+    key = (store, store.location, json.dumps(config, sort_keys=True))
+    with _buses_lock:
+        bus = _buses.get(key)
+        if bus is None:
+            transport = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+            bus = _buses[key] = CacheBus(transport, getattr(settings, "WIKI_CACHE_BUS_POLL_INTERVAL", 0.1))
+        return bus
+
+
+def publish_entry(sender, title, **kwargs):
+    """
+    Receiver for entry_saved that publishes the title on the cache bus.
+    """
+    bus = get_bus()
+    if bus is not None:
+        bus.publish(title)
+
+
+def publish_entries(sender, titles, **kwargs):
+    """
+    Receiver for entries_saved that has the other processes clear their
+    caches, with one message for the whole batch.
+    """
+    bus = get_bus()
+    if bus is not None:
+        bus.publish_clear()
@@ -0,0 +1,94 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class RenderCache:
+    """
+    Least-recently-used cache of rendered entry HTML (str, or bytes such
+    as compressed pages), bounded by the total size in bytes of the cached
+    HTML. Each title holds a single version; a lookup with any other
+    version is a miss.
+
+    If WIKI_RENDER_CACHE_ALIAS names a Django cache and shared is set, it
+    is used as a second tier shared between processes.
+    """
+
+    def __init__(self, max_bytes, shared=True):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, title, version):
+        """
+        Returns the cached HTML for the given version of an entry, or None.
+        """
+        with self._lock:
+            cached = self._entries.get(title)
+            if cached is not None and cached[0] == version:
+                self._entries.move_to_end(title)
+                return cached[1]
+
+        shared = _shared_cache() if self.shared else None
+        if shared is not None:
+            html = shared.get(_shared_key(title, version))
+            if html is not None:
+                self._store(title, version, html)
+                return html
+        return None
+
+    def set(self, title, version, html):
+        """
+        Caches the HTML rendered from the given version of an entry.
+        """
+        self._store(title, version, html)
+        shared = _shared_cache() if self.shared else None
+        if shared is not None:
+            shared.set(_shared_key(title, version), html)
+
+    def delete(self, title):
+        """
+        Drops any cached HTML for the entry.
+        """
+        with self._lock:
+            self._discard(title)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _store(self, title, version, html):
+        size = len(html) if isinstance(html, bytes) else len(html.encode("utf-8"))
+        with self._lock:
+            self._discard(title)
+            if size > self.max_bytes:
+                return
+            self._entries[title] = (version, html, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def _discard(self, title):
+        cached = self._entries.pop(title, None)
+        if cached is not None:
+            self.size -= cached[2]
+
+
+def _shared_cache():
+    alias = getattr(settings, "WIKI_RENDER_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+def _shared_key(title, version):
+    digest = hashlib.sha1(title.encode("utf-8")).hexdigest()
+    return f"encyclopedia:html:{digest}:{version}"
+
+
+render_cache = RenderCache(getattr(settings, "WIKI_RENDER_CACHE_MAX_BYTES", 16 * 1024 * 1024))
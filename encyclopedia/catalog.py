@@ -0,0 +1,174 @@
+import bisect
+import heapq
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+
+class EntryCatalog:
+    """
+    Process-wide sorted listing of the entries stored in a directory.
+
+    The listing is kept in memory and only re-read when the directory's
+    modification time changes, which is checked at most once every
+    WIKI_CATALOG_POLL_INTERVAL seconds. Saves made through util.save_entry
+    update the catalog directly, so they are visible immediately.
+
+    The returned lists are shared and replaced (never mutated) on change,
+    callers must not modify them. The lowercase and casefolded views are
+    only built when first asked for after a change.
+    """
+
+    def __init__(self, storage, directory="entries"):
+        self.storage = storage
+        self.directory = directory
+        self.generation = 0
+        self._titles = []
+        self._lowercase = None
+        self._casefolded = None
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def titles(self):
+        """
+        Returns the sorted list of entry titles.
+        """
+        self._poll()
+        return self._titles
+
+    def lowercase(self):
+        """
+        Returns the titles lowercased, in the same order as titles().
+        """
+        return self._view("_lowercase", str.lower)
+
+    def casefolded(self):
+        """
+        Returns the titles casefolded, in the same order as titles().
+        """
+        return self._view("_casefolded", str.casefold)
+
+    def add(self, title, mtime=None):
+        """
+        Records that an entry with the given title has been saved. mtime
+        is directory_mtime() from before it was written: only if the
+        catalog had seen the directory at that time is the save taken as
+        its only change, otherwise the next poll reads the directory.
+        """
+        self.add_many([title], mtime)
+
+    def add_many(self, titles, mtime=None):
+        """
+        Records that entries with the given titles have been saved,
+        merging them into the listing at once. mtime is as for add().
+        """
+        with self._lock:
+            if self._checked_at is None:
+                return
+            new = sorted({title for title in titles if not self._contains(title)})
+            if new:
+                self._set_titles(list(heapq.merge(self._titles, new)))
+            self._seen(mtime)
+
+    def discard(self, title, mtime=None):
+        """
+        Records that the entry with the given title no longer exists.
+        mtime is as for add().
+        """
+        with self._lock:
+            if self._checked_at is None:
+                return
+            index = bisect.bisect_left(self._titles, title)
+            if index < len(self._titles) and self._titles[index] == title:
+                titles = list(self._titles)
+                del titles[index]
+                self._set_titles(titles)
+            self._seen(mtime)
+
+    def invalidate(self):
+        """
+        Forces the listing to be re-read on next access.
+        """
+        with self._lock:
+            self._mtime = None
+            self._checked_at = None
+
+    def directory_mtime(self):
+        """
+        Returns the directory's modification time, or None if the storage
+        is not backed by the local filesystem.
+        """
+        try:
+            return os.stat(self.storage.path(self.directory)).st_mtime_ns
+        except (NotImplementedError, FileNotFoundError):
+            return None
+
+    def _seen(self, mtime):
+        # Changes others made since the last poll are still to be read
+        if mtime is not None and mtime == self._mtime:
+            self._mtime = self.directory_mtime()
+
+    def _contains(self, title):
+        index = bisect.bisect_left(self._titles, title)
+        return index < len(self._titles) and self._titles[index] == title
+
+    def _view(self, name, transform):
+        self._poll()
+        titles, view = self._titles, getattr(self, name)
+        if view is None:
+            view = [transform(title) for title in titles]
+            with self._lock:
+                # Kept only if the titles did not change meanwhile
+                if self._titles is titles:
+                    setattr(self, name, view)
+        return view
+
+    def _poll(self):
+        interval = getattr(settings, "WIKI_CATALOG_POLL_INTERVAL", 1.0)
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            mtime = self.directory_mtime()
+            if mtime is not None and mtime == self._mtime:
+                return
+            self._reload()
+            self._mtime = mtime
+
+    def _reload(self):
+        _, filenames = self.storage.listdir(self.directory)
+        titles = sorted(re.sub(r"\.md$", "", filename)
+                        for filename in filenames if filename.endswith(".md"))
+        if titles != self._titles:
+            self._set_titles(titles)
+
+    def _set_titles(self, titles):
+        self._titles = titles
+        self._lowercase = None
+        self._casefolded = None
+        self.generation += 1
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(storage=default_storage, directory="entries"):
+    """
+    Returns the shared catalog for the given storage directory.
+    """
+    try:
+        key = storage.path(directory)
+    except NotImplementedError:
+        key = (id(storage), directory)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = _catalogs[key] = EntryCatalog(storage, directory)
+        return catalog
@@ -0,0 +1,60 @@
+import gzip
+
+from django.conf import settings
+
+from .cache import RenderCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def available_encodings():
+    """
+    Returns the content codings of WIKI_COMPRESSION_ENCODINGS that can be
+    produced here, in order of preference. Brotli requires the brotli
+    package.
+    """
+    encodings = getattr(settings, "WIKI_COMPRESSION_ENCODINGS", ["br", "gzip"])
+    return [encoding for encoding in encodings if encoding == "gzip" or (encoding == "br" and brotli is not None)]
+
+
+def compress(data, encoding, best=False):
+    """
+    Returns data compressed with a content coding, at the best (slowest)
+    level if best is set, as for files compressed once ahead of time.
+    """
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 5)
+    raise ValueError(f"Unknown content coding {encoding!r}")
+
+
+def choose_encoding(accept_encoding):
+    """
+    Returns the preferred available content coding an Accept-Encoding
+    header allows, or None.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+# Entry pages compressed once per version and content coding, under
+# "<title>/<coding>" keys.
+page_cache = RenderCache(getattr(settings, "WIKI_COMPRESSED_PAGE_CACHE_MAX_BYTES", 8 * 1024 * 1024))
@@ -4,6 +4,14 @@ class NewEntryForm(forms.Form):
     title = forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control'}))
     content = forms.CharField(widget=forms.Textarea(attrs={'class': 'form-control', 'rows': '15'}))
 
+    def clean_title(self):
+        # Titles name files, so they cannot hold path separators
+        title = self.cleaned_data["title"]
+        if "/" in title or "\\" in title or ".." in title:
+            raise forms.ValidationError("Titles cannot contain /, \\ or ..")
+        return title
+
 class EditEntryForm(forms.Form):
     title = forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control', 'readonly': 'readonly'}))
-    content = forms.CharField(widget=forms.Textarea(attrs={'class': 'form-control', 'rows': '15'}))
\ No newline at end of file
+    content = forms.CharField(widget=forms.Textarea(attrs={'class': 'form-control', 'rows': '15'}))
+    revision = forms.IntegerField(widget=forms.HiddenInput, required=False)
\ No newline at end of file
@@ -0,0 +1,147 @@
+import bisect
+import contextvars
+import threading
+import time
+
+# Upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timings = contextvars.ContextVar("wiki_request_timings", default=None)
+
+
+class RequestTimings:
+    """
+    Time spent by one request in each phase. Phases nest without being
+    counted twice: entering one pauses the phase it runs inside of.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self._stack = []
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._add(*self._stack[-1], now)
+        self._stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        self._add(*self._stack.pop(), now)
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def _add(self, name, started, now):
+        self.durations[name] = self.durations.get(name, 0.0) + now - started
+
+
+class phase:
+    """
+    Context manager timing a block as the given phase of the current
+    request, such as "storage" or "markdown". Does nothing outside of a
+    request recorded by InstrumentationMiddleware.
+    """
+
+    __slots__ = ("name", "timings")
+
+    def __init__(self, name):
+        self.name = name
+        self.timings = _timings.get()
+
+    def __enter__(self):
+        if self.timings is not None:
+            self.timings.enter(self.name)
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.exit()
+
+
+def start():
+    """
+    Starts recording the phases of a request in the current context.
+    Returns the RequestTimings and a token to pass to stop().
+    """
+    timings = RequestTimings()
+    return timings, _timings.set(timings)
+
+
+def stop(token):
+    _timings.reset(token)
+
+
+class Histogram:
+    """
+    Cumulative counts of observed durations, in the Prometheus layout.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(view, durations):
+    """
+    Adds the phase durations, in seconds, of a request to the view's
+    histograms.
+    """
+    for name, value in durations.items():
+        key = (view, name)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            with _histograms_lock:
+                histogram = _histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def server_timing(durations):
+    """
+    Returns a Server-Timing header value for the phase durations.
+    """
+    return ", ".join(f"{name};dur={value * 1000:.2f}" for name, value in durations.items())
+
+
+def export():
+    """
+    Returns the histograms of this process in the Prometheus text
+    exposition format.
+    """
+    lines = [
+        "# HELP wiki_request_phase_seconds Time spent by requests in each phase.",
+        "# TYPE wiki_request_phase_seconds histogram",
+    ]
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    for (view, name), histogram in items:
+        counts, total = histogram.snapshot()
+        labels = f'view="{view}",phase="{name}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'wiki_request_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"wiki_request_phase_seconds_sum{{{labels}}} {total}")
+        lines.append(f"wiki_request_phase_seconds_count{{{labels}}} {cumulative}")
+    return "\n".join(lines) + "\n"
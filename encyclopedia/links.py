@@ -0,0 +1,146 @@
+import bisect
+import re
+import threading
+from array import array
+from urllib.parse import unquote
+
+from .titles import normalize_title
+
+# Targets of Markdown links, reference definitions and HTML anchors
+# pointing at /wiki/<title>
+LINK_RE = re.compile(r"""(?:\]\(\s*<?|^ {0,3}\[[^\]\n]+\]:\s*<?|href=["'])/wiki/([^\s)>"'#?]+)""", re.MULTILINE)
+
+
+def extract_links(content):
+    """
+    Returns the set of entry titles a Markdown document links to.
+    """
+    titles = set()
+    for match in LINK_RE.finditer(content):
+        title = unquote(match.group(1)).rstrip("/")
+        if title:
+            titles.add(title)
+    return titles
+
+
+class LinkGraph:
+    """
+    Graph of the links between entries, kept in line with an entry store.
+
+    Titles are numbered once and each entry's outgoing links and backlinks
+    are sorted arrays of those numbers, so a lookup or an edit costs time
+    in proportion to the entries involved. Links to titles that are not
+    entries are kept too, and reported as broken.
+
+    Link targets are resolved to entries with resolve(title), so a link
+    under another case or spelling of a title counts as a backlink of
+    that entry. Without resolve only exact titles of entries count.
+    """
+
+    def __init__(self, store, load, resolve=None):
+        self.store = store
+        self.load = load
+        self.resolve = resolve
+        self._ids = {}
+        self._titles = []
+        self._variants = {}
+        self._links = {}
+        self._backlinks = {}
+        self._sources = set()
+        self._generation = None
+        self._lock = threading.RLock()
+
+    def update(self, title, content):
+        """
+        Records the links of a saved entry, or drops them if content is
+        None.
+        """
+        with self._lock:
+            if self._generation is None:
+                return
+            if content is None:
+                self._sources.discard(title)
+                self._set_links(title, ())
+            else:
+                self._sources.add(title)
+                self._set_links(title, extract_links(content))
+            self._generation = self.store.generation
+
+    def links(self, title):
+        """
+        Returns the sorted titles an entry links to.
+        """
+        with self._lock:
+            self._sync()
+            source = self._ids.get(title)
+            return sorted(self._titles[target] for target in self._links.get(source, ()))
+
+    def backlinks(self, title):
+        """
+        Returns the sorted titles of the entries linking to an entry.
+        """
+        with self._lock:
+            self._sync()
+            sources = set()
+            for target in self._variants.get(normalize_title(title), ()):
+                if target in self._backlinks and self._resolve(self._titles[target]) == title:
+                    sources.update(self._backlinks[target])
+            return sorted(self._titles[source] for source in sources)
+
+    def broken(self):
+        """
+        Returns the sorted (source, target) pairs of links to titles that
+        do not resolve to entries.
+        """
+        with self._lock:
+            self._sync()
+            return sorted((self._titles[source], self._titles[target])
+                          for target, sources in self._backlinks.items()
+                          if self._resolve(self._titles[target]) is None
+                          for source in sources)
+
+    def _resolve(self, title):
+        if self.resolve is not None:
+            return self.resolve(title)
+        return title if title in self._sources else None
+
+    def _sync(self):
+        titles = self.store.titles()
+        generation = self.store.generation
+        if generation == self._generation:
+            return
+        for title in self._sources.difference(titles):
+            self._sources.discard(title)
+            self._set_links(title, ())
+        for title in titles:
+            if title not in self._sources:
+                content = self.load(title)
+                if content is not None:
+                    self._sources.add(title)
+                    self._set_links(title, extract_links(content))
+        self._generation = generation
+
+    def _set_links(self, title, targets):
+        source = self._id(title)
+        new = array("I", sorted(self._id(target) for target in targets))
+        old = self._links.get(source, array("I"))
+        for target in set(old).difference(new):
+            backlinks = self._backlinks[target]
+            del backlinks[bisect.bisect_left(backlinks, source)]
+            if not backlinks:
+                del self._backlinks[target]
+        for target in set(new).difference(old):
+            bisect.insort(self._backlinks.setdefault(target, array("I")), source)
+
+        if new:
+            self._links[source] = new
+        else:
+            self._links.pop(source, None)
+
+    def _id(self, title):
+        title_id = self._ids.get(title)
+        if title_id is None:
+            title_id = self._ids[title] = len(self._titles)
+            self._titles.append(title)
+            self._variants.setdefault(normalize_title(title), []).append(title_id)
+        return title_id
@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+
+
+class Command(BaseCommand):
+    help = "Lists links between entries that point at entries that do not exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print the links as a JSON list of [entry, target].")
+
+    def handle(self, *args, **options):
+        broken = util.broken_links()
+        if options["json"]:
+            self.stdout.write(json.dumps(broken))
+        else:
+            for source, target in broken:
+                self.stdout.write(f"{source} -> {target}")
+        if broken:
+            raise CommandError(f"Found {len(broken)} broken links.")
+        if not options["json"]:
+            self.stdout.write(self.style.SUCCESS("No broken links"))
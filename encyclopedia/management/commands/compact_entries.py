@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia.stores import PackedEntryStore, get_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites the segments of the packed entry store that mostly hold older versions "
+        "of entries or deleted ones, reclaiming their space."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-garbage", type=float, default=0.5,
+            help="Fraction of a segment's bytes that must be older versions for it to be rewritten.",
+        )
+        parser.add_argument(
+            "--train-dictionary", action="store_true",
+            help="Build a new shared compression dictionary from the entries and rewrite every segment with it.",
+        )
+
+    def handle(self, *args, **options):
+        store = get_store()
+        if not isinstance(store, PackedEntryStore):
+            raise CommandError("WIKI_ENTRY_STORE is not a PackedEntryStore.")
+
+        segments, reclaimed = store.log.compact(options["min_garbage"], train=options["train_dictionary"])
+        self.stdout.write(self.style.SUCCESS(f"Rewrote {segments} segments, reclaiming {reclaimed} bytes"))
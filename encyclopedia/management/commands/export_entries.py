@@ -0,0 +1,70 @@
+import gzip
+import io
+import json
+import sys
+import tarfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+
+TAR_MODES = {".tar": "w|", ".tar.gz": "w|gz", ".tgz": "w|gz", ".tar.bz2": "w|bz2", ".tar.xz": "w|xz"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports every entry to a compressed archive that import_entries can read: a "
+        "tarball of entries/<title>.md files, or a JSON Lines file with one entry per "
+        "line ('-' writes JSON Lines to stdout). Entries are written one at a time, so "
+        "the wiki is never held in memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Archive to write: .tar[.gz|.bz2|.xz], .jsonl[.gz] or -.")
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        if output == "-":
+            count = self.write_jsonl(sys.stdout)
+        elif output.endswith(".jsonl.gz"):
+            with gzip.open(output, "wt", encoding="utf-8") as f:
+                count = self.write_jsonl(f)
+        elif output.endswith(".jsonl"):
+            with open(output, "w", encoding="utf-8") as f:
+                count = self.write_jsonl(f)
+        else:
+            mode = next((mode for suffix, mode in TAR_MODES.items() if output.endswith(suffix)), None)
+            if mode is None:
+                raise CommandError(f"Cannot tell the format of {output}, expected a tarball or .jsonl file.")
+            with tarfile.open(output, mode) as archive:
+                count = self.write_tarball(archive)
+
+        if output != "-":
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} entries to {output}"))
+
+    def entries(self):
+        # Titles are listed up front, contents read one at a time
+        for title in list(util.list_entries()):
+            content = util.get_entry(title)
+            if content is not None:
+                yield title, content
+
+    def write_jsonl(self, f):
+        count = 0
+        for title, content in self.entries():
+            f.write(json.dumps({"title": title, "content": content}) + "\n")
+            count += 1
+        return count
+
+    def write_tarball(self, archive):
+        count = 0
+        for title, content in self.entries():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(f"entries/{title}.md")
+            info.size = len(data)
+            modified = util.entry_modified(title)
+            if modified is not None:
+                info.mtime = modified.timestamp()
+            archive.addfile(info, io.BytesIO(data))
+            count += 1
+        return count
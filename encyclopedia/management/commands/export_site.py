@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.template.loader import get_template, render_to_string
+
+from encyclopedia import util
+from encyclopedia.views import page_version, rendered_page_version
+
+MANIFEST = ".manifest.json"
+CHUNK_SIZE = 200
+PAGE_SIZE = 10
+
+
+def write_file(path, data):
+    """
+    Writes a file atomically, so a web server never serves half of it.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.tmp{os.getpid()}"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def render_entries(output, entries):
+    """
+    Renders the pages of the given (title, previous hash) pairs whose
+    content or backlinks have changed. Returns a list of (title, hash,
+    rendered) for the entries that still exist.
+    """
+    results = []
+    for title, previous in entries:
+        content = util.get_entry(title)
+        if content is None:
+            continue
+        backlinks = util.backlinks(title)
+        digest = hashlib.sha256(json.dumps([content, backlinks]).encode("utf-8")).hexdigest()
+        rendered = digest != previous
+        if rendered:
+            html = render_to_string("encyclopedia/entry.html", {
+                "title": title,
+                "content": util.render_entry(title),
+                "backlinks": backlinks,
+                "fragment_version": rendered_page_version(page_version(util.entry_version(title), backlinks))
+            })
+            write_file(os.path.join(output, "wiki", title, "index.html"), html)
+        results.append((title, digest, rendered))
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders every entry, the index pages and a sharded search index into a static "
+        "HTML tree that a web server can serve without Django. Entry pages are written "
+        "to wiki/<title>/index.html and index page N to page/N.html, which nginx can "
+        "serve for /?page=N with: try_files /page/$arg_page.html /index.html. Only "
+        "entries whose content or backlinks changed since the last export are rendered again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", nargs="?", default="site", help="Directory to write the site to.")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(),
+            help="Number of processes rendering entries, 1 renders in this process.",
+        )
+        parser.add_argument("--force", action="store_true", help="Render every entry again.")
+
+    def handle(self, *args, **options):
+        output = os.path.abspath(options["output"])
+        manifest_path = os.path.join(output, MANIFEST)
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+
+        templates = self.templates_fingerprint()
+        previous = manifest.get("entries", {})
+        if options["force"] or manifest.get("templates") != templates:
+            previous = {}
+
+        titles = list(util.list_entries())
+        chunks = [[(title, previous.get(title)) for title in titles[start:start + CHUNK_SIZE]]
+                  for start in range(0, len(titles), CHUNK_SIZE)]
+        if options["workers"] > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(options["workers"], initializer=django.setup) as executor:
+                results = [result for chunk in executor.map(render_entries, [output] * len(chunks), chunks)
+                           for result in chunk]
+        else:
+            results = [result for chunk in chunks for result in render_entries(output, chunk)]
+
+        entries = {title: digest for title, digest, _ in results}
+        for title in set(manifest.get("entries", {})).difference(entries):
+            shutil.rmtree(os.path.join(output, "wiki", title), ignore_errors=True)
+
+        rendered = sum(1 for _, _, changed in results if changed)
+        if rendered or entries.keys() != manifest.get("entries", {}).keys() or not previous:
+            self.export_index_pages(output, sorted(entries))
+            self.export_search(output)
+
+        manifest = {"templates": templates, "entries": entries}
+        write_file(manifest_path, json.dumps(manifest))
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {len(entries)} entries to {output} ({rendered} rendered)"))
+
+    def templates_fingerprint(self):
+        digest = hashlib.sha256()
+        for name in ["encyclopedia/layout.html", "encyclopedia/entry.html", "encyclopedia/index.html"]:
+            with open(get_template(name).origin.name, "rb") as f:
+                digest.update(f.read())
+        # Entries rendered by another Markdown renderer are rendered again
+        digest.update(util.get_renderer().key.encode("utf-8"))
+        return digest.hexdigest()
+
+    def export_index_pages(self, output, titles):
+        paginator = Paginator(titles, PAGE_SIZE)
+        for number in paginator.page_range:
+            page = paginator.page(number)
+            html = render_to_string("encyclopedia/index.html", {
+                "entries": page,
+                "page_range": paginator.get_elided_page_range(number)
+            })
+            write_file(os.path.join(output, "page", f"{number}.html"), html)
+            if number == 1:
+                write_file(os.path.join(output, "index.html"), html)
+
+    def export_search(self, output):
+        """
+        Writes search/documents.json, with the title and length of each
+        document, and one search/<shard>.json per first character of the
+        indexed terms, mapping each term to its [document, frequency] pairs.
+        """
+        directory = os.path.join(output, "search")
+        shutil.rmtree(directory, ignore_errors=True)
+        documents, postings = util.get_search().index().export()
+        write_file(os.path.join(directory, "documents.json"), json.dumps({
+            "titles": [title for title, _ in documents],
+            "lengths": [length for _, length in documents],
+        }))
+        shard, terms = None, {}
+        for term, term_postings in postings:
+            key = format(ord(term[0]), "x")
+            if key != shard and terms:
+                write_file(os.path.join(directory, f"{shard}.json"), json.dumps(terms))
+                terms = {}
+            shard = key
+            terms[term] = term_postings
+        if terms:
+            write_file(os.path.join(directory, f"{shard}.json"), json.dumps(terms))
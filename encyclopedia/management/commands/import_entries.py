@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+import sys
+import tarfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def read_directory(path):
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".md"):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                yield name[:-3], f.read()
+
+
+def read_tarball(path):
+    # Read as a stream, so members are never all held in memory
+    with tarfile.open(path, mode="r|*") as archive:
+        for member in archive:
+            name = os.path.basename(member.name)
+            if member.isfile() and name.endswith(".md"):
+                yield name[:-3], archive.extractfile(member).read().decode("utf-8")
+
+
+def read_jsonl(f):
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            yield record["title"], record["content"]
+        except (ValueError, KeyError, TypeError):
+            raise CommandError(f"Line {number} is not a JSON object with a title and content.")
+
+
+def read_jsonl_file(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        yield from read_jsonl(f)
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports entries in bulk from a directory of .md files, a tarball of them or a "
+        "JSON Lines file of {\"title\": ..., \"content\": ...} objects ('-' reads JSON Lines "
+        "from stdin). Entries are written in batches and the search index is rebuilt once "
+        "at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Directory, .tar[.gz|.bz2|.xz] or .jsonl[.gz] file, or -.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Entries written per batch.")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(),
+            help="Processes rendering Markdown ahead, for stores that keep the HTML.",
+        )
+        parser.add_argument("--skip-existing", action="store_true", help="Leave existing entries unchanged.")
+
+    def handle(self, *args, **options):
+        existing = set(util.list_entries()) if options["skip_existing"] else set()
+        skipped = []
+
+        def entries():
+            for title, content in self.read(options["source"]):
+                if not title or "/" in title or "\\" in title:
+                    raise CommandError(f"Invalid entry title {title!r}.")
+                if title in existing:
+                    skipped.append(title)
+                    continue
+                yield title, content
+
+        saved = util.save_entries(entries(), batch_size=options["batch_size"], workers=options["workers"])
+        self.stdout.write(self.style.SUCCESS(f"Imported {saved} entries ({len(skipped)} skipped)"))
+
+    def read(self, source):
+        if source == "-":
+            return read_jsonl(sys.stdin)
+        if os.path.isdir(source):
+            return read_directory(source)
+        if not os.path.exists(source):
+            raise CommandError(f"{source} does not exist.")
+        if source.endswith(TAR_SUFFIXES):
+            return read_tarball(source)
+        if source.endswith((".jsonl", ".jsonl.gz")):
+            return read_jsonl_file(source)
+        raise CommandError(f"Cannot tell the format of {source}, expected a directory, tarball or .jsonl file.")
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+from encyclopedia.bus import CacheBus, get_bus
+from encyclopedia.workqueue import RenderQueue
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders entries saved by the web processes ahead of their first view, as they "
+        "are published on the cache bus (WIKI_CACHE_BUS). Run it with WIKI_RENDER_QUEUE "
+        "set to 'worker' and either a WIKI_RENDER_CACHE_ALIAS shared with the web "
+        "processes or a store that keeps the HTML. The worker carries on from where it "
+        "last stopped reading the bus, or from the start of the bus the first time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=getattr(settings, "WIKI_RENDER_QUEUE_WORKERS", 1),
+            help="Threads rendering entries.",
+        )
+        parser.add_argument("--once", action="store_true", help="Render the entries published so far and exit.")
+        parser.add_argument(
+            "--cursor-file",
+            help="File keeping how far the bus was read, render-worker.cursor in MEDIA_ROOT by default.",
+        )
+
+    def handle(self, *args, **options):
+        shared = get_bus()
+        if shared is None:
+            raise CommandError("WIKI_CACHE_BUS is not set.")
+        cursor_file = options["cursor_file"]
+        if cursor_file is None:
+            try:
+                cursor_file = default_storage.path("render-worker.cursor")
+            except NotImplementedError:
+                raise CommandError("--cursor-file is needed when MEDIA_ROOT is not local.")
+        bus = CacheBus(shared.transport, shared.poll_interval, self.read_cursor(cursor_file, shared.transport))
+
+        queue = RenderQueue(
+            util.warm_entry,
+            workers=options["workers"],
+            max_pending=getattr(settings, "WIKI_RENDER_QUEUE_MAX_PENDING", 1000),
+        )
+        while True:
+            # Poll the bus as often as the web processes do
+            cursor = bus.cursor
+            titles = bus.poll(force=True)
+            if titles is None:
+                self.stderr.write(
+                    "Missed entries saved in bulk or while the bus was not read, they render on first view.")
+                titles = ()
+            for title in titles:
+                queue.enqueue(title)
+            if bus.cursor != cursor:
+                self.write_cursor(cursor_file, bus.cursor)
+            if options["once"]:
+                break
+            time.sleep(bus.poll_interval or 0.1)
+
+        queue.join()
+        counts = queue.counts
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {counts['completed']} entries ({counts['failed']} failed, {counts['dropped']} dropped)"))
+
+    def read_cursor(self, path, transport):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return transport.start
+
+    def write_cursor(self, path, cursor):
+        # Written atomically, titles queued but not rendered when the
+        # worker stops are rendered on first view
+        temporary = f"{path}.tmp{os.getpid()}"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(cursor, f)
+        os.replace(temporary, path)
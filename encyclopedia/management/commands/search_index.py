@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+from encyclopedia.search import IndexFile
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the persistent full-text search index, or verifies it against the entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Check the index file instead of rebuilding it.",
+        )
+
+    def handle(self, *args, **options):
+        search = util.get_search()
+        if not search.path:
+            raise CommandError("WIKI_SEARCH_INDEX_FILE is not set or the storage has no local path.")
+
+        if not options["verify"]:
+            index = search.rebuild()
+            self.stdout.write(self.style.SUCCESS(f"Indexed {len(index)} entries into {search.path}"))
+            return
+
+        try:
+            index_file = IndexFile(search.path)
+        except (FileNotFoundError, ValueError) as e:
+            raise CommandError(f"Cannot load the index: {e}")
+
+        problems = index_file.verify()
+        indexed = {index_file.title(doc_id): index_file.version(doc_id)
+                   for doc_id in range(index_file.doc_count)}
+        entries = util.list_entries()
+        pending = search.journal_titles()
+        for title in entries:
+            if title not in indexed:
+                if title not in pending:
+                    problems.append(f"{title!r} is not indexed")
+            elif indexed[title] != (util.entry_version(title) or "") and title not in pending:
+                problems.append(f"{title!r} has changed since it was indexed")
+        for title in set(indexed).difference(entries):
+            problems.append(f"{title!r} is indexed but no longer exists")
+        index_file.close()
+
+        for problem in problems:
+            self.stderr.write(problem)
+        if problems:
+            raise CommandError(f"Found {len(problems)} problems, run search_index to rebuild the index.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Index of {len(indexed)} entries is valid ({len(pending)} journaled changes pending)"))
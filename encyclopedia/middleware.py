@@ -0,0 +1,111 @@
+import cProfile
+import os
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import instrumentation, util
+from .bus import get_bus
+
+
+class InstrumentationMiddleware:
+    """
+    Records how long each request spends on entry storage, Markdown,
+    search and templates, returns it in a Server-Timing header and adds it
+    to the histograms served by the metrics view. Enabled by
+    WIKI_INSTRUMENTATION.
+
+    A WIKI_PROFILE_SAMPLE_RATE fraction of sync requests is also run
+    under cProfile, with the stats dumped to WIKI_PROFILE_DIR.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "WIKI_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "WIKI_PROFILE_SAMPLE_RATE", 0.0)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        timings, token = instrumentation.start()
+        profiler = None
+        if self.sample_rate and random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            instrumentation.stop(token)
+        self.record(request, response, timings)
+        if profiler is not None:
+            self.dump(request, profiler)
+        return response
+
+    async def __acall__(self, request):
+        timings, token = instrumentation.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            instrumentation.stop(token)
+        self.record(request, response, timings)
+        return response
+
+    def record(self, request, response, timings):
+        durations = dict(timings.durations)
+        durations["total"] = timings.total()
+        instrumentation.observe(self.view_name(request), durations)
+        response["Server-Timing"] = instrumentation.server_timing(durations)
+
+    def dump(self, request, profiler):
+        directory = getattr(settings, "WIKI_PROFILE_DIR", "profiles")
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.view_name(request)}-{os.getpid()}-{id(profiler):x}.prof"
+        profiler.dump_stats(os.path.join(directory, name))
+
+    def view_name(self, request):
+        match = getattr(request, "resolver_match", None)
+        return (match.url_name or match.view_name) if match else "unresolved"
+
+
+class CacheBusMiddleware:
+    """
+    Drops what this process cached about entries that other processes
+    saved, as published on the cache bus, before handling each request.
+    Enabled by WIKI_CACHE_BUS.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "WIKI_CACHE_BUS", None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        util.sync_caches()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        bus = get_bus()
+        if bus is not None and bus.due():
+            await util.run_io(util.sync_caches)
+        return await self.get_response(request)
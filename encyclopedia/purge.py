@@ -0,0 +1,35 @@
+import logging
+import threading
+import urllib.request
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+
+def purge_entry(sender, title, **kwargs):
+    """
+    Receiver for entry_saved that asks every reverse proxy listed in
+    WIKI_PURGE_URLS to drop its copy of the entry's page, in the
+    background so that saving is not held up by the proxies.
+    """
+    proxies = getattr(settings, "WIKI_PURGE_URLS", [])
+    if not proxies:
+        return
+    path = reverse("entry", args=[title])
+    urls = [urljoin(proxy, path) for proxy in proxies]
+    threading.Thread(target=purge, args=(urls,), daemon=True).start()
+
+
+def purge(urls):
+    """
+    Sends a PURGE request for each URL, logging failures.
+    """
+    timeout = getattr(settings, "WIKI_PURGE_TIMEOUT", 5)
+    for url in urls:
+        try:
+            urllib.request.urlopen(urllib.request.Request(url, method="PURGE"), timeout=timeout).close()
+        except OSError as e:
+            logger.warning("Could not purge %s: %s", url, e)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import re
+import threading
+
+import markdown2
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+_fence = re.compile(r" {0,3}(```|~~~)")
+_reference = re.compile(r" {0,3}\[[^\]]+\]:\s*\S")
+
+
+class Renderer:
+    """
+    Base class for the engines converting entry Markdown to HTML.
+    """
+
+    name = None
+
+    def __init__(self, **options):
+        self.options = options
+        self.key = self.name
+        if options:
+            digest = hashlib.sha1(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()
+            self.key = f"{self.name}-{digest[:8]}"
+
+    def render(self, text):
+        """
+        Returns the HTML for a Markdown document.
+        """
+        raise NotImplementedError
+
+    def render_chunks(self, text, chunk_size):
+        """
+        Yields the HTML for a Markdown document in pieces, each rendered
+        from at least chunk_size characters of it, so that the start of a
+        long document is available before the rest has been rendered.
+        text is a string or an iterable of lines.
+
+        Documents are only split before headings outside of code blocks.
+        Link reference definitions apply to the pieces that follow them.
+        """
+        lines = text.splitlines(keepends=True) if isinstance(text, str) else text
+        chunk, size, fence, references = [], 0, None, []
+        previous_blank = True
+        for line in lines:
+            marker = _fence.match(line)
+            if marker and (fence is None or marker.group(1) == fence):
+                fence = marker.group(1) if fence is None else None
+            elif fence is None:
+                if line.startswith("#") and previous_blank and size >= chunk_size:
+                    yield self.render("".join(chunk + references))
+                    chunk, size = [], 0
+                if _reference.match(line):
+                    references.append(line if line.endswith("\n") else line + "\n")
+            chunk.append(line)
+            size += len(line)
+            previous_blank = not line.strip()
+        if chunk:
+            yield self.render("".join(chunk + references))
+
+
+class Markdown2Renderer(Renderer):
+    """
+    Renders with markdown2. Options are passed to markdown2.Markdown, e.g.
+    {"extras": ["tables"]}.
+    """
+
+    name = "markdown2"
+
+    def render(self, text):
+        # A converter is not reused, as reset() keeps some of its tables
+        # growing from one document to the next
+        return str(markdown2.Markdown(**self.options).convert(text))
+
+
+class CommonMarkRenderer(Renderer):
+    """
+    Renders CommonMark with markdown-it-py, which is faster than markdown2
+    and follows the CommonMark spec. Options are passed to MarkdownIt,
+    e.g. {"config": "gfm-like"}.
+    """
+
+    name = "commonmark"
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        try:
+            from markdown_it import MarkdownIt
+        except ImportError:
+            raise ImproperlyConfigured("CommonMarkRenderer requires the markdown-it-py package.")
+        self._markdown_it = MarkdownIt
+        self._local = threading.local()
+
+    def render(self, text):
+        parser = getattr(self._local, "parser", None)
+        if parser is None:
+            options = dict(self.options)
+            parser = self._local.parser = self._markdown_it(options.pop("config", "commonmark"), options)
+        return parser.render(text)
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer():
+    """
+    Returns the Markdown renderer configured by WIKI_MARKDOWN_RENDERER.
+    """
+    config = getattr(settings, "WIKI_MARKDOWN_RENDERER", {})
+    backend = config.get("BACKEND", "encyclopedia.renderers.Markdown2Renderer")
+    options = config.get("OPTIONS", {})
+    key = (backend, json.dumps(options, sort_keys=True))
+    with _renderers_lock:
+        renderer = _renderers.get(key)
+        if renderer is None:
+            renderer = _renderers[key] = import_string(backend)(**options)
+        return renderer
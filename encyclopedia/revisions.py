@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from difflib import SequenceMatcher
+from urllib.parse import quote
+
+# Every SNAPSHOT_INTERVAL-th revision, starting with the first, stores the
+# full content instead of a delta, so rebuilding any revision reads at most
+# SNAPSHOT_INTERVAL records. So does the first revision recorded for an
+# entry that existed before its history was kept.
+SNAPSHOT_INTERVAL = 20
+
+
+class EditConflict(Exception):
+    """
+    Raised when an entry is saved on top of a revision that is no longer
+    its latest one.
+    """
+
+    def __init__(self, title, revision):
+        super().__init__(f"{title!r} has been changed since revision {revision}")
+        self.title = title
+        self.revision = revision
+
+
+def make_delta(old, new):
+    """
+    Returns a compact JSON-serializable description of how to turn old into
+    new, line by line: positive integers copy lines of old, negative ones
+    skip them and lists of strings are inserted.
+    """
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    delta = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            delta.append(i2 - i1)
+            continue
+        if i2 > i1:
+            delta.append(i1 - i2)
+        if j2 > j1:
+            delta.append(b[j1:j2])
+    return delta
+
+
+def apply_delta(old, delta):
+    """
+    Returns the text produced by applying a delta from make_delta to old.
+    """
+    lines = old.splitlines(keepends=True)
+    result = []
+    position = 0
+    for op in delta:
+        if isinstance(op, list):
+            result.extend(op)
+        elif op > 0:
+            result.extend(lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return "".join(result)
+
+
+def is_snapshot(revision):
+    return (revision - 1) % SNAPSHOT_INTERVAL == 0
+
+
+def make_record(revision, previous, content):
+    """
+    Returns the record stored for a revision, given the content of the
+    revision before it, or None if it is the first one recorded.
+    """
+    record = {"revision": revision, "timestamp": time.time()}
+    if previous is None or is_snapshot(revision):
+        record["content"] = content
+    else:
+        record["delta"] = make_delta(previous, content)
+    return record
+
+
+def replay(records):
+    """
+    Returns the content of the last of a run of records starting with a
+    snapshot.
+    """
+    content = ""
+    for record in records:
+        if "content" in record:
+            content = record["content"]
+        else:
+            content = apply_delta(content, record["delta"])
+    return content
+
+
+class RevisionLog:
+    """
+    Append-only revision history of entries kept in a local directory,
+    with one subdirectory per entry and one file per revision. Titles are
+    percent-encoded into a single directory name, which leaves most of
+    them unchanged.
+
+    A revision is claimed by hard-linking its fully written record into
+    place, which fails if another writer got there first. Concurrent
+    saves therefore never overwrite each other and need no lock.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def head(self, title):
+        """
+        Returns the latest revision number of an entry, or 0.
+        """
+        try:
+            names = os.listdir(self._path(title))
+        except FileNotFoundError:
+            return 0
+        return max((int(name) for name in names if name.isdigit()), default=0)
+
+    def append(self, title, revision, previous, content):
+        """
+        Records content as the given revision of an entry, previous being
+        the content of the revision before. Raises EditConflict if that
+        revision has already been recorded.
+        """
+        directory = self._path(title)
+        os.makedirs(directory, exist_ok=True)
+        temporary = os.path.join(directory, f".{os.getpid()}-{threading.get_ident()}.tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(make_record(revision, previous, content), f)
+        try:
+            os.link(temporary, os.path.join(directory, str(revision)))
+        except FileExistsError:
+            raise EditConflict(title, revision - 1)
+        finally:
+            os.remove(temporary)
+
+    def content(self, title, revision):
+        """
+        Returns the content of an entry at the given revision.
+        """
+        start = revision - (revision - 1) % SNAPSHOT_INTERVAL
+        return replay(self._read(title, number) for number in range(start, revision + 1))
+
+    def history(self, title):
+        """
+        Returns a list of {"revision", "timestamp"} dicts, oldest first.
+        """
+        return [{"revision": number, "timestamp": self._read(title, number)["timestamp"]}
+                for number in range(1, self.head(title) + 1)]
+
+    def _read(self, title, revision):
+        with open(os.path.join(self._path(title), str(revision)), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _path(self, title):
+        # Separators, "%" and a leading dot (as in "..") are encoded
+        name = quote(title, safe=" !$&'()+,;=@[]^`{}~")
+        if name.startswith("."):
+            name = "%2E" + name[1:]
+        return os.path.join(self.directory, name)
@@ -0,0 +1,648 @@
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from itertools import accumulate
+
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+TOKEN_RE = re.compile(r"\w+")
+MARKUP_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)|[#*_`>~|]+")
+
+
+def tokenize(text):
+    """
+    Splits text into casefolded word tokens.
+    """
+    return [token.casefold() for token in TOKEN_RE.findall(text)]
+
+
+class _Column:
+    """
+    Read-only sequence view over a table in an index file, so that the
+    bisect module can search it without loading it.
+    """
+
+    def __init__(self, length, getter):
+        self._length = length
+        self._getter = getter
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return self._getter(index)
+
+
+class IndexFile:
+    """
+    Read-only search index stored on disk and memory-mapped, so that
+    every process loading the same file shares its pages and startup
+    does not depend on the size of the wiki.
+
+    The file holds a header, a document table sorted by title (so the
+    document id is the title's rank), a term table sorted by term, a
+    string pool and the postings. The postings of each term are two
+    arrays, the gaps between consecutive document ids and the term
+    frequencies, each stored with the smallest integer type that fits.
+    """
+
+    MAGIC = b"WIKISRCH"
+    FORMAT = 1
+    HEADER = struct.Struct("<8sIIIQQQQQ")
+    DOC = struct.Struct("<IIIII")
+    TERM = struct.Struct("<IIIQ")
+    TYPECODES = "BHI"
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.doc_count, self.term_count, self.total_length,
+         self._docs, self._terms, self._strings, self._postings) = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC or version != self.FORMAT:
+            self._map.close()
+            raise ValueError(f"{path} is not a search index file")
+        self.titles = _Column(self.doc_count, self.title)
+        self.terms = _Column(self.term_count, self.term)
+
+    def close(self):
+        self._map.close()
+
+    def title(self, doc_id):
+        offset, length, _, _, _ = self.DOC.unpack_from(self._map, self._docs + doc_id * self.DOC.size)
+        return self._string(offset, length)
+
+    def version(self, doc_id):
+        _, _, offset, length, _ = self.DOC.unpack_from(self._map, self._docs + doc_id * self.DOC.size)
+        return self._string(offset, length)
+
+    def length(self, doc_id):
+        return self.DOC.unpack_from(self._map, self._docs + doc_id * self.DOC.size)[4]
+
+    def find(self, title):
+        """
+        Returns the document id of the given title, or None.
+        """
+        doc_id = bisect.bisect_left(self.titles, title)
+        if doc_id < self.doc_count and self.title(doc_id) == title:
+            return doc_id
+        return None
+
+    def term(self, term_id):
+        offset, length, _, _ = self.TERM.unpack_from(self._map, self._terms + term_id * self.TERM.size)
+        return self._string(offset, length)
+
+    def find_term(self, term):
+        """
+        Returns the id of the first term greater than or equal to term.
+        """
+        return bisect.bisect_left(self.terms, term)
+
+    def postings(self, term_id):
+        """
+        Returns the (document ids, term frequencies) of a term.
+        """
+        _, _, count, offset = self.TERM.unpack_from(self._map, self._terms + term_id * self.TERM.size)
+        offset += self._postings
+        gaps = array(self._map[offset:offset + 1].decode())
+        frequencies = array(self._map[offset + 1:offset + 2].decode())
+        offset += 2
+        end = offset + count * gaps.itemsize
+        gaps.frombytes(self._map[offset:end])
+        frequencies.frombytes(self._map[end:end + count * frequencies.itemsize])
+        if sys.byteorder == "big":
+            gaps.byteswap()
+            frequencies.byteswap()
+        return list(accumulate(gaps)), frequencies
+
+    def verify(self):
+        """
+        Checks the file's internal consistency and returns a list of
+        problems found.
+        """
+        problems = []
+        titles = [self.title(doc_id) for doc_id in range(self.doc_count)]
+        if any(a >= b for a, b in zip(titles, titles[1:])):
+            problems.append("document titles are not sorted")
+        if sum(self.length(doc_id) for doc_id in range(self.doc_count)) != self.total_length:
+            problems.append("document lengths do not add up to the total length")
+        previous = None
+        for term_id in range(self.term_count):
+            term = self.term(term_id)
+            if previous is not None and previous >= term:
+                problems.append(f"term {term!r} is out of order")
+            previous = term
+            try:
+                doc_ids, frequencies = self.postings(term_id)
+            except (ValueError, TypeError) as e:
+                problems.append(f"postings of {term!r} are corrupt: {e}")
+                continue
+            if any(a >= b for a, b in zip(doc_ids, doc_ids[1:])) or \
+                    (doc_ids and doc_ids[-1] >= self.doc_count) or 0 in frequencies:
+                problems.append(f"postings of {term!r} are invalid")
+        return problems
+
+    def _string(self, offset, length):
+        start = self._strings + offset
+        return self._map[start:start + length].decode("utf-8")
+
+    @classmethod
+    def write(cls, path, documents, postings, total_length):
+        """
+        Writes an index file atomically. documents is a list of (title,
+        version, length) sorted by title and postings an iterable of
+        (term, [(doc_id, frequency), ...]) sorted by term.
+        """
+        strings = bytearray()
+        doc_table = bytearray()
+        for title, version, length in documents:
+            title, version = title.encode("utf-8"), (version or "").encode("utf-8")
+            doc_table += cls.DOC.pack(len(strings), len(title), len(strings) + len(title), len(version), length)
+            strings += title + version
+
+        term_table = bytearray()
+        blob = bytearray()
+        term_count = 0
+        for term, term_postings in postings:
+            term = term.encode("utf-8")
+            term_table += cls.TERM.pack(len(strings), len(term), len(term_postings), len(blob))
+            strings += term
+            doc_ids = [doc_id for doc_id, _ in term_postings]
+            gaps = [doc_id - previous for doc_id, previous in zip(doc_ids, [0] + doc_ids[:-1])]
+            frequencies = [frequency for _, frequency in term_postings]
+            gaps, frequencies = cls._pack(gaps), cls._pack(frequencies)
+            blob += gaps.typecode.encode() + frequencies.typecode.encode()
+            if sys.byteorder == "big":
+                gaps.byteswap()
+                frequencies.byteswap()
+            blob += gaps.tobytes() + frequencies.tobytes()
+            term_count += 1
+
+        docs = cls.HEADER.size
+        terms = docs + len(doc_table)
+        strings_offset = terms + len(term_table)
+        postings_offset = strings_offset + len(strings)
+        header = cls.HEADER.pack(cls.MAGIC, cls.FORMAT, len(documents), term_count, total_length,
+                                 docs, terms, strings_offset, postings_offset)
+        temporary = f"{path}.tmp{os.getpid()}"
+        with open(temporary, "wb") as f:
+            f.write(header)
+            f.write(doc_table)
+            f.write(term_table)
+            f.write(strings)
+            f.write(blob)
+        os.replace(temporary, path)
+
+    @classmethod
+    def _pack(cls, values):
+        largest = max(values, default=0)
+        for typecode in cls.TYPECODES:
+            if largest < 1 << (8 * array(typecode).itemsize):
+                return array(typecode, values)
+        raise OverflowError("posting value too large")
+
+
+class SearchIndex:
+    """
+    Inverted index over entry titles and Markdown bodies.
+
+    Documents are ranked with BM25. Title tokens are counted TITLE_WEIGHT
+    times so that entries named after a query term rank first. Each query
+    term also matches up to MAX_PREFIX_EXPANSIONS indexed terms it is a
+    prefix of, at PREFIX_WEIGHT of the score of an exact match.
+
+    The index can be layered over a read-only IndexFile. Entries added
+    or removed afterwards are kept in memory and mask the file's copy.
+    Document frequencies then also count masked copies, which slightly
+    skews scores until the file is rewritten.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    TITLE_WEIGHT = 3
+    PREFIX_WEIGHT = 0.5
+    MAX_PREFIX_EXPANSIONS = 50
+
+    def __init__(self, base=None):
+        self.base = base
+        self._base_count = base.doc_count if base is not None else 0
+        self._masked = set()
+        self._masked_length = 0
+        self._ids = {}
+        self._titles = []
+        self._lengths = []
+        self._terms_by_doc = []
+        self._free_ids = []
+        self._postings = {}
+        self._vocabulary = []
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._base_count - len(self._masked) + len(self._ids)
+
+    def __contains__(self, title):
+        return title in self._ids or self._base_id(title) is not None
+
+    def titles(self):
+        titles = list(self._ids)
+        if self.base is not None:
+            titles.extend(self.base.title(doc_id) for doc_id in range(self._base_count)
+                          if doc_id not in self._masked)
+        return titles
+
+    def add(self, title, content):
+        """
+        Indexes an entry, replacing any previously indexed version.
+        """
+        counts = Counter(tokenize(content))
+        for token in tokenize(title):
+            counts[token] += self.TITLE_WEIGHT
+        with self._lock:
+            self.remove(title)
+            if self._free_ids:
+                doc_id = self._free_ids.pop()
+                self._titles[doc_id] = title
+            else:
+                doc_id = len(self._titles)
+                self._titles.append(title)
+                self._lengths.append(0)
+                self._terms_by_doc.append(())
+            self._add_document(doc_id, counts)
+            self._ids[title] = doc_id
+
+    def remove(self, title):
+        """
+        Removes an entry from the index, if present.
+        """
+        with self._lock:
+            base_id = self._base_id(title)
+            if base_id is not None:
+                self._masked.add(base_id)
+                self._masked_length += self.base.length(base_id)
+            doc_id = self._ids.pop(title, None)
+            if doc_id is None:
+                return
+            for term in self._terms_by_doc[doc_id]:
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+                    index = bisect.bisect_left(self._vocabulary, term)
+                    del self._vocabulary[index]
+            self._total_length -= self._lengths[doc_id]
+            self._titles[doc_id] = None
+            self._lengths[doc_id] = 0
+            self._terms_by_doc[doc_id] = ()
+            self._free_ids.append(doc_id)
+
+    def sync(self, titles, load):
+        """
+        Brings the index in line with the given titles, loading the content
+        of entries that are not indexed yet through load(title).
+        """
+        current = set(self.titles())
+        for title in current.difference(titles):
+            self.remove(title)
+        for title in titles:
+            if title not in current:
+                content = load(title)
+                if content is not None:
+                    self.add(title, content)
+
+    def search(self, query, limit=None):
+        """
+        Returns a list of (title, score) pairs matching the query, best
+        match first.
+        """
+        with self._lock:
+            count = len(self)
+            if not count:
+                return []
+            base_length = self.base.total_length if self.base is not None else 0
+            average_length = (base_length - self._masked_length + self._total_length) / count
+            scores = {}
+            for term in set(tokenize(query)):
+                for match, weight in self._expand(term):
+                    postings = []
+                    if match[1] is not None:
+                        doc_ids, frequencies = self.base.postings(match[1])
+                        postings.extend((doc_id, frequency) for doc_id, frequency
+                                        in zip(doc_ids, frequencies) if doc_id not in self._masked)
+                        frequency_count = len(doc_ids)
+                    else:
+                        frequency_count = 0
+                    memory = self._postings.get(match[0], {})
+                    postings.extend((self._base_count + doc_id, frequency)
+                                    for doc_id, frequency in memory.items())
+                    frequency_count += len(memory)
+                    idf = math.log(1 + (count - frequency_count + 0.5) / (frequency_count + 0.5))
+                    for doc_id, frequency in postings:
+                        norm = self.K1 * (1 - self.B + self.B * self._length(doc_id) / average_length)
+                        score = weight * idf * frequency * (self.K1 + 1) / (frequency + norm)
+                        scores[doc_id] = scores.get(doc_id, 0) + score
+            if limit is not None:
+                top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            else:
+                top = scores.items()
+            return sorted(((self._title(doc_id), score) for doc_id, score in top),
+                          key=lambda item: (-item[1], item[0]))
+
+    def save(self, path, version):
+        """
+        Writes the whole index, including the entries held in memory, to
+        an index file. version(title) gives the entry version to record.
+        """
+        with self._lock:
+            documents, postings = self.export()
+            total_length = sum(length for _, length in documents)
+            IndexFile.write(path, [(title, version(title), length) for title, length in documents],
+                            postings, total_length)
+
+    def export(self):
+        """
+        Returns the indexed documents as a list of (title, length) sorted
+        by title, and an iterator of (term, [(document number, frequency),
+        ...]) sorted by term, where the document number is the position in
+        that list. The index must not change while the iterator is used.
+        """
+        sources = sorted(
+            [(self._titles[doc_id], None, doc_id) for doc_id in self._ids.values()] +
+            [(self.base.title(doc_id), doc_id, None) for doc_id in range(self._base_count)
+             if doc_id not in self._masked])
+        base_ids = {base_id: new_id for new_id, (_, base_id, _) in enumerate(sources) if base_id is not None}
+        memory_ids = {doc_id: new_id for new_id, (_, _, doc_id) in enumerate(sources) if doc_id is not None}
+        documents = [(title, self.base.length(base_id) if base_id is not None else self._lengths[doc_id])
+                     for title, base_id, doc_id in sources]
+
+        def postings():
+            for term, term_id in self._merged_vocabulary():
+                merged = []
+                if term_id is not None:
+                    doc_ids, frequencies = self.base.postings(term_id)
+                    merged.extend((base_ids[doc_id], frequency) for doc_id, frequency
+                                  in zip(doc_ids, frequencies) if doc_id in base_ids)
+                merged.extend((memory_ids[doc_id], frequency)
+                              for doc_id, frequency in self._postings.get(term, {}).items())
+                if merged:
+                    yield term, sorted(merged)
+
+        return documents, postings()
+
+    def _base_id(self, title):
+        if self.base is None:
+            return None
+        doc_id = self.base.find(title)
+        if doc_id is None or doc_id in self._masked:
+            return None
+        return doc_id
+
+    def _title(self, doc_id):
+        if doc_id < self._base_count:
+            return self.base.title(doc_id)
+        return self._titles[doc_id - self._base_count]
+
+    def _length(self, doc_id):
+        if doc_id < self._base_count:
+            return self.base.length(doc_id)
+        return self._lengths[doc_id - self._base_count]
+
+    def _add_document(self, doc_id, counts):
+        for term, frequency in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._vocabulary, term)
+            postings[doc_id] = frequency
+        length = sum(counts.values())
+        self._terms_by_doc[doc_id] = tuple(counts)
+        self._lengths[doc_id] = length
+        self._total_length += length
+
+    def _merged_vocabulary(self):
+        """
+        Yields (term, index file term id or None) over the terms of the
+        index file and of the in-memory index, in order.
+        """
+        base_terms = range(self.base.term_count) if self.base is not None else range(0)
+        base = ((self.base.term(term_id), term_id) for term_id in base_terms)
+        memory = ((term, None) for term in self._vocabulary)
+        previous = None
+        for term, term_id in heapq.merge(base, memory, key=lambda item: item[0]):
+            if previous is not None and previous[0] == term:
+                previous = (term, previous[1] if previous[1] is not None else term_id)
+                continue
+            if previous is not None:
+                yield previous
+            previous = (term, term_id)
+        if previous is not None:
+            yield previous
+
+    def _expand(self, term):
+        """
+        Returns ((indexed term, index file term id or None), weight) pairs
+        matching a query term exactly or by prefix.
+        """
+        matches = {}
+        start = bisect.bisect_left(self._vocabulary, term)
+        for match in self._vocabulary[start:start + self.MAX_PREFIX_EXPANSIONS]:
+            if not match.startswith(term):
+                break
+            matches[match] = None
+        if self.base is not None:
+            start = self.base.find_term(term)
+            for term_id in range(start, min(start + self.MAX_PREFIX_EXPANSIONS, self.base.term_count)):
+                match = self.base.term(term_id)
+                if not match.startswith(term):
+                    break
+                matches[match] = term_id
+        matches = sorted(matches.items())[:self.MAX_PREFIX_EXPANSIONS]
+        return [(match, 1.0 if match[0] == term else self.PREFIX_WEIGHT) for match in matches]
+
+
+class EntrySearch:
+    """
+    Keeps a SearchIndex in line with the entries of an entry store.
+
+    If an index file path is given, the index is loaded from it (and
+    written to it when first built from the entries). Saves are appended
+    to a journal next to the file, which every process replays, so that
+    all workers sharing the file see each other's edits.
+    """
+
+    def __init__(self, store, load, version, path=None):
+        self.store = store
+        self.load = load
+        self.version = version
+        self.path = path
+        self.journal = f"{path}.journal" if path else None
+        self._index = None
+        self._generation = None
+        self._journal_offset = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        """
+        Returns the up to date index, building or loading it on first use.
+        """
+        titles = self.store.titles()
+        with self._lock:
+            if self._index is None:
+                self._open()
+            else:
+                self._poll()
+            if self._generation != self.store.generation:
+                self._index.sync(titles, self.load)
+                self._generation = self.store.generation
+            return self._index
+
+    def update(self, title, content):
+        """
+        Re-indexes a saved entry, or removes it if content is None.
+        """
+        with self._lock:
+            if self.journal and os.path.exists(self.path):
+                caught_up = self._journal_size() == self._journal_offset
+                with open(self.journal, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(title) + "\n")
+                if caught_up:
+                    self._journal_offset = self._journal_size()
+            if self._index is None:
+                return
+            if content is None:
+                self._index.remove(title)
+            else:
+                self._index.add(title, content)
+            if self._generation is not None:
+                self._generation = self.store.generation
+
+    def rebuild(self):
+        """
+        Re-indexes every entry and, if a path is set, rewrites the index
+        file and clears the journal.
+        """
+        index = SearchIndex()
+        index.sync(self.store.titles(), self.load)
+        with self._lock:
+            if self.path:
+                self._write(index)
+            self._index = index
+            self._generation = self.store.generation
+        return index
+
+    def journal_titles(self):
+        """
+        Returns the set of titles saved since the index file was written.
+        """
+        if not self.journal or not os.path.exists(self.journal):
+            return set()
+        with open(self.journal, encoding="utf-8") as f:
+            return {json.loads(line) for line in f if line.endswith("\n")}
+
+    def _open(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                self._index = SearchIndex(IndexFile(self.path))
+                self._journal_offset = 0
+                self._replay_journal()
+                self._checked_at = time.monotonic()
+                return
+            except ValueError:
+                pass
+        self._index = SearchIndex()
+        self._index.sync(self.store.titles(), self.load)
+        self._generation = self.store.generation
+        if self.path:
+            self._write(self._index)
+        self._checked_at = time.monotonic()
+
+    def _poll(self):
+        """
+        Picks up a rewritten index file or journal entries appended by
+        other processes, at most once per catalog poll interval.
+        """
+        if not self.path:
+            return
+        interval = getattr(settings, "WIKI_CATALOG_POLL_INTERVAL", 1.0)
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        base = self._index.base
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if base is None or (stat.st_ino, stat.st_mtime_ns) != (base.stat.st_ino, base.stat.st_mtime_ns):
+            self._index = None
+            self._generation = None
+            self._open()
+        else:
+            self._replay_journal()
+
+    def _replay_journal(self):
+        if self._journal_size() <= self._journal_offset:
+            return
+        with open(self.journal, "rb") as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        self._journal_offset += len(complete)
+        for title in {json.loads(line) for line in complete.decode("utf-8").splitlines()}:
+            content = self.load(title)
+            if content is None:
+                self._index.remove(title)
+            else:
+                self._index.add(title, content)
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal)
+        except FileNotFoundError:
+            return 0
+
+    def _write(self, index):
+        index.save(self.path, self.version)
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        self._journal_offset = 0
+
+
+def snippet(content, query, width=160):
+    """
+    Returns an HTML-safe excerpt of the Markdown content around the first
+    occurrence of a query term, with matching words wrapped in <mark>.
+    """
+    text = " ".join(MARKUP_RE.sub(r"\1", content).split())
+    terms = tokenize(query)
+    start = 0
+    for match in TOKEN_RE.finditer(text):
+        if any(match.group().casefold().startswith(term) for term in terms):
+            start = max(0, match.start() - width // 4)
+            break
+    excerpt = text[start:start + width]
+
+    parts = []
+    position = 0
+    for match in TOKEN_RE.finditer(excerpt):
+        if any(match.group().casefold().startswith(term) for term in terms):
+            parts.append(escape(excerpt[position:match.start()]))
+            parts.append(f"<mark>{escape(match.group())}</mark>")
+            position = match.end()
+    parts.append(escape(excerpt[position:]))
+    prefix = "..." if start else ""
+    suffix = "..." if start + width < len(text) else ""
+    return mark_safe(prefix + "".join(parts) + suffix)
@@ -0,0 +1,387 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.conf import settings
+
+from .revisions import EditConflict
+
+MAGIC = b"WIKISEG1"
+
+# flags, title length, data length, content size, revision, dictionary,
+# CRC-32 of the data and timestamp, followed by the title and the data
+RECORD = struct.Struct("<BHIIIIId")
+
+DELETED = 1
+
+# zlib uses at most the last 32 KiB of a preset dictionary
+DICTIONARY_SIZE = 32 * 1024
+
+
+class SegmentLog:
+    """
+    Entries packed into a few append-only segment files in a directory,
+    each entry zlib-compressed on its own, optionally with a preset
+    dictionary shared by all entries, so that one is read by slicing its
+    bytes out of the memory-mapped segment and decompressing just those.
+
+    Saving an entry appends a record to the last segment, or to a new
+    one once the last reaches max_segment_size bytes. An in-memory index
+    of the latest record of each title is built by reading the record
+    headers of every segment, and kept up to date with records appended
+    by other processes, which is checked at most once every
+    WIKI_CATALOG_POLL_INTERVAL seconds and before each write. Writers
+    take an exclusive lock on the directory.
+
+    Records of entries saved again or deleted are left in their segment
+    until compact() rewrites it.
+    """
+
+    def __init__(self, directory, max_segment_size=64 * 1024 * 1024, level=6):
+        self.directory = directory
+        self.max_segment_size = max_segment_size
+        self.level = level
+        self.generation = 0
+        self._index = {}
+        self._titles = []
+        self._segments = []
+        self._scanned = {}
+        self._maps = {}
+        self._dictionaries = {}
+        self._checked_at = None
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def titles(self):
+        """
+        Returns the sorted list of titles of the entries not deleted.
+        """
+        self._poll()
+        return self._titles
+
+    def find(self, title):
+        """
+        Returns the index record (segment, offset, flags, data length,
+        size, revision, dictionary, timestamp) of the latest version of
+        an entry not deleted, or None.
+        """
+        self._poll()
+        record = self._index.get(title)
+        if record is None or record[2] & DELETED:
+            return None
+        return record
+
+    def read(self, title):
+        """
+        Returns the content of an entry, or None.
+        """
+        with self._lock:
+            record = self.find(title)
+            if record is None:
+                return None
+            try:
+                data = self._data(record)
+            except FileNotFoundError:
+                # The segment was compacted away by another process
+                self._reload()
+                record = self.find(title)
+                if record is None:
+                    return None
+                data = self._data(record)
+        return self._decompressor(record[6]).decompress(data).decode("utf-8")
+
+    def write(self, entries, base_revision=None, step=1):
+        """
+        Appends (title, content) pairs, content None deleting the entry,
+        and returns their new revision numbers, step after the latest
+        ones. If base_revision is given and is not the latest revision of
+        the single entry written, EditConflict is raised and nothing is
+        written.
+        """
+        with self._lock, self._exclusive():
+            self._refresh()
+            dictionary = self._latest_dictionary()
+            records, revisions = [], []
+            for title, content in entries:
+                current = self._index.get(title)
+                head = current[5] if current is not None else 0
+                if base_revision is not None and base_revision != head:
+                    raise EditConflict(title, base_revision)
+                revisions.append(head + step)
+                records.append(self._pack(title, content, head + step, dictionary))
+            self._append(records)
+        return revisions
+
+    def compact(self, min_garbage=0.5, train=False):
+        """
+        Rewrites the segments where records of older versions and deleted
+        entries take up at least min_garbage of the bytes, into new
+        segments holding only the latest records. With train, a new
+        shared dictionary is built from the entries and every segment is
+        rewritten with it. Returns the numbers of segments rewritten and
+        of bytes reclaimed.
+        """
+        with self._lock, self._exclusive():
+            self._refresh()
+            live = Counter()
+            for title, (segment, _, _, length, *_) in self._index.items():
+                live[segment] += RECORD.size + len(title.encode("utf-8")) + length
+            sizes = {segment: self._scanned[segment] - len(MAGIC) for segment in self._segments}
+
+            dictionary = self._latest_dictionary()
+            if train:
+                dictionary = self._train_dictionary(dictionary + 1)
+                chosen = set(self._segments)
+            else:
+                chosen = {segment for segment, size in sizes.items()
+                          if size and (size - live[segment]) / size >= min_garbage}
+            if not chosen:
+                return 0, 0
+
+            # Deletions only need keeping while older records may remain
+            keep_deleted = chosen != set(self._segments)
+            records = []
+            for title in sorted(self._index):
+                record = self._index[title]
+                segment, offset, flags, length, size, revision, old_dictionary, timestamp = record
+                if segment not in chosen or (flags & DELETED and not keep_deleted):
+                    continue
+                if flags & DELETED:
+                    records.append(self._pack(title, None, revision, 0, timestamp))
+                    continue
+                data = self._data(record)
+                if old_dictionary != dictionary:
+                    content = self._decompressor(old_dictionary).decompress(data).decode("utf-8")
+                    records.append(self._pack(title, content, revision, dictionary, timestamp))
+                else:
+                    header = RECORD.pack(flags, len(title.encode("utf-8")), length, size, revision,
+                                         dictionary, zlib.crc32(data), timestamp)
+                    records.append(header + title.encode("utf-8") + data)
+
+            reclaimed = sum(sizes[segment] for segment in chosen)
+            first = self._new_segment()
+            self._append(records, sync=True)
+            reclaimed -= sum(self._scanned[segment] - len(MAGIC) for segment in self._segments if segment >= first)
+            for segment in chosen:
+                os.remove(self._segment_path(segment))
+            self._remove_unused_dictionaries(dictionary)
+            self._reload()
+            return len(chosen), reclaimed
+
+    def invalidate(self):
+        """
+        Makes the next access check the segments for changes.
+        """
+        self._checked_at = None
+
+    def _poll(self):
+        interval = getattr(settings, "WIKI_CATALOG_POLL_INTERVAL", 1.0)
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            self._refresh()
+
+    def _refresh(self):
+        segments = self._list_segments()
+        if segments[:len(self._segments)] != self._segments:
+            self._reload()
+            return
+        titles_changed = False
+        for segment in segments:
+            if segment not in self._scanned:
+                self._segments.append(segment)
+                self._scanned[segment] = len(MAGIC)
+            titles_changed |= self._scan(segment)
+        if titles_changed:
+            self._set_titles()
+
+    def _reload(self):
+        for mapping in self._maps.values():
+            mapping.close()
+        self._index, self._segments, self._scanned, self._maps = {}, [], {}, {}
+        self._dictionaries = {}
+        for segment in self._list_segments():
+            self._segments.append(segment)
+            self._scanned[segment] = len(MAGIC)
+            self._scan(segment)
+        self._set_titles()
+        self._checked_at = time.monotonic()
+
+    def _scan(self, segment):
+        """
+        Indexes the complete records appended to a segment since it was
+        last scanned. Returns whether the set of titles changed.
+        """
+        path = self._segment_path(segment)
+        try:
+            end = os.path.getsize(path)
+        except FileNotFoundError:
+            return False
+        offset = self._scanned[segment]
+        if end <= offset:
+            return False
+        mapping = self._map(segment, end)
+        changed = False
+        while offset + RECORD.size <= end:
+            flags, title_length, length, size, revision, dictionary, crc, timestamp = \
+                RECORD.unpack_from(mapping, offset)
+            data_offset = offset + RECORD.size + title_length
+            if data_offset + length > end or zlib.crc32(mapping[data_offset:data_offset + length]) != crc:
+                # A record still being written, or left incomplete
+                break
+            title = mapping[offset + RECORD.size:data_offset].decode("utf-8")
+            previous = self._index.get(title)
+            if previous is None or bool(previous[2] & DELETED) != bool(flags & DELETED):
+                changed = True
+            self._index[title] = (segment, data_offset, flags, length, size, revision, dictionary, timestamp)
+            offset = data_offset + length
+        self._scanned[segment] = offset
+        return changed
+
+    def _append(self, records, sync=False):
+        segment = self._segments[-1] if self._segments else self._new_segment()
+        end = self._scanned[segment]
+        # Drop an incomplete record left by a writer that failed
+        if os.path.getsize(self._segment_path(segment)) > end:
+            os.truncate(self._segment_path(segment), end)
+        written = [segment]
+        f = open(self._segment_path(segment), "ab")
+        try:
+            for record in records:
+                if end > len(MAGIC) and end + len(record) > self.max_segment_size:
+                    self._close(f, sync)
+                    segment = self._new_segment()
+                    written.append(segment)
+                    f = open(self._segment_path(segment), "ab")
+                    end = len(MAGIC)
+                f.write(record)
+                end += len(record)
+        finally:
+            self._close(f, sync)
+
+        # Index what was written, as another process reading it would
+        if any([self._scan(segment) for segment in written]):
+            self._set_titles()
+
+    def _close(self, f, sync):
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+        f.close()
+
+    def _pack(self, title, content, revision, dictionary, timestamp=None):
+        if content is None:
+            flags, data, size, dictionary = DELETED, b"", 0, 0
+        else:
+            raw = content.encode("utf-8")
+            flags, size = 0, len(raw)
+            compressor = zlib.compressobj(self.level, zdict=self._dictionary(dictionary)) \
+                if dictionary else zlib.compressobj(self.level)
+            data = compressor.compress(raw) + compressor.flush()
+        encoded = title.encode("utf-8")
+        header = RECORD.pack(flags, len(encoded), len(data), size, revision, dictionary,
+                             zlib.crc32(data), time.time() if timestamp is None else timestamp)
+        return header + encoded + data
+
+    def _decompressor(self, dictionary):
+        if dictionary:
+            return zlib.decompressobj(zdict=self._dictionary(dictionary))
+        return zlib.decompressobj()
+
+    def _data(self, record):
+        segment, offset, _, length, *_ = record
+        return self._map(segment, offset + length)[offset:offset + length]
+
+    def _map(self, segment, end):
+        mapping = self._maps.get(segment)
+        if mapping is None or len(mapping) < end:
+            if mapping is not None:
+                mapping.close()
+            with open(self._segment_path(segment), "rb") as f:
+                mapping = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapping
+
+    def _new_segment(self):
+        segment = (self._segments[-1] if self._segments else 0) + 1
+        with open(self._segment_path(segment), "xb") as f:
+            f.write(MAGIC)
+        self._segments.append(segment)
+        self._scanned[segment] = len(MAGIC)
+        return segment
+
+    def _set_titles(self):
+        self._titles = sorted(title for title, record in self._index.items() if not record[2] & DELETED)
+        self.generation += 1
+
+    def _list_segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith(".seg") and name[:-4].isdigit())
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:06d}.seg")
+
+    def _dictionary(self, dictionary):
+        data = self._dictionaries.get(dictionary)
+        if data is None:
+            with open(self._dictionary_path(dictionary), "rb") as f:
+                data = self._dictionaries[dictionary] = f.read()
+        return data
+
+    def _latest_dictionary(self):
+        return max((int(name[:-6]) for name in os.listdir(self.directory)
+                    if name.endswith(".zdict") and name[:-6].isdigit()), default=0)
+
+    def _train_dictionary(self, dictionary):
+        """
+        Writes a dictionary of the lines most common across entries, the
+        most common last, where zlib finds them soonest.
+        """
+        counts = Counter()
+        for title, record in self._index.items():
+            if not record[2] & DELETED:
+                counts.update(set(self.read(title).encode("utf-8").splitlines(keepends=True)))
+        common, size = [], 0
+        for line, count in counts.most_common():
+            if count < 2 or size + len(line) > DICTIONARY_SIZE:
+                break
+            common.append(line)
+            size += len(line)
+        path = self._dictionary_path(dictionary)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(b"".join(reversed(common)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+        return dictionary
+
+    def _remove_unused_dictionaries(self, latest):
+        used = {record[6] for record in self._index.values()} | {latest}
+        for name in os.listdir(self.directory):
+            if name.endswith(".zdict") and name[:-6].isdigit() and int(name[:-6]) not in used:
+                os.remove(os.path.join(self.directory, name))
+
+    def _dictionary_path(self, dictionary):
+        return os.path.join(self.directory, f"{dictionary:06d}.zdict")
+
+    def _exclusive(self):
+        return _FileLock(os.path.join(self.directory, "lock"))
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, "a")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
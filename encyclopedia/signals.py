@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent by util.save_entry after an entry has been saved, with the entry's
+# title and new revision number (None if the store keeps no revisions).
+entry_saved = Signal()
+
+# Sent by util.save_entries once per batch of entries saved in bulk, with
+# their titles, instead of entry_saved for each of them.
+entries_saved = Signal()
@@ -0,0 +1,51 @@
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+from django.core.files.base import ContentFile
+
+from .compression import available_encodings, compress
+
+SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+
+class CompressedStaticFilesMixin:
+    """
+    Writes a <name>.gz and, if the brotli package is installed, a
+    <name>.br copy of every collected text file, compressed at the best
+    level, when collectstatic runs. Web servers send them to clients that
+    accept them without compressing anything per request, e.g. nginx with
+    gzip_static and brotli_static on.
+    """
+
+    compressed_extensions = (".css", ".js", ".mjs", ".svg", ".html", ".txt", ".json", ".xml", ".map", ".ico")
+
+    def post_process(self, paths, dry_run=False, **options):
+        parent = getattr(super(), "post_process", None)
+        if parent is not None:
+            processed = parent(paths, dry_run=dry_run, **options)
+        else:
+            processed = ((name, name, True) for name in paths)
+        for name, processed_name, result in processed:
+            if not dry_run and not isinstance(result, Exception):
+                self.compress_file(processed_name or name)
+            yield name, processed_name, result
+
+    def compress_file(self, name):
+        if not name.endswith(self.compressed_extensions):
+            return
+        with self.open(name) as f:
+            data = f.read()
+        for encoding in available_encodings():
+            compressed_name = name + SUFFIXES[encoding]
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            compressed = compress(data, encoding, best=True)
+            # Not worth sending when it saves nothing
+            if len(compressed) < len(data):
+                self._save(compressed_name, ContentFile(compressed))
+
+
+class CompressedStaticFilesStorage(CompressedStaticFilesMixin, StaticFilesStorage):
+    pass
+
+
+class CompressedManifestStaticFilesStorage(CompressedStaticFilesMixin, ManifestStaticFilesStorage):
+    pass
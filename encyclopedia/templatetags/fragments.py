@@ -0,0 +1,56 @@
+from django import template
+from django.conf import settings
+
+from encyclopedia.cache import RenderCache
+
+register = template.Library()
+
+# Rendered template fragments of this process, kept apart from the shared
+# render cache tier as they change with the templates.
+fragment_cache = RenderCache(getattr(settings, "WIKI_FRAGMENT_CACHE_MAX_BYTES", 4 * 1024 * 1024), shared=False)
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, key=None, version=None):
+        self.nodelist = nodelist
+        self.name = name
+        self.key = key
+        self.version = version
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        if self.key is not None:
+            name = f"{name}/{self.key.resolve(context)}"
+        version = ""
+        if self.version is not None:
+            # Fragments without a known version are rendered every time,
+            # including when it is missing from the context
+            version = self.version.resolve(context)
+            if version is None or version == "":
+                return self.nodelist.render(context)
+
+        html = fragment_cache.get(name, version)
+        if html is None:
+            html = self.nodelist.render(context)
+            fragment_cache.set(name, version, html)
+        return html
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    Caches the rendered contents of the block in this process, under a
+    name and an optional key, until they are rendered for another version:
+
+        {% fragment "sidebar" %}...{% endfragment %}
+        {% fragment "entry" title version %}...{% endfragment %}
+
+    The contents must only depend on the name, key and version. Nothing
+    is cached when a version is given but is None or missing.
+    """
+    bits = token.split_contents()
+    if not 2 <= len(bits) <= 4:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a name, and optionally a key and a version.")
+    nodelist = parser.parse(("endfragment",))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, *(parser.compile_filter(bit) for bit in bits[1:]))
@@ -1,19 +1,80 @@
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from io import StringIO
+
+import markdown2
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.paginator import Page
-from django.test import TestCase
+from django.template import Context, Template
+from django.test import AsyncRequestFactory, TestCase, override_settings
 from django.urls import reverse
 
+from unittest import skipUnless
 from unittest.mock import patch
 
 from . import util
+from .bus import CacheBus, SQLiteTransport, get_bus
+from .cache import RenderCache, render_cache
+from .catalog import get_catalog
+from . import async_views, compression, instrumentation, purge
 from .forms import EditEntryForm, NewEntryForm
+from .renderers import CommonMarkRenderer, Markdown2Renderer
+from .revisions import EditConflict, apply_delta, make_delta
+from .search import EntrySearch
+from .stores import FileSystemEntryStore, PackedEntryStore, SQLiteEntryStore, get_store
+from .templatetags.fragments import fragment_cache
+from .views import page_version, rendered_page_version
+from .workqueue import RenderQueue
+from .writes import RateLimit, RateLimited, WriteBuffer
+
+SQLITE_CACHE_BUS = {'BACKEND': 'encyclopedia.bus.SQLiteTransport', 'OPTIONS': {}}
+
+class TempEntriesMixin:
+    """
+    Points default_storage at a fresh temporary directory for each test.
+    """
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.media_root, "entries"))
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        queue = util.get_render_queue()
+        if queue is not None:
+            queue.join()
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        super().tearDown()
+
+    def write_entry_file(self, title, content):
+        with open(os.path.join(self.media_root, "entries", f"{title}.md"), "w") as f:
+            f.write(content)
 
 # Views Tests
+def mock_entries(entries):
+    """
+    Mocks the paginated listing functions to serve the given entries.
+    """
+    def list_entries(offset=0, limit=None):
+        return entries[offset:] if limit is None else entries[offset:offset + limit]
+
+    return patch.multiple(util, list_entries=list_entries, count_entries=lambda: len(entries))
+
 class IndexViewTest(TestCase):
     def test_index_view_with_entries(self):
         entries = ["Entry1", "Entry2", "Entry3", "Entry4", "Entry5", "Entry6", "Entry7", "Entry8", "Entry9", "Entry10", "Entry11"]
 
-        # Mock the 'list_entries' function to return the list of entries
-        with patch.object(util, 'list_entries', return_value=entries):
+        # Mock the listing functions to return the list of entries
+        with mock_entries(entries):
             response = self.client.get(reverse('index'))
 
         self.assertEqual(response.status_code, 200)  # Check if the view returns a 200 status code
@@ -27,8 +88,8 @@ class IndexViewTest(TestCase):
         self.assertEqual(response.context['entries'].paginator.num_pages, 2)  # Check the number of pages
 
     def test_index_view_without_entries(self):
-        # Mock the 'list_entries' function to return an empty list
-        with patch.object(util, 'list_entries', return_value=[]):
+        # Mock the listing functions to return an empty list
+        with mock_entries([]):
             response = self.client.get(reverse('index'))
 
         self.assertEqual(response.status_code, 200)  # Check if the view returns a 200 status code
@@ -40,7 +101,30 @@ class IndexViewTest(TestCase):
         self.assertEqual(len(response.context['entries']), 0)  # Check the number of entries on the page
         self.assertEqual(response.context['entries'].paginator.num_pages, 1)  # Check the number of pages
 
-class EntryViewTest(TestCase):
+    def test_index_view_fetches_only_the_requested_page(self):
+        with patch.object(util, 'count_entries', return_value=100000):
+            with patch.object(util, 'list_entries', return_value=["Entry1"] * 10) as mock_list_entries:
+                response = self.client.get(reverse('index'), {'page': 5000})
+
+        self.assertEqual(response.context['entries'].number, 5000)
+        mock_list_entries.assert_called_once_with(49990, 10)
+
+class IndexCursorTest(TempEntriesMixin, TestCase):
+    def test_cursor_survives_insertions(self):
+        for number in range(15):
+            self.write_entry_file(f"Entry{number:02}", "Content")
+
+        response = self.client.get(reverse('index'), {'after': ''})
+        self.assertEqual(response.context['entries'][-1], "Entry09")
+        cursor = response.context['next_cursor']
+
+        # An entry added before the cursor does not shift the next page
+        util.save_entry("Entry00a", "Content")
+        response = self.client.get(reverse('index'), {'after': cursor})
+        self.assertEqual(response.context['entries'], ["Entry10", "Entry11", "Entry12", "Entry13", "Entry14"])
+        self.assertIsNone(response.context['next_cursor'])
+
+class EntryViewTest(TempEntriesMixin, TestCase):
     def test_entry_view_with_existing_entry(self):
         title = "Test Entry"
         content = "This is a test entry content."
@@ -75,8 +159,9 @@ class EntryViewTest(TestCase):
         self.assertContains(response, title)  # Check if the title is displayed
         self.assertContains(response, "Not Found")  # Check if the "Not Found" message is displayed
 
-class CreateViewTest(TestCase):
+class CreateViewTest(TempEntriesMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.test_data = {
             'title': 'Test Entry',
             'content': 'Test content',
@@ -105,8 +190,8 @@ class CreateViewTest(TestCase):
                 mock_save_entry.assert_called_once_with(self.test_data['title'], self.test_data['content'])
 
     def test_create_view_POST_existing_entry(self):
-        # Mock the 'get_entry' and 'save_entry' functions
-        with patch.object(util, 'get_entry', return_value="Existing Content"):
+        # Mock the title lookup to find an existing entry
+        with patch.object(util, 'resolve_title', return_value="Test Entry"):
             response = self.client.post(reverse('create'), data=self.test_data)                
 
         self.assertEqual(response.status_code, 200)  # Check if the view returns a 200 status code
@@ -134,8 +219,9 @@ class CreateViewTest(TestCase):
         # Check if the form has errors
         self.assertTrue(response.context['form'].errors)
 
-class EditViewTest(TestCase):
+class EditViewTest(TempEntriesMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.test_data = {
             'title': 'Test Entry',
             'original_content': 'Test content',
@@ -170,7 +256,7 @@ class EditViewTest(TestCase):
                 self.assertEqual(response.status_code, 302)  # Check if the view redirects to the entry page
 
                 # Check if the 'save_entry' function was called with the updated content
-                mock_save_entry.assert_called_once_with(self.test_data['title'], self.test_data['updated_content'])
+                mock_save_entry.assert_called_once_with(self.test_data['title'], self.test_data['updated_content'], base_revision=None)
 
     def test_edit_view_POST_invalid_data(self):
         response = self.client.post(reverse('edit', args=[self.test_data['title']]), data={'title': self.test_data['title'], 'content': ""})
@@ -182,28 +268,31 @@ class EditViewTest(TestCase):
         # Check if the form has errors
         self.assertTrue(response.context['form'].errors)
 
-class SearchViewTest(TestCase):
+class SearchViewTest(TempEntriesMixin, TestCase):
     def setUp(self):
+        super().setUp()
         self.entries_list = ['Python', 'Django', 'HTML']
+        for title in self.entries_list:
+            self.write_entry_file(title, f"# {title}\n\n{title} is used to build web applications.")
 
     def test_search_view_exact_match(self):
-        # Mock the 'list_entries' function to return a list of entries
-        with patch.object(util, 'list_entries', return_value=self.entries_list):
-            search_query = self.entries_list[0]
-            response = self.client.get(reverse('search'), {'q': search_query})
+        search_query = self.entries_list[0]
+        response = self.client.get(reverse('search'), {'q': search_query})
 
         self.assertEqual(response.status_code, 302)  # Check if the view redirects to the entry page
 
         # Check if the view redirects to the correct entry
-        self.assertRedirects(response, reverse('entry', args=[search_query.lower()]))
+        self.assertRedirects(response, reverse('entry', args=[search_query]))
+
+    def test_search_view_matches_title_in_any_case(self):
+        response = self.client.get(reverse('search'), {'q': 'pYTHON'})
+        self.assertRedirects(response, reverse('entry', args=['Python']))
 
     def test_search_view_no_results(self):
-        # Mock the 'list_entries' function to return a list of entries
-        with patch.object(util, 'list_entries', return_value=self.entries_list):
-            # Define a search query with no matching results
-            search_query = 'CSS'
+        # Define a search query with no matching results
+        search_query = 'CSS'
 
-            response = self.client.get(reverse('search'), {'q': search_query})
+        response = self.client.get(reverse('search'), {'q': search_query})
 
         self.assertEqual(response.status_code, 200)  # Check if the view returns a 200 status code
 
@@ -214,13 +303,11 @@ class SearchViewTest(TestCase):
         self.assertContains(response, 'No results found for "CSS"')
 
     def test_search_view_with_results(self):
-        # Mock the 'list_entries' function to return a list of entries
-        with patch.object(util, 'list_entries', return_value=self.entries_list):
-            # Define a search query with matching results
-            search_query = 'Py'
+        # Define a search query with matching results
+        search_query = 'Py'
 
-            # Create a GET request with the search query
-            response = self.client.get(reverse('search'), {'q': search_query})
+        # Create a GET request with the search query
+        response = self.client.get(reverse('search'), {'q': search_query})
 
         self.assertEqual(response.status_code, 200)  # Check if the view returns a 200 status code
 
@@ -230,13 +317,35 @@ class SearchViewTest(TestCase):
         # Check if the search results are displayed in the response content
         self.assertContains(response, '<a href="/wiki/Python/"')  # Check if 'Python' is in the response
 
-class RandomViewTest(TestCase):
-    #Ensure 'Python' is returned when calling rand.choice(entries)
-    @patch('random.choice', side_effect=lambda entries: 'Python')
+    def test_search_view_matches_content_ranked_by_relevance(self):
+        self.write_entry_file("Git", "Git tracks changes to source code. Git is distributed.")
+        util.save_entry("CSS", "CSS styles web pages written in HTML.")
+
+        # A query naming an entry redirects to it, so search for a prefix
+        response = self.client.get(reverse('search'), {'q': 'htm'})
+
+        # The entry titled HTML ranks above the one mentioning it in its body
+        titles = [result['title'] for result in response.context['entries']]
+        self.assertEqual(titles, ['HTML', 'CSS'])
+
+        # Check if matching words are highlighted in the snippet
+        self.assertContains(response, '<mark>HTML</mark>')
 
-    def test_random_view(self, random_choice_mock):
-        entries_list = ['Python', 'Django', 'HTML']
-        with patch.object(util, 'list_entries', return_value=entries_list):
+    def test_search_view_reads_only_the_entries_shown(self):
+        for number in range(25):
+            util.save_entry(f"Tool {number:02d}", "A widget for builders.")
+        util.get_render_queue().join()
+
+        with patch.object(util, 'get_entry', wraps=util.get_entry) as get_entry:
+            response = self.client.get(reverse('search'), {'q': 'widget', 'page': 3})
+        self.assertEqual(get_entry.call_count, 5)
+        self.assertEqual(len(response.context['entries']), 5)
+        self.assertContains(response, 'href="?q=widget&amp;page=2"')
+
+class RandomViewTest(TestCase):
+    def test_random_view(self):
+        # Ensure 'Python' is returned when picking a random entry
+        with patch.object(util, 'random_entry', return_value='Python') as random_entry_mock:
             # Create a GET request to the random view
             response = self.client.get(reverse('random'))
 
@@ -245,8 +354,1039 @@ class RandomViewTest(TestCase):
         # Check if the view redirects to the correct entry
         self.assertRedirects(response, reverse('entry', args=['Python']))
 
-        # Ensure that the random.choice function was called
-        random_choice_mock.assert_called_once_with(entries_list)
+        # Ensure that the random entry was picked once
+        random_entry_mock.assert_called_once_with(exclude=[])
+
+    def test_random_view_without_entries(self):
+        with patch.object(util, 'random_entry', return_value=None):
+            response = self.client.get(reverse('random'))
+
+        self.assertRedirects(response, reverse('index'))
+
+    @override_settings(WIKI_RANDOM_HISTORY=2)
+    def test_random_view_avoids_recently_shown_entries(self):
+        with patch.object(util, 'random_entry', side_effect=['Python', 'Django', 'HTML']) as random_entry_mock:
+            for _ in range(3):
+                self.client.get(reverse('random'))
+
+        self.assertEqual(random_entry_mock.call_args_list[-1].kwargs, {'exclude': ['Python', 'Django']})
+        self.assertEqual(self.client.session['recent_random'], ['Django', 'HTML'])
+
+class RandomEntryTest(TempEntriesMixin, TestCase):
+    def test_random_entry_avoids_excluded_entries(self):
+        for title in ['Python', 'Django']:
+            util.save_entry(title, f"# {title}")
+
+        with patch.object(FileSystemEntryStore, 'random_title', side_effect=['Python', 'Python', 'Django']):
+            self.assertEqual(util.random_entry(exclude=['Python']), 'Django')
+
+    def test_random_entry_without_entries(self):
+        self.assertIsNone(util.random_entry())
+
+class ConditionalEntryViewTest(TempEntriesMixin, TestCase):
+    def test_unchanged_entry_is_not_sent_again(self):
+        util.save_entry("Git", "# Git")
+        response = self.client.get(reverse('entry', args=["Git"]))
+
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(reverse('entry', args=["Git"]), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_entry_is_sent_again(self):
+        util.save_entry("Git", "# Git")
+        etag = self.client.get(reverse('entry', args=["Git"]))['ETag']
+
+        util.save_entry("Git", "# Git, a version control system")
+        response = self.client.get(reverse('entry', args=["Git"]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_entry_is_sent_again_after_renderer_change(self):
+        util.save_entry("Git", "# Git")
+        etag = self.client.get(reverse('entry', args=["Git"]))['ETag']
+        compressed = self.client.get(reverse('entry', args=["Git"]), headers={'Accept-Encoding': 'gzip'})['ETag']
+        self.assertEqual(compressed, "W/" + etag)
+
+        with self.settings(WIKI_MARKDOWN_RENDERER={'OPTIONS': {'extras': ['tables']}}):
+            response = self.client.get(reverse('entry', args=["Git"]), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('entry', args=["Git"]), HTTP_IF_NONE_MATCH=compressed,
+                                       headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(WIKI_PURGE_URLS=['http://proxy.local/'])
+    def test_saving_purges_the_entry_page(self):
+        with patch.object(purge.threading, 'Thread') as mock_thread:
+            util.save_entry("Git", "# Git")
+        mock_thread.assert_called_once_with(target=purge.purge, args=(['http://proxy.local/wiki/Git/'],), daemon=True)
+
+        with patch.object(purge.urllib.request, 'urlopen') as mock_urlopen:
+            purge.purge(['http://proxy.local/wiki/Git/'])
+        self.assertEqual(mock_urlopen.call_args.args[0].get_method(), 'PURGE')
+
+@override_settings(WIKI_STREAM_ENTRIES_OVER=0, WIKI_RENDER_CHUNK_SIZE=1)
+class StreamingEntryViewTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        render_cache.clear()
+        self.write_entry_file("Git", "# Git\n\nIntro\n\n## History\n\nText\n")
+
+    def test_large_entry_is_streamed_in_sections(self):
+        util.backlinks("Git")
+        with patch.object(FileSystemEntryStore, 'get') as mock_get:
+            response = self.client.get(reverse('entry', args=["Git"]))
+            chunks = list(response.streaming_content)
+        mock_get.assert_not_called()
+
+        self.assertEqual(len(chunks), 4)
+        self.assertIn(b"<title>", chunks[0])
+        self.assertIn(b"<h1>Git</h1>", chunks[1])
+        self.assertIn(b"<h2>History</h2>", chunks[2])
+        self.assertIn(b"</html>", chunks[3])
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_streamed_page_follows_backlinks(self):
+        fragment_cache.clear()
+        content = b"".join(self.client.get(reverse('entry', args=["Git"])).streaming_content)
+        self.assertNotIn(b'href="/wiki/HTML/"', content)
+
+        util.save_entry("HTML", "[Git](/wiki/Git)")
+        content = b"".join(self.client.get(reverse('entry', args=["Git"])).streaming_content)
+        self.assertIn(b'href="/wiki/HTML/"', content)
+
+    def test_missing_entry_is_not_streamed(self):
+        response = self.client.get(reverse('entry', args=["Missing"]))
+        self.assertFalse(response.streaming)
+        self.assertContains(response, "Not Found")
+
+    async def test_async_entry_view_streams(self):
+        response = await async_views.entry(AsyncRequestFactory().get('/wiki/Git/'), "Git")
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        self.assertIn(b"<h2>History</h2>", content)
+
+class AsyncViewsTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        for number in range(12):
+            util.save_entry(f"Entry{number:02}", f"# Entry {number}")
+
+    async def test_async_index_view(self):
+        response = await async_views.index(self.factory.get('/', {'page': 2}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'href="/wiki/Entry11/"')
+        self.assertNotContains(response, 'href="/wiki/Entry00/"')
+
+    async def test_async_entry_view_supports_conditional_get(self):
+        response = await async_views.entry(self.factory.get('/wiki/Entry01/'), "Entry01")
+        self.assertContains(response, "<h1>Entry 1</h1>")
+
+        request = self.factory.get('/wiki/Entry01/', headers={'If-None-Match': response['ETag']})
+        response = await async_views.entry(request, "Entry01")
+        self.assertEqual(response.status_code, 304)
+
+    async def test_async_create_view(self):
+        request = self.factory.post('/create/', {'title': "New", 'content': "# New"})
+        response = await async_views.create(request)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(await util.aget_entry("New"), "# New")
+
+    async def test_async_search_view(self):
+        response = await async_views.search(self.factory.get('/search/', {'q': 'entry 7'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'href="/wiki/Entry07/"')
+
+# Util Tests
+class CatalogTest(TempEntriesMixin, TestCase):
+    def test_list_entries_includes_saved_entry(self):
+        self.write_entry_file("Django", "# Django")
+        self.assertEqual(util.list_entries(), ["Django"])
+
+        util.save_entry("CSS", "# CSS")
+        self.assertEqual(util.list_entries(), ["CSS", "Django"])
+
+    def test_listing_is_cached_until_directory_changes(self):
+        self.write_entry_file("Django", "# Django")
+        catalog = get_catalog()
+        entries = catalog.titles()
+
+        with override_settings(WIKI_CATALOG_POLL_INTERVAL=0):
+            with patch.object(catalog.storage, 'listdir') as mock_listdir:
+                self.assertIs(catalog.titles(), entries)
+            mock_listdir.assert_not_called()
+
+            # Make sure the directory mtime changes on coarse filesystems
+            os.utime(os.path.join(self.media_root, "entries"), ns=(0, 0))
+            self.write_entry_file("HTML", "# HTML")
+            self.assertEqual(catalog.titles(), ["Django", "HTML"])
+            self.assertEqual(catalog.lowercase(), ["django", "html"])
+
+    def test_save_does_not_hide_changes_made_elsewhere(self):
+        self.write_entry_file("Django", "# Django")
+        catalog = get_catalog()
+        catalog.titles()
+
+        # Make sure the directory mtime changes on coarse filesystems
+        os.utime(os.path.join(self.media_root, "entries"), ns=(0, 0))
+        self.write_entry_file("HTML", "# HTML")
+        util.save_entry("CSS", "# CSS")
+        with override_settings(WIKI_CATALOG_POLL_INTERVAL=0):
+            self.assertEqual(catalog.titles(), ["CSS", "Django", "HTML"])
+
+    def test_case_views_are_built_on_first_use(self):
+        self.write_entry_file("Straße", "# Straße")
+        catalog = get_catalog()
+        catalog.titles()
+        util.save_entry("CSS", "# CSS")
+        self.assertIsNone(catalog._casefolded)
+
+        casefolded = catalog.casefolded()
+        self.assertEqual(casefolded, ["css", "strasse"])
+        self.assertIs(catalog.casefolded(), casefolded)
+
+class RenderCacheTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        render_cache.clear()
+
+    def test_saved_entry_is_rendered_without_reading_storage(self):
+        util.save_entry("Git", "# Git")
+        util.get_render_queue().join()
+
+        with patch.object(util, 'get_entry') as mock_get_entry:
+            self.assertIn("<h1>Git</h1>", util.render_entry("Git"))
+        mock_get_entry.assert_not_called()
+
+    def test_changed_entry_is_rendered_again(self):
+        self.write_entry_file("Git", "# Git")
+        self.assertIn("<h1>Git</h1>", util.render_entry("Git"))
+
+        self.write_entry_file("Git", "# Git is a version control system")
+        self.assertIn("version control", util.render_entry("Git"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = RenderCache(max_bytes=10)
+        cache.set("A", "1", "aaaa")
+        cache.set("B", "1", "bbbb")
+        cache.get("A", "1")
+        cache.set("C", "1", "cccc")
+
+        self.assertEqual(cache.get("A", "1"), "aaaa")
+        self.assertIsNone(cache.get("B", "1"))
+        self.assertEqual(cache.size, 8)
+
+class RenderQueueTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        render_cache.clear()
+
+    def test_repeated_saves_are_rendered_once(self):
+        rendered = []
+        started, release = threading.Event(), threading.Event()
+
+        def handler(title):
+            rendered.append(title)
+            started.set()
+            release.wait()
+
+        queue = RenderQueue(handler, max_pending=2)
+        queue.enqueue("Git")
+        started.wait()
+        for title in ("Git", "CSS", "Git", "HTML", "Python"):
+            queue.enqueue(title)
+        self.assertEqual(queue.depth()[0], 2)
+        release.set()
+        queue.join()
+
+        self.assertEqual(rendered, ["Git", "Git", "CSS"])
+        self.assertEqual(queue.counts, {"enqueued": 3, "coalesced": 1, "dropped": 2, "completed": 3, "failed": 0})
+        self.assertIn('wiki_render_queue_entries_total{result="dropped"} 2', queue.export())
+
+    @override_settings(WIKI_RENDER_QUEUE="worker", WIKI_CACHE_BUS=SQLITE_CACHE_BUS)
+    def test_render_worker_renders_published_entries(self):
+        self.assertIsNone(util.get_render_queue())
+        util.save_entry("Git", "# Git")
+        self.assertIsNone(render_cache.get("Git", util._render_version(util.entry_version("Git"))))
+
+        # As a worker process reading what the web processes published
+        out = StringIO()
+        call_command('render_worker', once=True, stdout=out)
+        self.assertIn("Rendered 1 entries", out.getvalue())
+        self.assertIn("<h1>Git</h1>", render_cache.get("Git", util._render_version(util.entry_version("Git"))))
+
+        # The next run carries on after what was read
+        util.save_entry("CSS", "# CSS")
+        out = StringIO()
+        call_command('render_worker', once=True, stdout=out)
+        self.assertIn("Rendered 1 entries", out.getvalue())
+        self.assertIn("<h1>CSS</h1>", render_cache.get("CSS", util._render_version(util.entry_version("CSS"))))
+
+class CompressionTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        compression.page_cache.clear()
+        self.write_entry_file("Git", "# Git\n\nGit is a version control system.")
+
+    def test_encoding_follows_accept_encoding(self):
+        with self.settings(WIKI_COMPRESSION_ENCODINGS=["gzip"]):
+            self.assertEqual(compression.choose_encoding("gzip, deflate"), "gzip")
+            self.assertEqual(compression.choose_encoding("br;q=1.0, *;q=0.5"), "gzip")
+            self.assertIsNone(compression.choose_encoding("gzip;q=0, identity"))
+            self.assertIsNone(compression.choose_encoding(""))
+
+    @override_settings(WIKI_COMPRESSION_ENCODINGS=["gzip"])
+    def test_entry_page_is_compressed_once(self):
+        plain = self.client.get(reverse('entry', args=["Git"]))
+        response = self.client.get(reverse('entry', args=["Git"]), headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        with patch.object(util, 'render_entry') as mock_render_entry:
+            again = self.client.get(reverse('entry', args=["Git"]), headers={'Accept-Encoding': 'gzip'})
+        mock_render_entry.assert_not_called()
+        self.assertEqual(again.content, response.content)
+
+        response = self.client.get(reverse('entry', args=["Git"]),
+                                   headers={'Accept-Encoding': 'gzip', 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli_is_preferred(self):
+        response = self.client.get(reverse('entry', args=["Git"]), headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn(b"<h1>Git</h1>", compression.brotli.decompress(response.content))
+
+    def test_collectstatic_writes_compressed_copies(self):
+        static_root = os.path.join(self.media_root, "static")
+        with self.settings(STATIC_ROOT=static_root, WIKI_COMPRESSION_ENCODINGS=["gzip"]):
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+        path = os.path.join(static_root, "encyclopedia", "styles.css")
+        with open(path, "rb") as f, gzip.open(f"{path}.gz") as compressed:
+            self.assertEqual(compressed.read(), f.read())
+        self.assertFalse(os.path.exists(os.path.join(static_root, "encyclopedia", "images", "logo-white-180x180.png.gz")))
+
+class FragmentCacheTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        fragment_cache.clear()
+        self.write_entry_file("Git", "# Git")
+
+    def test_entry_body_follows_the_entry_version(self):
+        self.assertContains(self.client.get(reverse('entry', args=["Git"])), "<h1>Git</h1>")
+        self.assertIsNotNone(fragment_cache.get("entry/Git", rendered_page_version(
+            page_version(util.entry_version("Git"), util.backlinks("Git")))))
+
+        self.write_entry_file("Git", "# Git 2")
+        self.assertContains(self.client.get(reverse('entry', args=["Git"])), "<h1>Git 2</h1>")
+
+    def test_fragment_tag_caches_by_key_and_version(self):
+        source = '{% load fragments %}{% fragment "test" key version %}{{ value }}{% endfragment %}'
+        render = lambda **context: Template(source).render(Context(context))
+
+        self.assertEqual(render(key="a", version="1", value="first"), "first")
+        self.assertEqual(render(key="a", version="1", value="second"), "first")
+        self.assertEqual(render(key="a", version="2", value="second"), "second")
+        self.assertEqual(render(key="b", version="1", value="third"), "third")
+        self.assertEqual(render(key="c", version=None, value="fourth"), "fourth")
+        self.assertEqual(render(key="c", version=None, value="fifth"), "fifth")
+        self.assertEqual(render(key="d", value="sixth"), "sixth")
+        self.assertEqual(render(key="d", value="seventh"), "seventh")
+
+class RendererTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        render_cache.clear()
+
+    def test_chunks_split_before_headings_outside_code_blocks(self):
+        text = "# One\n\nFirst [link][ref].\n\n[ref]: /wiki/One\n\n```\n# not a heading\n```\n\n## Two\n\nSee [link][ref].\n"
+        chunks = list(Markdown2Renderer().render_chunks(text, chunk_size=1))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertIn("not a heading", chunks[0])
+        self.assertIn('<h2>Two</h2>', chunks[1])
+        self.assertIn('<a href="/wiki/One">link</a>', chunks[1])
+
+    def test_markdown2_converter_is_not_reused(self):
+        # markdown2's reset() leaves some tables growing across documents
+        renderer = Markdown2Renderer()
+        with patch("encyclopedia.renderers.markdown2.Markdown", wraps=markdown2.Markdown) as mock_markdown:
+            first = renderer.render("# One\n\n`code` and *text*\n")
+            self.assertEqual(renderer.render("# One\n\n`code` and *text*\n"), first)
+        self.assertEqual(mock_markdown.call_count, 2)
+
+    def test_streamed_entry_is_cached_whole(self):
+        self.write_entry_file("Git", "# Git\n\nIntro\n\n## History\n\nText\n")
+        with self.settings(WIKI_RENDER_CHUNK_SIZE=1):
+            chunks = list(util.render_entry_chunks("Git"))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(util.render_entry("Git"), "".join(chunks))
+        self.assertIsNone(util.render_entry_chunks("Missing"))
+
+    @skipUnless(importlib.util.find_spec("markdown_it"), "markdown-it-py is not installed")
+    def test_renderer_is_selectable(self):
+        self.write_entry_file("Git", "# Git\n\n* one\n* two\n")
+        self.assertIn("<h1>Git</h1>", util.render_entry("Git"))
+
+        with self.settings(WIKI_MARKDOWN_RENDERER={'BACKEND': 'encyclopedia.renderers.CommonMarkRenderer'}):
+            with patch.object(CommonMarkRenderer, 'render', return_value="<p>commonmark</p>") as mock_render:
+                self.assertEqual(util.render_entry("Git"), "<p>commonmark</p>")
+            mock_render.assert_called_once()
+
+class PersistentSearchIndexTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_entry_file("Python", "Python is a programming language.")
+        self.write_entry_file("Git", "Git is a version control system.")
+        self.index_path = os.path.join(self.media_root, "search.idx")
+
+    def new_search(self):
+        # A separate instance stands in for another worker process
+        return EntrySearch(get_store(), util.get_entry, util.entry_version, self.index_path)
+
+    def test_index_is_loaded_from_file_without_reading_entries(self):
+        call_command('search_index', stdout=StringIO())
+
+        load = patch.object(util, 'get_entry').start()
+        self.addCleanup(patch.stopall)
+        index = self.new_search().index()
+
+        self.assertIsNotNone(index.base)
+        self.assertEqual(index.search("program")[0][0], "Python")
+        load.assert_not_called()
+
+    def test_saves_are_replayed_by_other_processes(self):
+        call_command('search_index', stdout=StringIO())
+        other = self.new_search()
+        other.index()
+
+        util.save_entry("Git", "Git tracks source code history.")
+        util.save_entry("CSS", "CSS styles web pages.")
+
+        with override_settings(WIKI_CATALOG_POLL_INTERVAL=0):
+            index = other.index()
+        self.assertEqual([title for title, _ in index.search("source")], ["Git"])
+        self.assertEqual([title for title, _ in index.search("version")], [])
+        self.assertEqual([title for title, _ in index.search("styles")], ["CSS"])
+
+    def test_verify_reports_stale_index(self):
+        call_command('search_index', stdout=StringIO())
+        call_command('search_index', verify=True, stdout=StringIO())
+
+        self.write_entry_file("Python", "Python is a snake.")
+        with self.assertRaises(CommandError):
+            call_command('search_index', verify=True, stdout=StringIO(),
+                         stderr=StringIO())
+
+class EntryStoreTestMixin(TempEntriesMixin):
+    def test_save_and_get(self):
+        self.store.save("Python", "# Python")
+        self.store.save("CSS", "# CSS")
+        self.store.save("Python", "# Python 3")
+
+        self.assertEqual(self.store.get("Python"), "# Python 3")
+        self.assertIsNone(self.store.get("Missing"))
+        self.assertEqual(self.store.titles(), ["CSS", "Python"])
+        self.assertEqual(self.store.count(), 2)
+        self.assertEqual(self.store.page(1, 10), ["Python"])
+        self.assertEqual(self.store.page_after("CSS", 10), ["Python"])
+        self.assertEqual(self.store.page_after(None, 1), ["CSS"])
+        self.assertIn(self.store.random_title(), ["CSS", "Python"])
+
+    def test_lines_and_size(self):
+        self.store.save("Café", "# Café\n\nText")
+
+        self.assertEqual(list(self.store.lines("Café")), ["# Café\n", "\n", "Text"])
+        self.assertEqual(self.store.size("Café"), 13)
+        self.assertIsNone(self.store.lines("Missing"))
+        self.assertIsNone(self.store.size("Missing"))
+
+    def test_version_changes_on_save(self):
+        self.assertIsNone(self.store.version("Python"))
+        self.store.save("Python", "# Python")
+        version = self.store.version("Python")
+        self.store.save("Python", "# Python 3")
+        self.assertNotEqual(self.store.version("Python"), version)
+
+    def test_generation_changes_when_titles_change(self):
+        self.store.titles()
+        generation = self.store.generation
+        self.store.save("Python", "# Python")
+        self.assertNotEqual(self.store.generation, generation)
+
+        generation = self.store.generation
+        self.store.delete("Python")
+        self.assertNotEqual(self.store.generation, generation)
+        self.assertEqual(self.store.titles(), [])
+
+    def test_revisions_are_recorded(self):
+        self.assertEqual(self.store.save("Python", "# Python\n\nA language.\n"), 1)
+        for number in range(2, 25):
+            self.assertEqual(self.store.save("Python", f"# Python\n\nA language.\n\n{number}\n"), number)
+
+        self.assertEqual(self.store.revision("Python"), 24)
+        self.assertEqual(len(self.store.history("Python")), 24)
+        self.assertEqual(self.store.get_revision("Python", 1), "# Python\n\nA language.\n")
+        self.assertEqual(self.store.get_revision("Python", 23), "# Python\n\nA language.\n\n23\n")
+
+    def test_stale_base_revision_is_rejected(self):
+        self.store.save("Python", "# Python")
+        self.store.save("Python", "# Python 3", base_revision=1)
+
+        with self.assertRaises(EditConflict):
+            self.store.save("Python", "# Python 2", base_revision=1)
+        self.assertEqual(self.store.get("Python"), "# Python 3")
+
+    def test_save_revisions_writes_the_last_content(self):
+        self.store.save("Python", "# Python")
+        self.assertEqual(self.store.save_revisions("Python", ["# Python 2", "# Python 3"], base_revision=1), 3)
+
+        self.assertEqual(self.store.get("Python"), "# Python 3")
+        self.assertEqual(self.store.get_revision("Python", 2), "# Python 2")
+        with self.assertRaises(EditConflict):
+            self.store.save_revisions("Python", ["# Python 4"], base_revision=1)
+
+class FileSystemEntryStoreTest(EntryStoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = FileSystemEntryStore()
+
+    def test_existing_entry_starts_history_with_its_content(self):
+        self.write_entry_file("Git", "# Git")
+        self.assertEqual(self.store.revision("Git"), 0)
+
+        self.assertEqual(self.store.save("Git", "# Git 2", base_revision=0), 2)
+        self.assertEqual(self.store.get_revision("Git", 1), "# Git")
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "entries")), ["Git.md"])
+
+    def test_save_many_adds_the_batch_to_the_catalog_at_once(self):
+        self.store.save("CSS", "# CSS")
+        self.store.titles()
+        generation = self.store.generation
+
+        self.store.save_many([("Python", "# Python", None), ("Git", "# Git", None), ("CSS", "# CSS 2", None)])
+        self.assertEqual(self.store.generation, generation + 1)
+        self.assertEqual(self.store.titles(), ["CSS", "Git", "Python"])
+
+    def test_revisions_stay_in_their_directory(self):
+        self.store.save("../entries/Sub", "# Sub")
+        self.store.save("..", "# Dots")
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.media_root, "revisions"))),
+                         ["%2E.", "%2E.%2Fentries%2FSub"])
+        self.assertEqual(self.store.get_revision("../entries/Sub", 1), "# Sub")
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "entries", "Sub")))
+
+class SQLiteEntryStoreTest(EntryStoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = SQLiteEntryStore(os.path.join(self.media_root, "entries.sqlite3"))
+
+    def test_entry_view_serves_stored_html(self):
+        path = os.path.join(self.media_root, "entries.sqlite3")
+        with override_settings(WIKI_ENTRY_STORE={
+                'BACKEND': 'encyclopedia.stores.SQLiteEntryStore', 'OPTIONS': {'path': path}}):
+            util.save_entry("Python", "# Python")
+            util.get_render_queue().join()
+            render_cache.clear()
+
+            with patch.object(Markdown2Renderer, 'render') as mock_render:
+                response = self.client.get(reverse('entry', args=["Python"]))
+            mock_render.assert_not_called()
+
+        self.assertContains(response, "<h1>Python</h1>")
+        self.assertEqual(util.list_entries(), [])
+
+    def test_stored_html_of_another_renderer_is_not_served(self):
+        path = os.path.join(self.media_root, "entries.sqlite3")
+        with override_settings(WIKI_ENTRY_STORE={
+                'BACKEND': 'encyclopedia.stores.SQLiteEntryStore', 'OPTIONS': {'path': path}}):
+            util.save_entry("Python", "# Python")
+            util.get_render_queue().join()
+            render_cache.clear()
+
+            with self.settings(WIKI_MARKDOWN_RENDERER={'OPTIONS': {'extras': ['header-ids']}}):
+                response = self.client.get(reverse('entry', args=["Python"]))
+                self.assertContains(response, '<h1 id="python">Python</h1>')
+
+            self.assertEqual(get_store().rendered("Python")[1:], ("markdown2", "<h1>Python</h1>\n"))
+
+    def test_random_titles_stay_uniform_after_edits_and_deletes(self):
+        self.store.save_many([(f"A{n:02d}", "# A", None) for n in range(10)])
+        for number in range(300):
+            self.store.save("A00", f"# A {number}")
+        self.store.save_many([(f"B{n:02d}", "# B", None) for n in range(10)])
+        self.assert_uniform_picks(20)
+
+        # Deletes leave ids too sparse for probing
+        self.store.save_many([(f"C{n:03d}", "# C", None) for n in range(300)])
+        for n in range(300):
+            self.store.delete(f"C{n:03d}")
+        self.assert_uniform_picks(20)
+
+    def assert_uniform_picks(self, count):
+        picks = Counter(self.store.random_title() for _ in range(100 * count))
+        self.assertEqual(len(picks), count)
+        self.assertLess(max(picks.values()), 250)
+
+@override_settings(WIKI_CATALOG_POLL_INTERVAL=0)
+class PackedEntryStoreTest(EntryStoreTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.media_root, "packed")
+        self.store = PackedEntryStore(self.path, max_segment_size=1024)
+
+    def test_revisions_are_recorded(self):
+        # Only the latest version of an entry is kept
+        self.assertEqual(self.store.save("Python", "# Python"), 1)
+        self.assertEqual(self.store.save("Python", "# Python 3"), 2)
+
+        self.assertEqual(self.store.revision("Python"), 2)
+        self.assertEqual([item["revision"] for item in self.store.history("Python")], [2])
+        self.assertEqual(self.store.get_revision("Python", 2), "# Python 3")
+        self.assertIsNone(self.store.get_revision("Python", 1))
+
+    def test_save_revisions_writes_the_last_content(self):
+        self.store.save("Python", "# Python")
+        self.assertEqual(self.store.save_revisions("Python", ["# Python 2", "# Python 3"], base_revision=1), 3)
+        self.assertEqual(self.store.get("Python"), "# Python 3")
+        self.assertEqual(self.store.revision("Python"), 3)
+
+    def test_buffered_edits_keep_their_revisions(self):
+        with override_settings(WIKI_ENTRY_STORE={
+                'BACKEND': 'encyclopedia.stores.PackedEntryStore', 'OPTIONS': {'path': self.path}}):
+            util.save_entry("Python", "# Python")
+            buffer = WriteBuffer(util.save_entry_revisions, util.entry_revision, window=60)
+            self.assertEqual(buffer.submit("Python", "# Python 2", base_revision=1), 2)
+            self.assertEqual(buffer.submit("Python", "# Python 3", base_revision=2), 3)
+            buffer.flush()
+
+            self.assertEqual(util.entry_revision("Python"), 3)
+            self.assertEqual(util.save_entry("Python", "# Python 4", base_revision=3), 4)
+            self.assertEqual(util.get_entry("Python"), "# Python 4")
+
+    def test_entries_are_packed_into_segments(self):
+        contents = {f"Entry{n:03d}": f"# Entry {n}\n\n" + "Some text. " * 40 for n in range(40)}
+        self.store.save_many([(title, content, None) for title, content in contents.items()])
+
+        segments = [name for name in os.listdir(self.path) if name.endswith(".seg")]
+        self.assertLess(len(segments), 10)
+        # Another process reads what this one wrote
+        other = PackedEntryStore(self.path)
+        self.assertEqual(other.titles(), sorted(contents))
+        self.assertEqual(other.get("Entry007"), contents["Entry007"])
+        self.store.save("Entry007", "# Changed")
+        self.assertEqual(other.get("Entry007"), "# Changed")
+
+    def test_compaction_keeps_latest_versions(self):
+        for number in range(30):
+            self.store.save("Python", f"# Python {number}\n\n" + "A language. " * 20)
+        self.store.save("CSS", "# CSS")
+        self.store.save("Perl", "# Perl")
+        self.store.delete("Perl")
+        version = self.store.version("Python")
+
+        out = StringIO()
+        with override_settings(WIKI_ENTRY_STORE={
+                'BACKEND': 'encyclopedia.stores.PackedEntryStore', 'OPTIONS': {'path': self.path}}):
+            call_command('compact_entries', train_dictionary=True, stdout=out)
+        self.assertRegex(out.getvalue(), r"Rewrote [2-9] segments")
+
+        for store in (self.store, PackedEntryStore(self.path)):
+            self.assertEqual(store.titles(), ["CSS", "Python"])
+            self.assertTrue(store.get("Python").startswith("# Python 29"))
+            self.assertEqual(store.revision("Python"), 30)
+        self.assertNotEqual(self.store.version("Python"), version)
+        self.assertEqual(len([name for name in os.listdir(self.path) if name.endswith(".seg")]), 1)
+        self.assertEqual(self.store.save("Python", "# Python", base_revision=30), 31)
+
+    def test_compaction_needs_packed_store(self):
+        with self.assertRaises(CommandError):
+            call_command('compact_entries', stdout=StringIO())
+
+class RevisionDeltaTest(TestCase):
+    def test_delta_round_trip(self):
+        old = "# Title\n\nFirst paragraph.\n\nSecond paragraph.\n"
+        new = "# Title\n\nSecond paragraph.\n\nThird paragraph.\n"
+        self.assertEqual(apply_delta(old, make_delta(old, new)), new)
+
+class EditConflictViewTest(TempEntriesMixin, TestCase):
+    def test_stale_edit_is_rejected(self):
+        util.save_entry("Git", "# Git")
+        util.save_entry("Git", "# Git, changed elsewhere")
+
+        response = self.client.post(reverse('edit', args=["Git"]),
+                                    data={'title': "Git", 'content': "# Mine", 'revision': 1})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, "changed while you were editing", status_code=409)
+        self.assertEqual(response.context['form']['revision'].value(), 2)
+        self.assertEqual(util.get_entry("Git"), "# Git, changed elsewhere")
+
+class WriteBufferTest(TempEntriesMixin, TestCase):
+    def tearDown(self):
+        for buffer in util._write_buffers.values():
+            buffer.flush()
+        util._write_buffers.clear()
+        super().tearDown()
+
+    def test_buffered_edits_are_saved_together(self):
+        util.save_entry("Git", "# Git")
+        buffer = WriteBuffer(util.save_entry_revisions, util.entry_revision, window=60)
+
+        with patch.object(util, 'save_entry_revisions', wraps=util.save_entry_revisions) as mock_save:
+            buffer.save = mock_save
+            self.assertEqual(buffer.submit("Git", "# Git 2", base_revision=1), 2)
+            self.assertEqual(buffer.submit("Git", "# Git 3", base_revision=2), 3)
+            with self.assertRaises(EditConflict):
+                buffer.submit("Git", "# Stale", base_revision=1)
+            self.assertEqual(buffer.pending("Git"), ("# Git 3", 3))
+            self.assertEqual(util.get_entry("Git"), "# Git")
+
+            buffer.flush()
+        mock_save.assert_called_once_with("Git", ["# Git 2", "# Git 3"], 1)
+        self.assertIsNone(buffer.pending("Git"))
+        self.assertEqual(util.get_entry("Git"), "# Git 3")
+        self.assertEqual(get_store().get_revision("Git", 2), "# Git 2")
+        self.assertEqual(buffer.counts["coalesced"], 1)
+
+    def test_edits_beyond_the_rate_limits_are_refused(self):
+        buffer = WriteBuffer(lambda title, contents, base_revision: None, lambda title: None,
+                             window=0, title_rate=2, global_rate=3)
+        buffer.submit("Git", "# Git")
+        buffer.submit("Git", "# Git 2")
+        with self.assertRaises(RateLimited) as raised:
+            buffer.submit("Git", "# Git 3")
+        self.assertAlmostEqual(raised.exception.retry_after, 30, delta=1)
+        buffer.submit("CSS", "# CSS")
+        with self.assertRaises(RateLimited):
+            buffer.submit("HTML", "# HTML")
+        self.assertEqual(buffer.counts["limited"], 2)
+
+    def test_rates_below_one_edit_per_minute_allow_an_edit(self):
+        limit = RateLimit(0.5)
+        self.assertEqual(limit.take("Git", 0), 0)
+        self.assertEqual(limit.take("Git", 60), 60)
+        self.assertEqual(limit.take("Git", 120), 0)
+
+    @override_settings(WIKI_WRITE_BUFFER_WINDOW=60, WIKI_WRITE_RATE_PER_TITLE=2)
+    def test_edit_view_buffers_and_limits_edits(self):
+        util.save_entry("Git", "# Git")
+        url = reverse('edit', args=["Git"])
+
+        response = self.client.post(url, data={'title': "Git", 'content': "# Git 2", 'revision': 1})
+        self.assertEqual(response.status_code, 302)
+        form = self.client.get(url).context['form']
+        self.assertEqual((form.initial['content'], form.initial['revision']), ("# Git 2", 2))
+
+        self.client.post(url, data={'title': "Git", 'content': "# Git 3", 'revision': 2})
+        response = self.client.post(url, data={'title': "Git", 'content': "# Git 4", 'revision': 3})
+        self.assertContains(response, "edited too often", status_code=429)
+        self.assertEqual(response["Retry-After"], "30")
+
+        util.get_write_buffer().flush()
+        self.assertEqual(util.get_entry("Git"), "# Git 3")
+
+class ExportSiteTest(TempEntriesMixin, TestCase):
+    def export(self):
+        out = StringIO()
+        call_command('export_site', self.output, workers=1, stdout=out)
+        return out.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        self.output = os.path.join(self.media_root, "site")
+        self.write_entry_file("Python", "# Python\n\nPython is a language.")
+        self.write_entry_file("Git", "# Git")
+
+    def test_export_writes_entries_index_and_search(self):
+        self.assertIn("(2 rendered)", self.export())
+
+        with open(os.path.join(self.output, "wiki", "Python", "index.html")) as f:
+            self.assertIn("<h1>Python</h1>", f.read())
+        with open(os.path.join(self.output, "index.html")) as f:
+            self.assertIn('href="/wiki/Git/"', f.read())
+        with open(os.path.join(self.output, "search", "documents.json")) as f:
+            self.assertEqual(json.load(f)["titles"], ["Git", "Python"])
+        with open(os.path.join(self.output, "search", "6c.json")) as f:
+            self.assertEqual(json.load(f)["language"], [[1, 1]])
+
+    def test_export_lists_backlinks(self):
+        self.export()
+        util.save_entry("CSS", "[Git](/wiki/git)")
+        self.assertIn("(2 rendered)", self.export())
+
+        with open(os.path.join(self.output, "wiki", "Git", "index.html")) as f:
+            self.assertIn('href="/wiki/CSS/"', f.read())
+
+    def test_export_only_renders_changed_entries(self):
+        self.export()
+        self.assertIn("(0 rendered)", self.export())
+
+        util.save_entry("Git", "# Git 2")
+        self.assertIn("(1 rendered)", self.export())
+
+        os.remove(os.path.join(self.media_root, "entries", "Git.md"))
+        get_catalog().invalidate()
+        self.export()
+        self.assertFalse(os.path.exists(os.path.join(self.output, "wiki", "Git")))
+
+    def test_export_renders_entries_again_after_renderer_change(self):
+        self.export()
+        with self.settings(WIKI_MARKDOWN_RENDERER={'OPTIONS': {'extras': ['header-ids']}}):
+            self.assertIn("(2 rendered)", self.export())
+
+        with open(os.path.join(self.output, "wiki", "Git", "index.html")) as f:
+            self.assertIn('<h1 id="git">Git</h1>', f.read())
+
+@override_settings(WIKI_INSTRUMENTATION=True)
+class InstrumentationTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        instrumentation.reset()
+        render_cache.clear()
+        self.write_entry_file("Python", "# Python\n\nPython is a language.")
+
+    def test_entry_view_reports_phase_timings(self):
+        response = self.client.get(reverse('entry', args=["Python"]))
+
+        phases = [part.split(";")[0] for part in response['Server-Timing'].split(", ")]
+        self.assertEqual(sorted(phases), ["markdown", "storage", "template", "total"])
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('wiki_request_phase_seconds_count{view="entry",phase="markdown"} 1', metrics)
+        self.assertIn('wiki_request_phase_seconds_bucket{view="entry",phase="total",le="+Inf"} 1', metrics)
+
+    def test_nested_phases_are_not_counted_twice(self):
+        timings, token = instrumentation.start()
+        try:
+            with instrumentation.phase("search"):
+                with instrumentation.phase("storage"):
+                    pass
+        finally:
+            instrumentation.stop(token)
+        self.assertLessEqual(sum(timings.durations.values()), timings.total())
+
+    def test_sampled_requests_are_profiled(self):
+        directory = os.path.join(self.media_root, "profiles")
+        with self.settings(WIKI_PROFILE_SAMPLE_RATE=1.0, WIKI_PROFILE_DIR=directory):
+            self.client.get(reverse('entry', args=["Python"]))
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    @override_settings(WIKI_INSTRUMENTATION=False)
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse('entry', args=["Python"]))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+class TitleResolutionTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_entry_file("Python", "# Python")
+        self.write_entry_file("High_Level_Programming_Language", "# HLL")
+        self.write_entry_file("Café", "# Café")
+
+    def test_titles_resolve_across_case_spacing_and_normalization(self):
+        self.assertEqual(util.resolve_title("Python"), "Python")
+        self.assertEqual(util.resolve_title("pYthon"), "Python")
+        self.assertEqual(util.resolve_title("high level  programming_language"), "High_Level_Programming_Language")
+        self.assertEqual(util.resolve_title("Cafe\u0301"), "Café")
+        self.assertIsNone(util.resolve_title("Perl"))
+
+        util.save_entry("perl", "# Perl")
+        self.assertEqual(util.resolve_title("PERL"), "perl")
+
+    def test_entry_view_redirects_to_canonical_title(self):
+        response = self.client.get(reverse('entry', args=["python"]))
+        self.assertRedirects(response, reverse('entry', args=["Python"]), status_code=301)
+
+    def test_create_rejects_title_differing_in_case(self):
+        response = self.client.post(reverse('create'), data={'title': "PYTHON", 'content': "# Other"})
+        self.assertContains(response, "Already Exists")
+        self.assertEqual(util.list_entries(), ["Café", "High_Level_Programming_Language", "Python"])
+
+    def test_links_to_other_spellings_are_not_broken(self):
+        util.save_entry("Django", "[Python](/wiki/python) and [Perl](/wiki/Perl)")
+        self.assertEqual(util.broken_links(), [("Django", "Perl")])
+
+@override_settings(WIKI_CACHE_BUS=SQLITE_CACHE_BUS, WIKI_CACHE_BUS_POLL_INTERVAL=0)
+class CacheBusTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_entry_file("Python", "# Python\n\nSee [Git](/wiki/Git).")
+        self.write_entry_file("Git", "# Git")
+        # Reads from here on, as the first request would
+        self.bus = get_bus()
+        # Another process sharing the entries and the bus
+        self.other = CacheBus(SQLiteTransport(), poll_interval=0)
+
+    def test_saves_are_published_to_other_processes(self):
+        self.other.poll()
+        util.save_entry("Git", "# Git 2")
+        util.save_entry("CSS", "# CSS")
+        self.assertEqual(self.other.poll(), {"Git", "CSS"})
+        self.assertEqual(self.other.poll(), set())
+        self.assertEqual(self.bus.poll(), set())
+
+    def test_caches_follow_saves_in_other_processes(self):
+        self.assertEqual(util.list_entries(), ["Git", "Python"])
+        self.assertEqual(util.backlinks("Git"), ["Python"])
+
+        self.write_entry_file("Python", "# Python")
+        self.write_entry_file("CSS", "[Git](/wiki/Git)")
+        self.other.publish("Python")
+        self.other.publish("CSS")
+        self.client.get(reverse('index'))
+
+        self.assertEqual(util.list_entries(), ["CSS", "Git", "Python"])
+        self.assertEqual(util.backlinks("Git"), ["CSS"])
+        self.assertEqual(util.resolve_title("css"), "CSS")
+
+    def test_lost_messages_clear_every_cache(self):
+        self.other.transport.max_messages = 2
+        util.render_entry("Git")
+        for title in ("A", "B", "C"):
+            self.other.publish(title)
+        with patch.object(util, "clear_caches") as clear_caches:
+            util.sync_caches()
+        clear_caches.assert_called_once_with()
+
+class SuggestTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for title in ("Python", "PyPI", "High_Level_Programming_Language", "HTML", "Hi"):
+            self.write_entry_file(title, f"# {title}")
+
+    def test_titles_are_suggested_by_prefix(self):
+        self.assertEqual(util.suggest_titles("py"), ["PyPI", "Python"])
+        self.assertEqual(util.suggest_titles("h", limit=2), ["Hi", "High_Level_Programming_Language"])
+        self.assertEqual(util.suggest_titles("high level p"), ["High_Level_Programming_Language"])
+        self.assertEqual(util.suggest_titles("hi "), [])
+        self.assertEqual(util.suggest_titles("  "), [])
+
+        util.save_entry("Pygments", "# Pygments")
+        self.assertEqual(util.suggest_titles("py"), ["Pygments", "PyPI", "Python"])
+
+    def test_suggest_view(self):
+        response = self.client.get(reverse('suggest'), {'q': "PY", 'limit': 1})
+        self.assertEqual(response.json(), {"query": "PY", "titles": ["PyPI"]})
+        self.assertIn("max-age=60", response['Cache-Control'])
+
+        response = self.client.get(reverse('suggest'), {'q': "x", 'limit': "lots"})
+        self.assertEqual(response.json()["titles"], [])
+
+class LinkGraphTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_entry_file("Python", "# Python\n\nSee [Git](/wiki/Git) and [Perl](/wiki/Perl/).")
+        self.write_entry_file("Git", "# Git\n\n[python]: /wiki/Python\n")
+        self.write_entry_file("CSS", '<a href="/wiki/Git">Git</a>')
+
+    def test_links_are_read_from_entries(self):
+        self.assertEqual(util.backlinks("Git"), ["CSS", "Python"])
+        self.assertEqual(util.get_links().links("Python"), ["Git", "Perl"])
+        self.assertEqual(util.broken_links(), [("Python", "Perl")])
+
+    def test_links_follow_saved_entries(self):
+        util.backlinks("Git")
+        util.save_entry("Python", "# Python\n\nSee [Perl](/wiki/Perl).")
+        util.save_entry("Perl", "# Perl")
+
+        self.assertEqual(util.backlinks("Git"), ["CSS"])
+        self.assertEqual(util.backlinks("Perl"), ["Python"])
+        self.assertEqual(util.broken_links(), [])
+
+    def test_links_under_other_spellings_are_backlinks(self):
+        self.write_entry_file("HTML", "# HTML\n\nSee [git](/wiki/git) and [perl](/wiki/perl).")
+
+        self.assertEqual(util.backlinks("Git"), ["CSS", "HTML", "Python"])
+        self.assertEqual(util.broken_links(), [("HTML", "perl"), ("Python", "Perl")])
+        util.save_entry("Perl", "# Perl")
+        self.assertEqual(util.backlinks("Perl"), ["HTML", "Python"])
+        self.assertEqual(util.broken_links(), [])
+
+    def test_entry_page_lists_backlinks(self):
+        response = self.client.get(reverse('entry', args=["Git"]))
+        self.assertContains(response, "Pages that link here")
+        self.assertContains(response, 'href="/wiki/CSS/"')
+
+        etag = response['ETag']
+        util.save_entry("HTML", "[Git](/wiki/Git)")
+        response = self.client.get(reverse('entry', args=["Git"]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_broken_links_command(self):
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('broken_links', stdout=out)
+        self.assertIn("Python -> Perl", out.getvalue())
+
+class ImportExportEntriesTest(TempEntriesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        util.save_entry("Python", "# Python\n\nPython is a language.")
+        util.save_entry("Café", "# Café")
+
+    def round_trip(self, filename):
+        path = os.path.join(self.media_root, filename)
+        call_command('export_entries', path, stdout=StringIO())
+
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp(dir=self.media_root)):
+            out = StringIO()
+            call_command('import_entries', path, workers=1, batch_size=1, stdout=out)
+            self.assertIn("Imported 2 entries", out.getvalue())
+            self.assertEqual(util.list_entries(), ["Café", "Python"])
+            self.assertEqual(util.get_entry("Café"), "# Café")
+            self.assertEqual(util.search_entries("language")[0]["title"], "Python")
+
+    def test_round_trip_through_tarball(self):
+        self.round_trip("wiki.tar.gz")
+
+    def test_round_trip_through_jsonl(self):
+        self.round_trip("wiki.jsonl.gz")
+
+    def test_import_skips_existing_entries(self):
+        source = os.path.join(self.media_root, "import")
+        os.mkdir(source)
+        for title in ["Python", "Git"]:
+            with open(os.path.join(source, f"{title}.md"), "w") as f:
+                f.write(f"# Imported {title}")
+
+        out = StringIO()
+        call_command('import_entries', source, skip_existing=True, stdout=out)
+
+        self.assertIn("Imported 1 entries (1 skipped)", out.getvalue())
+        self.assertEqual(util.get_entry("Python"), "# Python\n\nPython is a language.")
+        self.assertEqual(util.get_entry("Git"), "# Imported Git")
+
+    @override_settings(
+        WIKI_CACHE_BUS=SQLITE_CACHE_BUS, WIKI_CACHE_BUS_POLL_INTERVAL=0, WIKI_PURGE_URLS=['http://proxy.local/'])
+    def test_saving_in_bulk_notifies_once_per_batch(self):
+        other = CacheBus(SQLiteTransport(), poll_interval=0)
+        queue = util.get_render_queue()
+        enqueued = queue.counts["enqueued"]
+        with patch.object(purge.threading, 'Thread') as mock_thread:
+            util.save_entries(iter([("A", "# A"), ("B", "# B"), ("C", "# C")]), batch_size=2)
+        mock_thread.assert_not_called()
+        self.assertEqual(queue.counts["enqueued"], enqueued)
+
+        self.assertEqual(len(other.transport.read(other.cursor)[1]), 2)
+        self.assertIsNone(other.poll())
+        self.assertEqual(util.list_entries(), ["A", "B", "C", "Café", "Python"])
+
+    def test_sqlite_store_saves_batches_with_html(self):
+        path = os.path.join(self.media_root, "entries.sqlite3")
+        with self.settings(WIKI_ENTRY_STORE={
+                'BACKEND': 'encyclopedia.stores.SQLiteEntryStore', 'OPTIONS': {'path': path}}):
+            self.assertEqual(util.save_entries(iter([("A", "# A"), ("B", "# B")]), batch_size=1), 2)
+            self.assertEqual(get_store().rendered("B")[2], "<h1>B</h1>\n")
+            self.assertEqual(get_store().revision("A"), 1)
 
 # Forms Tests
 class CreateEntryFormTest(TestCase):
@@ -268,6 +1408,12 @@ class CreateEntryFormTest(TestCase):
         self.assertFalse(form.is_valid())
         self.assertIn('title', form.errors)
 
+    def test_create_form_rejects_path_titles(self):
+        for title in ("../entries/Sub", "A/B", "A\\B", ".."):
+            form = NewEntryForm(data={'title': title, 'content': 'Text'})
+            self.assertFalse(form.is_valid())
+            self.assertIn('title', form.errors)
+
 class EditEntryFormTest(TestCase):
     def test_edit_form_valid_data(self):
         form_data = {
@@ -0,0 +1,117 @@
+import bisect
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_title(title):
+    """
+    Returns the key under which titles that only differ in case, Unicode
+    normalization form, underscores or repeated spaces are the same.
+    """
+    title = unicodedata.normalize("NFKC", title).casefold()
+    return " ".join(title.replace("_", " ").split())
+
+
+def normalize_prefix(prefix):
+    """
+    Returns the normalized form of the start of a title, keeping a
+    trailing separator so that it only matches at word boundaries.
+    """
+    key = normalize_title(prefix)
+    if key and (prefix[-1:].isspace() or prefix.endswith("_")):
+        key += " "
+    return key
+
+
+class TitleIndex:
+    """
+    Maps normalized titles to the titles of an entry store, kept in line
+    with the store's generation. When several titles normalize alike, the
+    first in sorted order is the canonical one.
+
+    The normalized titles are also kept in a sorted array, searched with
+    bisect for completions, whose results are cached for the
+    cache_size most recently asked prefixes until the titles change.
+    """
+
+    def __init__(self, store, cache_size=1024):
+        self.store = store
+        self.cache_size = cache_size
+        self._exact = set()
+        self._canonical = {}
+        self._keys = []
+        self._titles = []
+        self._completions = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def resolve(self, title):
+        """
+        Returns the title of the entry that title refers to: itself if an
+        entry has exactly that title, otherwise the canonical title it
+        normalizes to, or None.
+        """
+        self._sync()
+        if title in self._exact:
+            return title
+        return self._canonical.get(normalize_title(title))
+
+    def complete(self, prefix, limit):
+        """
+        Returns up to limit titles whose normalized form starts with the
+        normalized prefix, in the order of their normalized forms.
+        """
+        self._sync()
+        key = normalize_prefix(prefix)
+        if not key:
+            return []
+        with self._lock:
+            cached = self._completions.get((key, limit))
+            if cached is not None:
+                self._completions.move_to_end((key, limit))
+                return cached
+            keys, titles = self._keys, self._titles
+            start = bisect.bisect_left(keys, key)
+            end = start
+            while end < len(keys) and end - start < limit and keys[end].startswith(key):
+                end += 1
+            completions = titles[start:end]
+            self._completions[(key, limit)] = completions
+            if len(self._completions) > self.cache_size:
+                self._completions.popitem(last=False)
+            return completions
+
+    def add(self, title):
+        """
+        Records that an entry with the given title has been saved.
+        """
+        with self._lock:
+            if self._generation is None or title in self._exact:
+                return
+            self._exact.add(title)
+            key = normalize_title(title)
+            if key not in self._canonical or title < self._canonical[key]:
+                self._canonical[key] = title
+            index = bisect.bisect_right(self._keys, key)
+            self._keys.insert(index, key)
+            self._titles.insert(index, title)
+            self._completions.clear()
+            self._generation = self.store.generation
+
+    def _sync(self):
+        # Listing the titles first lets the store notice outside changes
+        titles = self.store.titles()
+        generation = self.store.generation
+        if generation == self._generation:
+            return
+        with self._lock:
+            pairs = sorted((normalize_title(title), title) for title in titles)
+            canonical = {}
+            for key, title in pairs:
+                canonical.setdefault(key, title)
+            self._exact, self._canonical = set(titles), canonical
+            self._keys = [key for key, _ in pairs]
+            self._titles = [title for _, title in pairs]
+            self._completions.clear()
+            self._generation = generation
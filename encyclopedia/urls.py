@@ -1,12 +1,18 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+if getattr(settings, "WIKI_ASYNC_VIEWS", False):
+    views = async_views
 
 urlpatterns = [
     path("", views.index, name="index"),
     path("wiki/<str:title>/", views.entry, name="entry"),
     path("search/", views.search, name="search"),
+    path("suggest/", views.suggest, name="suggest"),
     path("random/", views.random, name="random"),
     path("create/", views.create, name="create"),
-    path("edit/<str:title>/", views.edit, name="edit")
+    path("edit/<str:title>/", views.edit, name="edit"),
+    path("metrics/", views.metrics, name="metrics")
 ]
@@ -1,28 +1,333 @@
-import re
+import asyncio
+import atexit
+import contextvars
+import functools
+import hashlib
+import itertools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
+import django
+from django.conf import settings
 
+from .bus import get_bus
+from .cache import render_cache
+from .instrumentation import phase
+from .links import LinkGraph
+from .renderers import get_renderer
+from .revisions import EditConflict
+from .signals import entries_saved, entry_saved
+from .search import EntrySearch, snippet
+from .stores import get_store
+from .titles import TitleIndex
+from .workqueue import RenderQueue
+from .writes import RateLimited, WriteBuffer
 
-def list_entries():
+
+def list_entries(offset=0, limit=None):
+    """
+    Returns a list of names of encyclopedia entries in sorted order,
+    all of them by default or up to limit names starting at offset.
+    The full list is shared with the entry store and must not be
+    modified.
+    """
+    with phase("storage"):
+        if limit is None:
+            titles = get_store().titles()
+            return titles[offset:] if offset else titles
+        return get_store().page(offset, limit)
+
+
+def list_entries_after(title, limit):
+    """
+    Returns up to limit names of encyclopedia entries that sort after
+    title, or from the first one if title is None. Unlike offsets, a
+    title keeps pointing at the same place when entries are added.
+    """
+    with phase("storage"):
+        return get_store().page_after(title, limit)
+
+
+def count_entries():
     """
-    Returns a list of all names of encyclopedia entries.
+    Returns the number of encyclopedia entries.
     """
-    _, filenames = default_storage.listdir("entries")
-    return list(sorted(re.sub(r"\.md$", "", filename)
-                for filename in filenames if filename.endswith(".md")))
+    with phase("storage"):
+        return get_store().count()
+
+
+RANDOM_ATTEMPTS = 5
 
 
-def save_entry(title, content):
+def random_entry(exclude=()):
+    """
+    Returns the name of a random encyclopedia entry, trying a few times
+    to avoid those in exclude, or None if there are no entries.
+    """
+    store = get_store()
+    with phase("storage"):
+        title = store.random_title()
+        for _ in range(RANDOM_ATTEMPTS):
+            if title not in exclude:
+                break
+            title = store.random_title()
+    return title
+
+
+class EntryListing:
+    """
+    Sequence of all entry names that fetches only the slices asked for,
+    so that a Paginator over it costs one page per request.
+    """
+
+    def count(self):
+        return count_entries()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self.count())
+            return list_entries(start, max(0, stop - start))
+        return list_entries(index, 1)[0]
+
+
+def save_entry(title, content, base_revision=None):
     """
     Saves an encyclopedia entry, given its title and Markdown
     content. If an existing entry with the same title already exists,
-    it is replaced.
+    it is replaced. If base_revision is given and the entry has been
+    saved since that revision, EditConflict is raised instead.
+    Returns the new revision number, if the store keeps revisions.
+    """
+    return save_entry_revisions(title, [content], base_revision)
+
+
+def save_entry_revisions(title, contents, base_revision=None):
+    """
+    Saves successive Markdown contents of an encyclopedia entry at once,
+    like save_entry does for one: each is kept as a revision, but only
+    the last one is written, rendered and indexed.
+    """
+    content = contents[-1]
+    html = None
+    renderer = get_renderer()
+    prewarm = getattr(settings, "WIKI_RENDER_CACHE_PREWARM", True)
+    if prewarm and not getattr(settings, "WIKI_RENDER_QUEUE", None):
+        with phase("markdown"):
+            html = renderer.render(content)
+
+    store = get_store()
+    with phase("storage"):
+        if len(contents) == 1:
+            revision = store.save(title, content, html, base_revision, renderer.key)
+        else:
+            revision = store.save_revisions(title, contents, html, base_revision, renderer.key)
+
+    render_cache.delete(title)
+    if html is not None:
+        version = entry_version(title)
+        if version is not None:
+            render_cache.set(title, _render_version(version, renderer), html)
+
+    with phase("search"):
+        get_search().update(title, content)
+    get_links().update(title, content)
+    get_titles().add(title)
+    entry_saved.send(sender=store.__class__, title=title, revision=revision)
+
+    queue = get_render_queue()
+    if queue is not None and prewarm:
+        queue.enqueue(title)
+    return revision
+
+
+def save_entries(entries, batch_size=500, workers=1):
+    """
+    Saves many encyclopedia entries, given an iterable of (title, content)
+    pairs, writing them to the store batch_size at a time. Markdown is
+    rendered ahead in workers processes for stores that keep the HTML,
+    and the search index is rebuilt once at the end instead of being
+    updated per entry. entries_saved is sent once per batch instead of
+    entry_saved per entry: other processes clear their caches, while
+    reverse proxies are not purged and entries are not queued for
+    rendering. Returns the number of entries saved.
+    """
+    entries = iter(entries)
+    store = get_store()
+    executor = None
+    if store.stores_html and workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=django.setup)
+
+    saved = 0
+    try:
+        while batch := list(itertools.islice(entries, batch_size)):
+            contents = [content for _, content in batch]
+            if not store.stores_html:
+                htmls = [None] * len(batch)
+            elif executor is not None:
+                htmls = list(executor.map(_render_markdown, contents, chunksize=max(len(batch) // workers, 1)))
+            else:
+                htmls = [_render_markdown(content) for content in contents]
+
+            with phase("storage"):
+                store.save_many(
+                    [(title, content, html) for (title, content), html in zip(batch, htmls)],
+                    get_renderer().key)
+            links, titles = get_links(), get_titles()
+            for title, content in batch:
+                render_cache.delete(title)
+                links.update(title, content)
+                titles.add(title)
+            entries_saved.send(sender=store.__class__, titles=[title for title, _ in batch])
+            saved += len(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with phase("search"):
+        get_search().rebuild()
+    return saved
+
+
+def _render_markdown(content):
+    return get_renderer().render(content)
+
+
+_render_queue = None
+_render_queue_lock = threading.Lock()
+
+
+def get_render_queue():
+    """
+    Returns the queue of saved entries that background threads render
+    ahead of their first view, or None unless WIKI_RENDER_QUEUE is
+    "thread".
+    """
+    global _render_queue
+    if getattr(settings, "WIKI_RENDER_QUEUE", None) != "thread":
+        return None
+    with _render_queue_lock:
+        if _render_queue is None:
+            _render_queue = RenderQueue(
+                warm_entry,
+                workers=getattr(settings, "WIKI_RENDER_QUEUE_WORKERS", 1),
+                max_pending=getattr(settings, "WIKI_RENDER_QUEUE_MAX_PENDING", 1000),
+            )
+        return _render_queue
+
+
+_write_buffers = {}
+_write_buffers_lock = threading.Lock()
+
+
+def get_write_buffer():
+    """
+    Returns the buffer that edits are saved through, configured by
+    WIKI_WRITE_BUFFER_WINDOW, WIKI_WRITE_RATE_PER_TITLE and
+    WIKI_WRITE_RATE_GLOBAL, or None if none of them is set.
     """
-    filename = f"entries/{title}.md"
-    if default_storage.exists(filename):
-        default_storage.delete(filename)
-    default_storage.save(filename, ContentFile(content))
+    config = (
+        getattr(settings, "WIKI_WRITE_BUFFER_WINDOW", 0),
+        getattr(settings, "WIKI_WRITE_RATE_PER_TITLE", None),
+        getattr(settings, "WIKI_WRITE_RATE_GLOBAL", None),
+    )
+    if not any(config):
+        return None
+    with _write_buffers_lock:
+        buffer = _write_buffers.get(config)
+        if buffer is None:
+            buffer = _write_buffers[config] = WriteBuffer(save_entry_revisions, entry_revision, *config)
+            # Edits still buffered when the process exits are saved
+            atexit.register(buffer.flush)
+        return buffer
+
+
+def edit_entry(title, content, base_revision=None):
+    """
+    Saves an edit of an encyclopedia entry like save_entry, through the
+    write buffer if there is one, in which case the entry is saved once
+    its window has passed. Raises RateLimited if the entry or the wiki
+    is edited too often. Returns the new revision number, if the store
+    keeps revisions.
+    """
+    buffer = get_write_buffer()
+    if buffer is None:
+        return save_entry(title, content, base_revision=base_revision)
+    return buffer.submit(title, content, base_revision)
+
+
+def latest_edit(title):
+    """
+    Returns the (content, revision) that an edit of an entry starts from:
+    its latest edit still in the write buffer, or else what is saved.
+    """
+    buffer = get_write_buffer()
+    pending = buffer.pending(title) if buffer is not None else None
+    if pending is not None:
+        return pending
+    return get_entry(title), entry_revision(title)
+
+
+def warm_entry(title):
+    """
+    Renders the stored version of an entry into the render cache, and
+    into the store if it keeps the HTML, unless it is already there.
+    """
+    version = entry_version(title)
+    if version is None or _cached_html(title, version) is not None:
+        return
+    content = get_entry(title)
+    if content is None:
+        return
+
+    renderer = get_renderer()
+    with phase("markdown"):
+        html = renderer.render(content)
+    render_cache.set(title, _render_version(version, renderer), html)
+    store = get_store()
+    if store.stores_html:
+        with phase("storage"):
+            store.save_rendered(title, version, renderer.key, html)
+
+
+_title_indexes = {}
+_title_indexes_lock = threading.Lock()
+
+
+def get_titles():
+    """
+    Returns the index of normalized entry titles of the entry store.
+    """
+    store = get_store()
+    key = (store, store.location)
+    with _title_indexes_lock:
+        index = _title_indexes.get(key)
+        if index is None:
+            index = _title_indexes[key] = TitleIndex(
+                store, cache_size=getattr(settings, "WIKI_SUGGEST_CACHE_SIZE", 1024))
+        return index
+
+
+def resolve_title(title):
+    """
+    Returns the name of the encyclopedia entry a title refers to,
+    ignoring case, Unicode normalization form and underscores versus
+    spaces, or None if there is no such entry.
+    """
+    return get_titles().resolve(title)
+
+
+def suggest_titles(prefix, limit=None):
+    """
+    Returns up to limit (WIKI_SUGGEST_LIMIT by default) entry titles
+    starting with prefix, ignoring case as resolve_title does.
+    """
+    if limit is None:
+        limit = getattr(settings, "WIKI_SUGGEST_LIMIT", 10)
+    return get_titles().complete(prefix, limit)
 
 
 def get_entry(title):
@@ -30,8 +335,384 @@ def get_entry(title):
     Retrieves an encyclopedia entry by its title. If no such
     entry exists, the function returns None.
     """
-    try:
-        f = default_storage.open(f"entries/{title}.md")
-        return f.read().decode("utf-8")
-    except FileNotFoundError:
+    with phase("storage"):
+        return get_store().get(title)
+
+
+def entry_version(title):
+    """
+    Returns a string identifying the stored version of an entry, such as
+    the file's modification time and size, without reading it. Returns
+    None if the entry does not exist or the store cannot tell cheaply.
+    """
+    with phase("storage"):
+        return get_store().version(title)
+
+
+def entry_modified(title):
+    """
+    Returns when an entry was last saved, as an aware datetime, or None
+    if it does not exist or the store cannot tell.
+    """
+    with phase("storage"):
+        return get_store().modified(title)
+
+
+def entry_size(title):
+    """
+    Returns the size in bytes of an entry's Markdown content, or None if
+    it does not exist.
+    """
+    with phase("storage"):
+        return get_store().size(title)
+
+
+def entry_revision(title):
+    """
+    Returns the latest revision number of an entry, 0 if it has none
+    yet, or None if the entry store does not keep revisions.
+    """
+    with phase("storage"):
+        return get_store().revision(title)
+
+
+def render_entry(title):
+    """
+    Returns an encyclopedia entry converted to HTML, served from the
+    render cache when the stored version has not changed. If no such
+    entry exists, the function returns None.
+    """
+    _wait_for_render(title)
+    version = entry_version(title)
+    html = _cached_html(title, version)
+    if html is not None:
+        return html
+
+    content = get_entry(title)
+    if content is None:
         return None
+
+    if version is None:
+        version = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        html = render_cache.get(title, _render_version(version))
+        if html is not None:
+            return html
+
+    renderer = get_renderer()
+    with phase("markdown"):
+        html = renderer.render(content)
+    render_cache.set(title, _render_version(version, renderer), html)
+    return html
+
+
+def render_entry_chunks(title):
+    """
+    Returns an iterator over the HTML of an encyclopedia entry in pieces,
+    reading and rendering long entries a section of WIKI_RENDER_CHUNK_SIZE
+    characters at a time, or None if no such entry exists. The whole HTML
+    is cached once the iterator is exhausted.
+    """
+    _wait_for_render(title)
+    version = entry_version(title)
+    if version is None:
+        html = render_entry(title)
+        return iter([html]) if html is not None else None
+
+    html = _cached_html(title, version)
+    if html is not None:
+        return iter([html])
+
+    with phase("storage"):
+        lines = get_store().lines(title)
+    if lines is None:
+        return None
+    return _render_chunks(title, version, lines)
+
+
+def _wait_for_render(title):
+    # An entry the render queue is rendering is not rendered twice
+    queue = get_render_queue()
+    if queue is not None:
+        queue.wait(title)
+
+
+def _render_chunks(title, version, lines):
+    renderer = get_renderer()
+    chunks = renderer.render_chunks(lines, getattr(settings, "WIKI_RENDER_CHUNK_SIZE", 64 * 1024))
+    pieces, size = [], 0
+    while True:
+        with phase("markdown"):
+            piece = next(chunks, None)
+        if piece is None:
+            break
+        # Stop keeping the pieces once they could not be cached anyway
+        size += len(piece)
+        if pieces is not None and size <= render_cache.max_bytes:
+            pieces.append(piece)
+        else:
+            pieces = None
+        yield piece
+    if pieces is not None:
+        render_cache.set(title, _render_version(version, renderer), "".join(pieces))
+
+
+def _render_version(version, renderer=None):
+    # HTML is cached per stored version and per renderer, so that changing
+    # WIKI_MARKDOWN_RENDERER does not serve HTML from the previous one
+    return f"{version}/{(renderer or get_renderer()).key}"
+
+
+def _cached_html(title, version):
+    """
+    Returns the HTML of the given stored version of an entry from the
+    render cache or the store, or None. HTML kept by the store is only
+    used if the current renderer produced it.
+    """
+    if version is None:
+        return None
+    renderer = get_renderer()
+    html = render_cache.get(title, _render_version(version, renderer))
+    if html is not None:
+        return html
+    with phase("storage"):
+        rendered = get_store().rendered(title)
+    if rendered is not None and rendered[:2] == (version, renderer.key):
+        render_cache.set(title, _render_version(version, renderer), rendered[2])
+        return rendered[2]
+    return None
+
+
+_searches = {}
+_searches_lock = threading.Lock()
+
+
+def get_search():
+    """
+    Returns the full-text search over the entry store. The index is
+    persisted to WIKI_SEARCH_INDEX_FILE, relative to the store's local
+    directory, if it has one.
+    """
+    store = get_store()
+    key = (store, store.location)
+    with _searches_lock:
+        search = _searches.get(key)
+        if search is None:
+            path = None
+            filename = getattr(settings, "WIKI_SEARCH_INDEX_FILE", "search.idx")
+            if filename and store.location is not None:
+                path = os.path.join(store.location, filename)
+            search = _searches[key] = EntrySearch(store, get_entry, entry_version, path)
+        return search
+
+
+_link_graphs = {}
+_link_graphs_lock = threading.Lock()
+
+
+def get_links():
+    """
+    Returns the graph of links between the entries of the entry store.
+    """
+    store = get_store()
+    key = (store, store.location)
+    with _link_graphs_lock:
+        graph = _link_graphs.get(key)
+        if graph is None:
+            graph = _link_graphs[key] = LinkGraph(store, get_entry, resolve_title)
+        return graph
+
+
+def backlinks(title):
+    """
+    Returns the sorted names of the encyclopedia entries that link to
+    an entry, under any title that resolves to it.
+    """
+    return get_links().backlinks(title)
+
+
+def broken_links():
+    """
+    Returns a sorted list of (entry, missing entry) pairs for the links
+    to entries that do not exist, even under another case or spelling.
+    """
+    return get_links().broken()
+
+
+def sync_caches():
+    """
+    Drops what this process cached about the entries other processes
+    saved, as published on the cache bus (WIKI_CACHE_BUS), at most once
+    every WIKI_CACHE_BUS_POLL_INTERVAL seconds.
+    """
+    bus = get_bus()
+    if bus is None:
+        return
+    titles = bus.poll()
+    if titles is None:
+        clear_caches()
+        return
+    for title in titles:
+        forget_entry(title)
+
+
+def forget_entry(title):
+    """
+    Drops what this process cached about an entry saved elsewhere.
+    """
+    store = get_store()
+    store.invalidate(title)
+    render_cache.delete(title)
+    content = get_entry(title)
+    get_links().update(title, content)
+    if content is not None:
+        get_titles().add(title)
+
+
+def clear_caches():
+    """
+    Drops everything this process cached about the entries.
+    """
+    store = get_store()
+    store.invalidate()
+    render_cache.clear()
+    key = (store, store.location)
+    with _link_graphs_lock:
+        _link_graphs.pop(key, None)
+    with _title_indexes_lock:
+        _title_indexes.pop(key, None)
+
+
+class SearchResults:
+    """
+    Sequence of the entries matching a search, best match first, as
+    dicts with the entry's "title" and an HTML "snippet" highlighting the
+    matched words. Entries are only read to build the snippets of the
+    slices asked for, so that a Paginator over it reads one page of
+    entries per request.
+    """
+
+    def __init__(self, query, titles):
+        self.query = query
+        self.titles = titles
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [result for result in map(self._result, self.titles[index]) if result is not None]
+        return self._result(self.titles[index])
+
+    def _result(self, title):
+        content = get_entry(title)
+        if content is None:
+            return None
+        return {"title": title, "snippet": snippet(content, self.query)}
+
+
+def search_entries(query, limit=None):
+    """
+    Returns the entries whose title or content match the query as
+    SearchResults.
+    """
+    if limit is None:
+        limit = getattr(settings, "WIKI_SEARCH_RESULTS_LIMIT", 50)
+    with phase("search"):
+        titles = [title for title, _ in get_search().index().search(query, limit)]
+    return SearchResults(query, titles)
+
+
+# Async variants, for the views in async_views. Blocking entry I/O runs in
+# a dedicated pool of WIKI_ASYNC_IO_WORKERS threads, which also bounds how
+# many reads hit the disk at once.
+
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
+
+def _get_io_executor():
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "WIKI_ASYNC_IO_WORKERS", 16),
+                thread_name_prefix="entry-io")
+        return _io_executor
+
+
+async def run_io(func, *args, **kwargs):
+    """
+    Runs a blocking function in the entry I/O thread pool, in a copy of
+    the current context so that it is timed as part of the request.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_io_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+async def alist_entries(offset=0, limit=None):
+    return await run_io(list_entries, offset, limit)
+
+
+async def alist_entries_after(title, limit):
+    return await run_io(list_entries_after, title, limit)
+
+
+async def acount_entries():
+    return await run_io(count_entries)
+
+
+async def arandom_entry(exclude=()):
+    return await run_io(random_entry, exclude)
+
+
+async def asave_entry(title, content, base_revision=None):
+    return await run_io(save_entry, title, content, base_revision)
+
+
+async def aedit_entry(title, content, base_revision=None):
+    return await run_io(edit_entry, title, content, base_revision)
+
+
+async def alatest_edit(title):
+    return await run_io(latest_edit, title)
+
+
+async def aresolve_title(title):
+    return await run_io(resolve_title, title)
+
+
+async def asuggest_titles(prefix, limit=None):
+    return await run_io(suggest_titles, prefix, limit)
+
+
+async def aget_entry(title):
+    return await run_io(get_entry, title)
+
+
+async def aentry_version(title):
+    return await run_io(entry_version, title)
+
+
+async def aentry_modified(title):
+    return await run_io(entry_modified, title)
+
+
+async def aentry_size(title):
+    return await run_io(entry_size, title)
+
+
+async def abacklinks(title):
+    return await run_io(backlinks, title)
+
+
+async def aentry_revision(title):
+    return await run_io(entry_revision, title)
+
+
+async def arender_entry(title):
+    return await run_io(render_entry, title)
+
+
+async def asearch_entries(query, limit=None):
+    return await run_io(search_entries, query, limit)
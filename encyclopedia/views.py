@@ -1,27 +1,141 @@
+import itertools
+import json
+import math
+import zlib
+
+from django.conf import settings
 from django.core.paginator import Paginator
-from django.shortcuts import render, redirect
-import markdown2
-import random as rand
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.shortcuts import render as render_template
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
 
-from . import util
+from . import compression, instrumentation, util
 from .forms import EditEntryForm, NewEntryForm
+from .renderers import get_renderer
+
+def render(request, template_name, context=None, status=None):
+    # Timed as the template phase of the request
+    with instrumentation.phase("template"):
+        return render_template(request, template_name, context, status=status)
 
 def index(request):
-    paginator = Paginator(util.list_entries(), 10)
+    # Cursor pagination, stable while entries are being added
+    after = request.GET.get('after')
+    if after is not None:
+        entries = util.list_entries_after(after, 11)
+        return render(request, "encyclopedia/index.html", {
+            "entries": entries[:10],
+            "next_cursor": entries[9] if len(entries) > 10 else None
+        })
+
+    paginator = Paginator(util.EntryListing(), 10)
     page_num = request.GET.get('page')
     page_obj = paginator.get_page(page_num)
 
     return render(request, "encyclopedia/index.html", {
-        "entries": page_obj
+        "entries": page_obj,
+        "page_range": paginator.get_elided_page_range(page_obj.number)
     })
 
-def entry(request, title):
-    entry = util.get_entry(title)
-    if (entry):
-        return render(request, "encyclopedia/entry.html", {
+# Stands in for the content when rendering entry.html around a streamed entry
+ENTRY_CONTENT_MARKER = "<!-- entry content -->"
+
+def entry_page_parts(request, title, backlinks, version):
+    # The entry page's HTML before and after the entry's content, cached
+    # apart from the fragments of whole pages of the same version
+    fragment_version = rendered_page_version(version)
+    with instrumentation.phase("template"):
+        page = render_to_string("encyclopedia/entry.html", {
             "title": title,
-            "content": markdown2.markdown(util.get_entry(title))
-        })
+            "content": ENTRY_CONTENT_MARKER,
+            "backlinks": backlinks,
+            "fragment_version": f"{fragment_version}/streamed" if fragment_version is not None else None
+        }, request)
+    return page.split(ENTRY_CONTENT_MARKER, 1)
+
+def should_stream(size):
+    threshold = getattr(settings, "WIKI_STREAM_ENTRIES_OVER", None)
+    return threshold is not None and size is not None and size >= threshold
+
+def page_version(version, backlinks):
+    # The entry page also changes when the entries linking to it do
+    if version is None:
+        return None
+    return f"{version}-{zlib.crc32(json.dumps(backlinks).encode('utf-8')):08x}"
+
+def rendered_page_version(version):
+    # Rendered pages also change with the Markdown renderer
+    return f"{version}/{get_renderer().key}" if version is not None else None
+
+def cached_entry_page(title, version, encoding):
+    # The entry page as compressed for an earlier request, or None
+    if version is None or encoding is None:
+        return None
+    body = compression.page_cache.get(f"{title}/{encoding}", rendered_page_version(version))
+    return compressed_response(body, version, encoding) if body is not None else None
+
+def compress_entry_page(response, title, version, encoding):
+    # Compresses the entry page once per version for each content coding
+    if version is None or encoding is None:
+        return response
+    body = compression.compress(response.content, encoding)
+    compression.page_cache.set(f"{title}/{encoding}", rendered_page_version(version), body)
+    return compressed_response(body, version, encoding, response["Content-Type"])
+
+def compressed_response(body, version, encoding, content_type=None):
+    response = HttpResponse(body, content_type=content_type)
+    response["Content-Encoding"] = encoding
+    # Weak, as the coding changes the bytes but not the page
+    response["ETag"] = "W/" + quote_etag(rendered_page_version(version))
+    return response
+
+def entry_etag(request, title):
+    # The same version as the cached and compressed pages
+    return rendered_page_version(page_version(util.entry_version(title), util.backlinks(title)))
+
+def entry_last_modified(request, title):
+    return util.entry_modified(title)
+
+@condition(etag_func=entry_etag, last_modified_func=entry_last_modified)
+def entry(request, title):
+    # Other spellings of an entry's title redirect to it
+    canonical = util.resolve_title(title)
+    if canonical is not None and canonical != title:
+        return redirect("entry", canonical, permanent=True)
+
+    # Large entries are sent while they are read and rendered
+    if should_stream(util.entry_size(title)):
+        chunks = util.render_entry_chunks(title)
+        if chunks is not None:
+            backlinks = util.backlinks(title)
+            head, tail = entry_page_parts(
+                request, title, backlinks, page_version(util.entry_version(title), backlinks))
+            response = StreamingHttpResponse(itertools.chain([head], chunks, [tail]))
+            patch_cache_control(response, **getattr(settings, "WIKI_ENTRY_CACHE_CONTROL", {}))
+            return response
+
+    # Pages are compressed once per version and sent as compressed
+    backlinks = util.backlinks(title)
+    version = page_version(util.entry_version(title), backlinks)
+    encoding = compression.choose_encoding(request.headers.get("Accept-Encoding", ""))
+    response = cached_entry_page(title, version, encoding)
+    if response is None:
+        content = util.render_entry(title)
+        if (content):
+            response = compress_entry_page(render(request, "encyclopedia/entry.html", {
+                "title": title,
+                "content": content,
+                "backlinks": backlinks,
+                "fragment_version": rendered_page_version(version)
+            }), title, version, encoding)
+    if response is not None:
+        patch_vary_headers(response, ["Accept-Encoding"])
+        patch_cache_control(response, **getattr(settings, "WIKI_ENTRY_CACHE_CONTROL", {}))
+        return response
     else:
         return render(request, "encyclopedia/error.html", {
             "title": title,
@@ -35,7 +149,7 @@ def create(request):
             title = form.cleaned_data["title"]
             content = form.cleaned_data["content"]
 
-            if (util.get_entry(title)):
+            if (util.resolve_title(title)):
                 return render(request, "encyclopedia/create.html", {
                     "message": "Entry with Title Already Exists!",
                     "form": form
@@ -58,7 +172,20 @@ def edit(request, title):
         form = EditEntryForm(request.POST)
         if form.is_valid():
             content = form.cleaned_data["content"]
-            util.save_entry(title, content)
+            try:
+                util.edit_entry(title, content, base_revision=form.cleaned_data["revision"])
+            except util.RateLimited as error:
+                return rate_limited_edit(request, title, form, error)
+            except util.EditConflict:
+                # Keep the user's text but base it on the latest revision, so
+                # submitting again knowingly replaces the other change
+                data = request.POST.copy()
+                data["revision"] = util.latest_edit(title)[1]
+                return render(request, "encyclopedia/edit.html", {
+                    'title': title,
+                    'message': "This entry was changed while you were editing it. Review the latest version before saving again.",
+                    'form': EditEntryForm(data)
+                }, status=409)
             return redirect("entry", title)
         else:
             return render(request, "encyclopedia/edit.html", {
@@ -66,34 +193,84 @@ def edit(request, title):
                 'form': form
             })
             
+    content, revision = util.latest_edit(title)
     return render(request, "encyclopedia/edit.html", {
             "title": title,
-            "form": EditEntryForm(initial={"title": title, "content": util.get_entry(title)})
+            "form": EditEntryForm(initial={
+                "title": title,
+                "content": content,
+                "revision": revision
+            })
         })
 
-def search(request):
-    entries = util.list_entries()
-    lowercase_entries = [entry.lower() for entry in entries]
+def rate_limited_edit(request, title, form, error):
+    # The edit form again, with the user's text, until they may save
+    response = render(request, "encyclopedia/edit.html", {
+        'title': title,
+        'message': f"This entry is being edited too often. Try saving again in {math.ceil(error.retry_after)} seconds.",
+        'form': form
+    }, status=429)
+    response["Retry-After"] = str(math.ceil(error.retry_after))
+    return response
 
+def search(request):
     query = request.GET.get("q", "")
-    lowercase_query = query.lower()
     
-    if (query in entries):
-        return redirect("entry", lowercase_query)
+    title = util.resolve_title(query)
+    if (title):
+        return redirect("entry", title)
 
-    results = []
-    for i in range(len(entries)):
-        if (lowercase_query in lowercase_entries[i]):
-            results.append(entries[i])
+    # Snippets are only built for the page shown
+    paginator = Paginator(util.search_entries(query), 10)
+    page_num = request.GET.get('page')
+    page_obj = paginator.get_page(page_num)
 
     return render(request, "encyclopedia/searchResults.html", {
         "query": query,
-        "no_results": not results,
-        "entries": results
+        "no_results": not paginator.count,
+        "entries": page_obj,
+        "page_range": paginator.get_elided_page_range(page_obj.number)
     })
 
+def suggest_limit(request):
+    # The number of titles asked for, capped at WIKI_SUGGEST_LIMIT
+    limit = getattr(settings, "WIKI_SUGGEST_LIMIT", 10)
+    try:
+        return max(1, min(int(request.GET["limit"]), limit))
+    except (KeyError, ValueError):
+        return limit
+
+def suggest_response(query, titles):
+    response = JsonResponse({"query": query, "titles": titles})
+    patch_cache_control(response, **getattr(settings, "WIKI_SUGGEST_CACHE_CONTROL", {}))
+    return response
+
+def suggest(request):
+    query = request.GET.get("q", "")
+    return suggest_response(query, util.suggest_titles(query, suggest_limit(request)))
+
 def random(request):
-    entries = util.list_entries()
-    entry = rand.choice(entries)
+    # Avoid the entries this session was recently sent to, if enabled
+    history = getattr(settings, "WIKI_RANDOM_HISTORY", 0)
+    recent = request.session.get("recent_random", []) if history else []
+
+    entry = util.random_entry(exclude=recent)
+    if entry is None:
+        return redirect("index")
+
+    if history:
+        request.session["recent_random"] = (recent + [entry])[-history:]
+    return redirect("entry", entry)
 
-    return redirect("entry", entry)
\ No newline at end of file
+def metrics(request):
+    # Phase timing histograms of this process, for Prometheus to scrape
+    if not getattr(settings, "WIKI_INSTRUMENTATION", False):
+        raise Http404
+    body = instrumentation.export()
+    queue = util.get_render_queue()
+    if queue is not None:
+        body += queue.export()
+    buffer = util.get_write_buffer()
+    if buffer is not None:
+        body += buffer.export()
+    return HttpResponse(body, content_type="text/plain; version=0.0.4")
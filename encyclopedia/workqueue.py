@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .instrumentation import BUCKETS, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueue:
+    """
+    Queue of entry titles handled by a pool of background threads, used
+    to render entries ahead of their first view after a save.
+
+    A title saved again while it waits is only handled once, and titles
+    queued beyond max_pending are dropped rather than holding up the
+    savers: those entries are then rendered on their first view instead.
+    """
+
+    COUNTERS = ("enqueued", "coalesced", "dropped", "completed", "failed")
+
+    def __init__(self, handler, workers=1, max_pending=1000):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.wait_time = Histogram()
+        self._pending = OrderedDict()
+        self._running = {}
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def enqueue(self, title):
+        """
+        Queues a title, unless it is already waiting or the queue is full.
+        """
+        with self._condition:
+            if title in self._pending:
+                self.counts["coalesced"] += 1
+                return
+            if len(self._pending) >= self.max_pending:
+                self.counts["dropped"] += 1
+                return
+            self.counts["enqueued"] += 1
+            self._pending[title] = time.monotonic()
+            self._condition.notify_all()
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"render-queue-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def wait(self, title, timeout=None):
+        """
+        Waits until a title being handled is done, so that its rendering
+        is not repeated by the caller.
+        """
+        with self._condition:
+            done = self._running.get(title)
+        if done is not None:
+            done.wait(timeout)
+
+    def join(self):
+        """
+        Waits until every queued title has been handled.
+        """
+        with self._condition:
+            while self._pending or self._running:
+                self._condition.wait()
+
+    def depth(self):
+        """
+        Returns the number of titles waiting and the age in seconds of the
+        oldest one.
+        """
+        with self._condition:
+            if not self._pending:
+                return 0, 0.0
+            return len(self._pending), time.monotonic() - next(iter(self._pending.values()))
+
+    def export(self):
+        """
+        Returns the queue's backpressure metrics in the Prometheus text
+        exposition format.
+        """
+        depth, age = self.depth()
+        with self._condition:
+            counts = dict(self.counts)
+        lines = [
+            "# HELP wiki_render_queue_depth Entries waiting to be rendered.",
+            "# TYPE wiki_render_queue_depth gauge",
+            f"wiki_render_queue_depth {depth}",
+            "# HELP wiki_render_queue_oldest_seconds Time the oldest waiting entry has waited.",
+            "# TYPE wiki_render_queue_oldest_seconds gauge",
+            f"wiki_render_queue_oldest_seconds {age}",
+            "# HELP wiki_render_queue_entries_total Entries saved, by what the render queue did with them.",
+            "# TYPE wiki_render_queue_entries_total counter",
+        ]
+        lines.extend(f'wiki_render_queue_entries_total{{result="{name}"}} {count}' for name, count in counts.items())
+        lines += [
+            "# HELP wiki_render_queue_wait_seconds Time entries waited before being rendered.",
+            "# TYPE wiki_render_queue_wait_seconds histogram",
+        ]
+        counts, total = self.wait_time.snapshot()
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'wiki_render_queue_wait_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"wiki_render_queue_wait_seconds_sum {total}")
+        lines.append(f"wiki_render_queue_wait_seconds_count {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def _work(self):
+        while True:
+            with self._condition:
+                # A title saved again while being handled waits its turn
+                while (title := self._next()) is None:
+                    self._condition.wait()
+                queued_at = self._pending.pop(title)
+                done = self._running[title] = threading.Event()
+            self.wait_time.observe(time.monotonic() - queued_at)
+            result = "completed"
+            try:
+                self.handler(title)
+            except Exception:
+                logger.exception("Could not render %s", title)
+                result = "failed"
+            finally:
+                with self._condition:
+                    del self._running[title]
+                    self.counts[result] += 1
+                    self._condition.notify_all()
+                done.set()
+
+    def _next(self):
+        return next((title for title in self._pending if title not in self._running), None)
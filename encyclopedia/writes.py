@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+
+from .revisions import EditConflict
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """
+    Raised when an edit is refused because too many were made recently.
+    """
+
+    def __init__(self, title, retry_after):
+        super().__init__(f"Too many edits, retry {title} in {retry_after:.0f}s")
+        self.title = title
+        self.retry_after = retry_after
+
+
+class RateLimit:
+    """
+    Token buckets allowing rate edits per minute and per key, in bursts
+    of up to rate edits, or of one edit for rates below one per minute.
+    Keys whose bucket has filled up again are forgotten.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self._buckets = {}
+
+    def take(self, key, now):
+        """
+        Takes a token for key and returns 0, or returns the seconds until
+        one is available without taking it.
+        """
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate / 60)
+        if tokens < 1:
+            return (1 - tokens) * 60 / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > 1024:
+            self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * self.rate / 60 >= self.capacity:
+                del self._buckets[key]
+
+
+class WriteBuffer:
+    """
+    Buffers the edits of each entry for window seconds, then hands them
+    to save(title, contents, base_revision) together, so that an entry
+    edited many times in a row is only written, rendered and invalidated
+    once. revision(title) returns the latest saved revision of an entry,
+    which edits are checked against like saves are.
+
+    Edits beyond title_rate per entry or global_rate overall per minute
+    raise RateLimited. Buffers and limits are per process.
+    """
+
+    COUNTERS = ("submitted", "coalesced", "limited", "saved", "failed")
+
+    def __init__(self, save, revision, window=1.0, title_rate=None, global_rate=None):
+        self.save = save
+        self.revision = revision
+        self.window = window
+        self.title_limit = RateLimit(title_rate) if title_rate else None
+        self.global_limit = RateLimit(global_rate) if global_rate else None
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self._pending = {}
+        self._saving = {}
+        self._thread = None
+        self._condition = threading.Condition()
+
+    def submit(self, title, content, base_revision=None):
+        """
+        Buffers an edit and returns the revision it will have once saved,
+        if the store keeps revisions. Raises EditConflict if base_revision
+        is not the latest revision, counting buffered edits, and
+        RateLimited if too many edits were made.
+        """
+        with self._condition:
+            if self.window > 0:
+                return self._buffer(title, content, base_revision)
+            self._check_limits(title)
+            self.counts["submitted"] += 1
+
+        # Without a window edits are saved right away, conflicts included
+        revision = self.save(title, [content], base_revision)
+        with self._condition:
+            self.counts["saved"] += 1
+        return revision
+
+    def pending(self, title):
+        """
+        Returns the (content, revision) of the latest buffered edit of an
+        entry, or None.
+        """
+        with self._condition:
+            edits = self._pending.get(title) or self._saving.get(title)
+            if edits is None:
+                return None
+            return edits["contents"][-1], edits["revision"]
+
+    def flush(self):
+        """
+        Saves every buffered edit now.
+        """
+        with self._condition:
+            pending, self._pending = self._pending, {}
+            self._saving.update(pending)
+        for title, edits in pending.items():
+            self._save(title, edits)
+
+    def export(self):
+        """
+        Returns the buffer's counters in the Prometheus text exposition
+        format.
+        """
+        with self._condition:
+            counts = dict(self.counts)
+            depth = len(self._pending)
+        lines = [
+            "# HELP wiki_write_buffer_entries Entries with edits waiting to be saved.",
+            "# TYPE wiki_write_buffer_entries gauge",
+            f"wiki_write_buffer_entries {depth}",
+            "# HELP wiki_write_buffer_edits_total Edits, by what the write buffer did with them.",
+            "# TYPE wiki_write_buffer_edits_total counter",
+        ]
+        lines.extend(f'wiki_write_buffer_edits_total{{result="{name}"}} {count}' for name, count in counts.items())
+        return "\n".join(lines) + "\n"
+
+    def _buffer(self, title, content, base_revision):
+        # Edits being saved are the base of the next ones
+        pending = self._pending.get(title)
+        current = pending or self._saving.get(title)
+        head = current["revision"] if current is not None else self.revision(title)
+        if base_revision is not None and head is not None and base_revision != head:
+            raise EditConflict(title, base_revision)
+        self._check_limits(title)
+
+        self.counts["submitted"] += 1
+        revision = head + 1 if head is not None else None
+        if pending is not None:
+            self.counts["coalesced"] += 1
+            pending["contents"].append(content)
+            pending["revision"] = revision
+            return revision
+        self._pending[title] = {
+            "contents": [content],
+            "base_revision": head,
+            "revision": revision,
+            "due": time.monotonic() + self.window,
+        }
+        self._condition.notify_all()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="write-buffer", daemon=True)
+            self._thread.start()
+        return revision
+
+    def _check_limits(self, title):
+        now = time.monotonic()
+        for limit, key in ((self.title_limit, title), (self.global_limit, None)):
+            wait = limit.take(key, now) if limit is not None else 0
+            if wait:
+                self.counts["limited"] += 1
+                raise RateLimited(title, wait)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                title, edits = min(self._pending.items(), key=lambda item: item[1]["due"])
+                delay = edits["due"] - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                self._saving[title] = self._pending.pop(title)
+            self._save(title, edits)
+
+    def _save(self, title, edits):
+        contents = edits["contents"]
+        try:
+            try:
+                self.save(title, contents, edits["base_revision"])
+            except EditConflict:
+                # Saved by another process during the window: the buffered
+                # edits were accepted, so they are kept as later revisions
+                logger.warning("%s was saved elsewhere while %d edits were buffered", title, len(contents))
+                self.save(title, contents, None)
+        except Exception:
+            logger.exception("Could not save %d edits of %s", len(contents), title)
+            result = "failed"
+        else:
+            result = "saved"
+        with self._condition:
+            self.counts[result] += len(contents)
+            if self._saving.get(title) is edits:
+                del self._saving[title]
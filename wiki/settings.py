@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'encyclopedia.middleware.InstrumentationMiddleware',
+    'encyclopedia.middleware.CacheBusMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +58,6 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -64,6 +65,13 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Templates are compiled once per process and reused
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -119,3 +127,167 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# collectstatic also writes gzip and brotli compressed copies of text
+# files, for the web server to send as they are (e.g. nginx gzip_static).
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'encyclopedia.staticfiles.CompressedStaticFilesStorage',
+    },
+}
+
+
+# Encyclopedia
+
+# Where entries are stored. The default keeps one Markdown file per entry
+# in MEDIA_ROOT/entries. To keep them in a SQLite database instead use:
+# {
+#     'BACKEND': 'encyclopedia.stores.SQLiteEntryStore',
+#     'OPTIONS': {'path': os.path.join(BASE_DIR, 'entries.sqlite3')},
+# }
+# or, to pack them compressed into a few segment files, compacted with
+# `manage.py compact_entries`:
+# {
+#     'BACKEND': 'encyclopedia.stores.PackedEntryStore',
+#     'OPTIONS': {'path': os.path.join(BASE_DIR, 'packed')},
+# }
+WIKI_ENTRY_STORE = {
+    'BACKEND': 'encyclopedia.stores.FileSystemEntryStore',
+}
+
+# Seconds between checks of the entries/ directory for changes made
+# outside of util.save_entry.
+WIKI_CATALOG_POLL_INTERVAL = 1.0
+
+# Engine converting entries from Markdown to HTML, with options passed to
+# it. encyclopedia.renderers.CommonMarkRenderer is faster and requires
+# markdown-it-py. HTML stored by the SQLite store when entries are saved
+# is served until each entry is saved again after changing it.
+WIKI_MARKDOWN_RENDERER = {
+    'BACKEND': 'encyclopedia.renderers.Markdown2Renderer',
+    'OPTIONS': {},
+}
+
+# Characters of Markdown rendered at a time when an entry's HTML is
+# produced in pieces by util.render_entry_chunks.
+WIKI_RENDER_CHUNK_SIZE = 64 * 1024
+
+# Entries of at least this many bytes are streamed: the page is sent as
+# their Markdown is read and rendered, a WIKI_RENDER_CHUNK_SIZE section at
+# a time, instead of after rendering all of it. None disables streaming.
+WIKI_STREAM_ENTRIES_OVER = 256 * 1024
+
+# Upper bound, in bytes, of rendered entry HTML kept in each process.
+WIKI_RENDER_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Optional alias from CACHES used as a cache tier shared between processes.
+WIKI_RENDER_CACHE_ALIAS = None
+
+# Bus on which each process publishes the entries it saves, so that the
+# others drop their cached HTML, listings and links for them. It is read
+# before requests, at most once every WIKI_CACHE_BUS_POLL_INTERVAL
+# seconds. Processes sharing a filesystem can use a SQLite database, kept
+# in MEDIA_ROOT unless given a path:
+# {
+#     'BACKEND': 'encyclopedia.bus.SQLiteTransport',
+#     'OPTIONS': {},
+# }
+# For several hosts use a Redis server (requires the redis package):
+# {
+#     'BACKEND': 'encyclopedia.bus.RedisTransport',
+#     'OPTIONS': {'url': 'redis://localhost:6379/0'},
+# }
+# None disables the bus, for a single process.
+WIKI_CACHE_BUS = None
+WIKI_CACHE_BUS_POLL_INTERVAL = 0.1
+
+# Upper bound, in bytes, of the rendered template fragments (the layout's
+# head and sidebar, and the body of each entry page) kept in each process.
+WIKI_FRAGMENT_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Content codings entry pages are sent with, in order of preference,
+# when clients accept them. Each page is compressed once per version and
+# coding, and kept in a cache of up to WIKI_COMPRESSED_PAGE_CACHE_MAX_BYTES
+# per process. "br" requires the brotli package.
+WIKI_COMPRESSION_ENCODINGS = ['br', 'gzip']
+WIKI_COMPRESSED_PAGE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# Render entries into the cache as soon as they are saved.
+WIKI_RENDER_CACHE_PREWARM = True
+
+# Where saved entries are rendered: None while saving them, "thread" by
+# WIKI_RENDER_QUEUE_WORKERS background threads of each process, or
+# "worker" by `manage.py render_worker`, which reads the cache bus and
+# helps the web processes if WIKI_RENDER_CACHE_ALIAS is shared with it or
+# the store keeps the HTML. Entries saved while
+# WIKI_RENDER_QUEUE_MAX_PENDING others wait are rendered on first view.
+WIKI_RENDER_QUEUE = 'thread'
+WIKI_RENDER_QUEUE_WORKERS = 1
+WIKI_RENDER_QUEUE_MAX_PENDING = 1000
+
+# Edits of an entry are buffered for WIKI_WRITE_BUFFER_WINDOW seconds and
+# saved together: the latest is written, rendered and indexed once, and
+# the others are kept as revisions. Entry pages show the edits after the
+# window. Edits beyond WIKI_WRITE_RATE_PER_TITLE per entry or
+# WIKI_WRITE_RATE_GLOBAL overall per minute are refused with a 429
+# response. Buffers and limits are kept by each process; 0 and None turn
+# them off.
+WIKI_WRITE_BUFFER_WINDOW = 0
+WIKI_WRITE_RATE_PER_TITLE = None
+WIKI_WRITE_RATE_GLOBAL = None
+
+# Maximum number of ranked results of a search, shown 10 per page.
+WIKI_SEARCH_RESULTS_LIMIT = 50
+
+# Search index file, relative to MEDIA_ROOT, loaded with mmap at startup.
+# Set to None to keep the index in memory only.
+WIKI_SEARCH_INDEX_FILE = "search.idx"
+
+# Number of entries /random/ avoids repeating for each session, which
+# stores them in the session. 0 disables this.
+WIKI_RANDOM_HISTORY = 0
+
+# Cache-Control directives sent with entry pages, as keyword arguments to
+# django.utils.cache.patch_cache_control. Entry pages also carry an ETag
+# and Last-Modified header, so caches can revalidate them cheaply.
+WIKI_ENTRY_CACHE_CONTROL = {
+    'public': True,
+    'max_age': 0,
+    'must_revalidate': True,
+}
+
+# Most titles suggested as a title is typed into the search box, and how
+# many of the most recently asked prefixes keep their suggestions cached
+# in each process until an entry is added.
+WIKI_SUGGEST_LIMIT = 10
+WIKI_SUGGEST_CACHE_SIZE = 1024
+
+# Cache-Control directives sent with suggestions, so browsers and proxies
+# answer repeated prefixes themselves.
+WIKI_SUGGEST_CACHE_CONTROL = {
+    'public': True,
+    'max_age': 60,
+}
+
+# Base URLs of reverse proxies sent a PURGE request for an entry's page
+# whenever it is saved, e.g. ['http://127.0.0.1:6081/'].
+WIKI_PURGE_URLS = []
+
+# Serve the async views in encyclopedia/async_views.py, for running under
+# an ASGI server such as uvicorn. Entry I/O then runs in a pool of
+# WIKI_ASYNC_IO_WORKERS threads.
+WIKI_ASYNC_VIEWS = config('WIKI_ASYNC_VIEWS', default=False, cast=bool)
+WIKI_ASYNC_IO_WORKERS = 16
+
+# Time how long requests spend on entry storage, Markdown, search and
+# templates, returned in a Server-Timing header and served as Prometheus
+# histograms at /metrics/. A WIKI_PROFILE_SAMPLE_RATE fraction of requests
+# is also profiled, with cProfile dumps written to WIKI_PROFILE_DIR.
+WIKI_INSTRUMENTATION = config('WIKI_INSTRUMENTATION', default=False, cast=bool)
+WIKI_PROFILE_SAMPLE_RATE = 0.0
+WIKI_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')